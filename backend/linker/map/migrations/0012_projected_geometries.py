@@ -0,0 +1,85 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.gis.db.models.fields
+import django.contrib.gis.db.models.functions
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0011_weide_slotweide'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basis',
+            name='point_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('point', 31370),
+                output_field=django.contrib.gis.db.models.fields.PointField(srid=31370),
+            ),
+        ),
+        migrations.AddField(
+            model_name='fiche',
+            name='point_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('point', 31370),
+                output_field=django.contrib.gis.db.models.fields.PointField(srid=31370),
+            ),
+        ),
+        migrations.AddField(
+            model_name='forbiddenarea',
+            name='area_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('area', 31370),
+                output_field=django.contrib.gis.db.models.fields.MultiPolygonField(srid=31370),
+            ),
+        ),
+        migrations.AddField(
+            model_name='tocht',
+            name='route_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('route', 31370),
+                output_field=django.contrib.gis.db.models.fields.LineStringField(srid=31370),
+            ),
+        ),
+        migrations.AddField(
+            model_name='weide',
+            name='polygon_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('polygon', 31370),
+                output_field=django.contrib.gis.db.models.fields.PolygonField(srid=31370),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='basis',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['point_projected'], name='basis_point_projected_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='fiche',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['point_projected'], name='fiche_point_projected_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='forbiddenarea',
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=['area_projected'], name='forbidden_area_projected_gist'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='tocht',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['route_projected'], name='tocht_route_projected_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='weide',
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=['polygon_projected'], name='weide_polygon_projected_gist'
+            ),
+        ),
+    ]
@@ -3,10 +3,13 @@ from typing import cast
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Collect
-from django.contrib.gis.db.models.functions import Centroid
+from django.contrib.gis.db.models.functions import Centroid, Transform
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.indexes import GistIndex
 from django.core.validators import MinValueValidator
 
+from linker.tracing.constants import PROJECTED_SRID
+
 
 class Tocht(models.Model):
     identifier = models.CharField(max_length=2, unique=True)
@@ -15,15 +18,24 @@ class Tocht(models.Model):
     leads = models.ManyToManyField('people.OrganizationMember', blank=True)
 
     route = models.LineStringField()
+    route_projected = models.GeneratedField(
+        expression=Transform('route', PROJECTED_SRID),
+        output_field=models.LineStringField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [GistIndex(fields=['route_projected'], name='tocht_route_projected_gist')]
 
     def __str__(self) -> str:
         return self.identifier
 
     @classmethod
-    def centroid(cls) -> Point | None:
+    def centroid(cls, projected: bool = False) -> Point | None:
+        field = 'route_projected' if projected else 'route'
         return cast(
             Point | None,
-            cls.objects.filter(is_alternative=False).aggregate(centroid=Centroid(Collect('route')))['centroid'],
+            cls.objects.filter(is_alternative=False).aggregate(centroid=Centroid(Collect(field)))['centroid'],
         )
 
 
@@ -32,23 +44,45 @@ class Weide(models.Model):
     name = models.CharField(max_length=20)
     tocht = models.OneToOneField(Tocht, null=True, blank=True, on_delete=models.SET_NULL)
     polygon = models.PolygonField()
+    polygon_projected = models.GeneratedField(
+        expression=Transform('polygon', PROJECTED_SRID),
+        output_field=models.PolygonField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
     slotweide = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [GistIndex(fields=['polygon_projected'], name='weide_polygon_projected_gist')]
+
     def __str__(self) -> str:
         return f'Weide {self.identifier}'
 
 
 class Basis(models.Model):
     point = models.PointField()
+    point_projected = models.GeneratedField(
+        expression=Transform('point', PROJECTED_SRID),
+        output_field=models.PointField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [GistIndex(fields=['point_projected'], name='basis_point_projected_gist')]
 
 
 class Fiche(models.Model):
     order = models.IntegerField(validators=[MinValueValidator(1)])
     tocht = models.ForeignKey('Tocht', on_delete=models.CASCADE)
     point = models.PointField()
+    point_projected = models.GeneratedField(
+        expression=Transform('point', PROJECTED_SRID),
+        output_field=models.PointField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
 
     class Meta:
         unique_together = [['order', 'tocht']]
+        indexes = [GistIndex(fields=['point_projected'], name='fiche_point_projected_gist')]
 
     def __str__(self) -> str:
         return self.tocht.identifier + str(self.order)
@@ -74,8 +108,16 @@ class MapNote(models.Model):
 class ForbiddenArea(models.Model):
     description = models.TextField(blank=True)
     area = models.MultiPolygonField()
+    area_projected = models.GeneratedField(
+        expression=Transform('area', PROJECTED_SRID),
+        output_field=models.MultiPolygonField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
     route_allowed = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [GistIndex(fields=['area_projected'], name='forbidden_area_projected_gist')]
+
     def __str__(self) -> str:
         if not self.description:
             return super().__str__()
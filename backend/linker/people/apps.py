@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class PeopleConfig(AppConfig):
+    name = 'linker.people'
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401
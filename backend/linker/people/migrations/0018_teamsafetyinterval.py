@@ -0,0 +1,60 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import django.db.models.deletion
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+# A copy of the SQL in linker.people.safety, a migration must not change when the application code does
+FILL_TEAM_SAFETY_INTERVALS_SQL = """
+    INSERT INTO people_teamsafetyinterval (team_id, location, during)
+    SELECT team_id, location, during
+    FROM (
+        SELECT team_id,
+               location,
+               tstzrange(created, LEAD(created) OVER (PARTITION BY team_id ORDER BY created, id), '[)') AS during
+        FROM people_teamsafetylog
+    ) logs
+    WHERE location <> '' AND NOT isempty(during)
+"""
+
+
+def fill_team_safety_intervals(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FILL_TEAM_SAFETY_INTERVALS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0017_organizationmember_tracker_token'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.CreateModel(
+            name='TeamSafetyInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('during', django.contrib.postgres.fields.ranges.DateTimeRangeField()),
+                ('location', models.CharField(max_length=100)),
+                (
+                    'team',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='safety_intervals',
+                        to='people.team',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    django.contrib.postgres.constraints.ExclusionConstraint(
+                        expressions=[('team', '='), ('during', '&&')], name='teamsafetyinterval_no_overlap'
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_team_safety_intervals, migrations.RunPython.noop),
+    ]
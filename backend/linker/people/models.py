@@ -2,45 +2,63 @@ from secrets import token_urlsafe
 
 from django.contrib.auth.models import User
 from django.contrib.gis.measure import D
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
 from django.db import connection, models
-from django.db.models import OuterRef, Subquery
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from enumfields import EnumField
 
 from linker.map.models import Basis, Fiche, ForbiddenArea, Tocht, Weide
 from linker.people.constants import Direction, MemberType
 from linker.tracing.constants import FICHE_MAX_DISTANCE, GEBIED_MAX_DISTANCE, TOCHT_MAX_DISTANCE, WEIDE_MAX_DISTANCE
-from linker.trackers.models import Position, Tracker
+from linker.trackers.models import Tracker
+from linker.trackers.rollups import position_table_sql
 
 
 def _default_tracker_token():
     return token_urlsafe(32)
 
 
+class TrackerTokenMixin:
+    """Remembers the tracker token as loaded from the database, so its cache entry can be invalidated on change."""
+
+    loaded_tracker_token: str | None = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)  # type: ignore[misc]
+        instance.loaded_tracker_token = instance.__dict__.get('tracker_token')
+        return instance
+
+
 class LocationMixin:
     def with_last_location(self):
         return self.with_last_position_point().annotate(
             fiche=Subquery(
                 Fiche.objects.filter(
-                    point__distance_lte=(OuterRef('last_position_point'), D(m=FICHE_MAX_DISTANCE))
+                    point_projected__dwithin=(OuterRef('latest_position__point_projected'), D(m=FICHE_MAX_DISTANCE))
                 ).values('pk')[:1]
             ),
             nearest_tocht=Subquery(
                 Tocht.objects.filter(
-                    route__distance_lte=(OuterRef('last_position_point'), D(m=TOCHT_MAX_DISTANCE))
+                    route_projected__dwithin=(OuterRef('latest_position__point_projected'), D(m=TOCHT_MAX_DISTANCE))
                 ).values('pk')[:1]
             ),
             weide=Subquery(
                 Weide.objects.filter(
-                    polygon__distance_lte=(OuterRef('last_position_point'), D(m=WEIDE_MAX_DISTANCE))
+                    polygon_projected__dwithin=(OuterRef('latest_position__point_projected'), D(m=WEIDE_MAX_DISTANCE))
                 ).values('pk')[:1]
             ),
             basis=Subquery(
                 Basis.objects.filter(
-                    point__distance_lte=(OuterRef('last_position_point'), D(m=WEIDE_MAX_DISTANCE))
+                    point_projected__dwithin=(OuterRef('latest_position__point_projected'), D(m=WEIDE_MAX_DISTANCE))
                 ).values('pk')[:1]
             ),
             forbidden_area=Subquery(
-                ForbiddenArea.objects.filter(area__contains=OuterRef('last_position_point')).values('pk')[:1]
+                ForbiddenArea.objects.filter(
+                    area_projected__contains=OuterRef('latest_position__point_projected')
+                ).values('pk')[:1]
             ),
         )
 
@@ -60,29 +78,19 @@ class ContactPerson(models.Model):
 class OrganizationMemberQuerySet(LocationMixin, models.QuerySet):
     def with_last_position_point(self):
         return self.annotate(
-            last_position_point=Subquery(
-                Position.objects.filter(organization_member=OuterRef('pk')).order_by('-timestamp').values('point')[:1]
-            ),
+            last_position_point=F('latest_position__point'),
         )
 
     def with_last_position_timestamp(self):
         return self.annotate(
-            last_position_timestamp=Subquery(
-                Position.objects.filter(organization_member=OuterRef('pk'))
-                .order_by('-timestamp')
-                .values('timestamp')[:1]
-            )
+            last_position_timestamp=Coalesce('latest_position__end_timestamp', 'latest_position__timestamp')
         )
 
     def with_last_position_source(self):
-        return self.annotate(
-            last_position_source=Subquery(
-                Position.objects.filter(organization_member=OuterRef('pk')).order_by('-timestamp').values('source')[:1]
-            )
-        )
+        return self.annotate(last_position_source=F('latest_position__source'))
 
 
-class OrganizationMember(models.Model):
+class OrganizationMember(TrackerTokenMixin, models.Model):
     tracker = models.OneToOneField(Tracker, on_delete=models.SET_NULL, blank=True, null=True)
     name = models.CharField(max_length=100)
     code = models.CharField(max_length=5, help_text='De letters die op de kaart verschijnen')
@@ -95,16 +103,16 @@ class OrganizationMember(models.Model):
     def __str__(self) -> str:
         return f'{self.member_type.value.title()} - {self.name}'
 
-    def get_track_geojson(self) -> str:
-        tocht_centroid = Tocht.centroid()
+    def get_track_geojson(self, resolution: int | None = None) -> str:
+        tocht_centroid = Tocht.centroid(projected=True)
         tocht_centroid_ewkb = tocht_centroid.hexewkb.decode('utf-8') if tocht_centroid else None
         with connection.cursor() as cursor:
             cursor.execute(
-                """SELECT ST_AsGeoJSON(ST_MakeLine(trackers_position.point ORDER BY trackers_position.timestamp))
-                FROM trackers_position
+                f"""SELECT ST_AsGeoJSON(ST_MakeLine(p.point ORDER BY p.timestamp))
+                FROM {position_table_sql(resolution)} p
                 WHERE (
-                    trackers_position.organization_member_id = %s
-                    AND (%s IS NULL OR ST_DistanceSphere(trackers_position.point, %s::geometry) < %s)
+                    p.organization_member_id = %s
+                    AND (%s IS NULL OR ST_DWithin(p.point_projected, %s::geometry, %s))
                 )""",
                 [self.id, tocht_centroid_ewkb, tocht_centroid_ewkb, GEBIED_MAX_DISTANCE],
             )
@@ -115,24 +123,16 @@ class OrganizationMember(models.Model):
 class TeamQuerySet(LocationMixin, models.QuerySet):
     def with_last_position_point(self):
         return self.annotate(
-            last_position_point=Subquery(
-                Position.objects.filter(team=OuterRef('pk')).order_by('-timestamp').values('point')[:1]
-            ),
+            last_position_point=F('latest_position__point'),
         )
 
     def with_last_position_timestamp(self):
         return self.annotate(
-            last_position_timestamp=Subquery(
-                Position.objects.filter(team=OuterRef('pk')).order_by('-timestamp').values('timestamp')[:1]
-            ),
+            last_position_timestamp=Coalesce('latest_position__end_timestamp', 'latest_position__timestamp'),
         )
 
     def with_last_position_source(self):
-        return self.annotate(
-            last_position_source=Subquery(
-                Position.objects.filter(team=OuterRef('pk')).order_by('-timestamp').values('source')[:1]
-            )
-        )
+        return self.annotate(last_position_source=F('latest_position__source'))
 
     def with_last_safety_location(self):
         return self.annotate(
@@ -150,7 +150,7 @@ class TeamQuerySet(LocationMixin, models.QuerySet):
         )
 
 
-class Team(models.Model):
+class Team(TrackerTokenMixin, models.Model):
     direction = EnumField(Direction)
     number = models.PositiveIntegerField(unique=True)
     name = models.CharField(max_length=100)
@@ -171,24 +171,21 @@ class Team(models.Model):
     def __str__(self) -> str:
         return f'{self.direction.value}{self.number:02d} {self.name}'
 
-    def get_track_geojson(self) -> str:
-        # TODO: team is safe filter
-        tocht_centroid = Tocht.centroid()
+    def get_track_geojson(self, resolution: int | None = None) -> str:
+        tocht_centroid = Tocht.centroid(projected=True)
         tocht_centroid_ewkb = tocht_centroid.hexewkb.decode('utf-8') if tocht_centroid else None
         with connection.cursor() as cursor:
             cursor.execute(
-                """SELECT ST_AsGeoJSON(ST_MakeLine(trackers_position.point ORDER BY trackers_position.timestamp))
-                FROM trackers_position
+                f"""SELECT ST_AsGeoJSON(ST_MakeLine(p.point ORDER BY p.timestamp))
+                FROM {position_table_sql(resolution)} p
                 WHERE (
-                    trackers_position.team_id = %s
-                    AND (%s IS NULL OR ST_DistanceSphere(trackers_position.point, %s::geometry) < %s)
-                    AND COALESCE((
-                        SELECT location FROM people_teamsafetylog
+                    p.team_id = %s
+                    AND (%s IS NULL OR ST_DWithin(p.point_projected, %s::geometry, %s))
+                    AND NOT EXISTS (
+                        SELECT 1 FROM people_teamsafetyinterval
                         WHERE team_id = %s
-                        AND created <= trackers_position.timestamp
-                        ORDER BY created DESC
-                        LIMIT 1
-                    ), '') = ''
+                        AND during @> p.timestamp
+                    )
                 )""",
                 [self.id, tocht_centroid_ewkb, tocht_centroid_ewkb, GEBIED_MAX_DISTANCE, self.id],
             )
@@ -209,6 +206,26 @@ class TeamSafetyLog(models.Model):
         return f'{self.team}: {self.location} at {self.created}'
 
 
+class TeamSafetyInterval(models.Model):
+    """The periods in which a team was marked safe, derived from TeamSafetyLog, see rebuild_team_safety_intervals."""
+
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='safety_intervals')
+    during = DateTimeRangeField()
+    location = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            # Its GiST index serves the lookups of whether a team was safe at a moment
+            ExclusionConstraint(
+                name='teamsafetyinterval_no_overlap',
+                expressions=[('team', RangeOperators.EQUAL), ('during', RangeOperators.OVERLAPS)],
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.team}: {self.location} during {self.during}'
+
+
 class LoginToken(models.Model):
     token = models.CharField(max_length=64, unique=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_tokens')
@@ -0,0 +1,41 @@
+from collections.abc import Iterable
+
+from django.db import connection, transaction
+
+from .models import Team
+
+# Every log marks the team safe (with a location) or not safe (without one) until the next log of the team. Only the
+# periods in which the team was safe are stored.
+REBUILD_TEAM_SAFETY_INTERVALS_SQL = """
+    INSERT INTO people_teamsafetyinterval (team_id, location, during)
+    SELECT team_id, location, during
+    FROM (
+        SELECT team_id,
+               location,
+               tstzrange(created, LEAD(created) OVER (PARTITION BY team_id ORDER BY created, id), '[)') AS during
+        FROM people_teamsafetylog
+        WHERE team_id = ANY(%s)
+    ) logs
+    WHERE location <> '' AND NOT isempty(during)
+"""
+
+
+def rebuild_team_safety_intervals(team_ids: Iterable[int]) -> None:
+    """Derive the TeamSafetyInterval rows of the teams from their TeamSafetyLog rows again.
+
+    The post_save and post_delete signals of TeamSafetyLog call this for its team. QuerySet.update(), bulk_create()
+    and raw SQL send no signals: call this for the teams they touch. The rebuild_all_team_safety_intervals task
+    repairs intervals that were missed anyway.
+    """
+    team_ids = sorted(set(team_ids))
+    if not team_ids:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Concurrent rebuilds of a team would both insert its intervals
+        cursor.execute('SELECT id FROM people_team WHERE id = ANY(%s) ORDER BY id FOR UPDATE', [team_ids])
+        cursor.execute('DELETE FROM people_teamsafetyinterval WHERE team_id = ANY(%s)', [team_ids])
+        cursor.execute(REBUILD_TEAM_SAFETY_INTERVALS_SQL, [team_ids])
+
+
+def rebuild_all_team_safety_intervals() -> None:
+    rebuild_team_safety_intervals(Team.objects.values_list('id', flat=True))
@@ -0,0 +1,13 @@
+from typing import Any
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import TeamSafetyLog
+from .safety import rebuild_team_safety_intervals
+
+
+@receiver(post_save, sender=TeamSafetyLog)
+@receiver(post_delete, sender=TeamSafetyLog)
+def team_safety_log_changed(instance: TeamSafetyLog, **kwargs: Any) -> None:
+    rebuild_team_safety_intervals([instance.team_id])
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .safety import rebuild_all_team_safety_intervals
+
+
+@shared_task
+def rebuild_team_safety_intervals() -> None:
+    # Scheduled every hour, for safety logs that were changed without sending signals
+    rebuild_all_team_safety_intervals()
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from json import loads
 from typing import Any
 
@@ -5,17 +6,23 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import Permission
 from django.contrib.gis.measure import D
 from django.db.models import Prefetch, Q
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.utils.timezone import now
 from django.views import View
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.serializers import BaseSerializer, Serializer
 
 from linker.map.models import Tocht
 from linker.tracing.constants import GEBIED_MAX_DISTANCE
+from linker.trackers.constants import POSITION_ROLLUP_RESOLUTIONS, RECENT_POSITIONS_HOURS
+from linker.trackers.models import PositionRollup
 from linker.trackers.permissions import CanViewPositions
+from linker.trackers.recent_positions import get_recent_positions, position_rows
 
 from .models import ContactPerson, LoginToken, OrganizationMember, Team, TeamNote
 from .serializers import (
@@ -28,17 +35,38 @@ from .serializers import (
 )
 
 
+def get_resolution(request: HttpRequest) -> int | None:
+    """The resolution in seconds of the rollups to read positions from, or None for the positions themselves."""
+    resolution = request.GET.get('resolution', 'raw')
+    if resolution == 'raw':
+        return None
+    if resolution not in POSITION_ROLLUP_RESOLUTIONS:
+        raise ValidationError({'resolution': f'Must be one of raw, {", ".join(POSITION_ROLLUP_RESOLUTIONS)}.'})
+    return POSITION_ROLLUP_RESOLUTIONS[resolution]
+
+
+def owner_positions(owner: Team | OrganizationMember, resolution: int | None) -> QuerySet[Any]:
+    if resolution is None:
+        return owner.positions.all()
+    return owner.position_rollups.filter(resolution=resolution)
+
+
 def positions_response(queryset) -> HttpResponse:
-    tocht_centroid = Tocht.centroid()
-    queryset = queryset.filter(point__distance_lt=(tocht_centroid, D(m=GEBIED_MAX_DISTANCE)))
+    tocht_centroid = Tocht.centroid(projected=True)
+    queryset = queryset.filter(point_projected__dwithin=(tocht_centroid, D(m=GEBIED_MAX_DISTANCE)))
     queryset = queryset.order_by('timestamp')
+    # A rollup answers with the id of the position it holds
+    id_field = 'position_id' if queryset.model is PositionRollup else 'id'
 
     response = '['
-    for item in queryset.values('id', 'timestamp', 'point', 'source', 'team_id', 'organization_member_id'):
+    for item in queryset.values(
+        id_field, 'timestamp', 'end_timestamp', 'point', 'source', 'team_id', 'organization_member_id'
+    ):
         team_id = item['team_id'] if item['team_id'] else 'null'
         organization_member_id = item['organization_member_id'] if item['organization_member_id'] else 'null'
+        end_timestamp = f'"{item["end_timestamp"].isoformat()}"' if item['end_timestamp'] else 'null'
         response += (
-            f'{{"id":{item["id"]},"timestamp":"{item["timestamp"].isoformat()}",'
+            f'{{"id":{item[id_field]},"timestamp":"{item["timestamp"].isoformat()}","end_timestamp":{end_timestamp},'
             f'"point":{item["point"].json},"source":"{item["source"].value}",'
             f'"team_id":{team_id}, "organization_member_id":{organization_member_id}}},'
         )
@@ -49,6 +77,40 @@ def positions_response(queryset) -> HttpResponse:
     return HttpResponse(response, content_type='application/json')
 
 
+def recent_positions_response(request: HttpRequest, owner: Team | OrganizationMember) -> JsonResponse:
+    """The positions of the last minutes of the owner, from the recent positions in Redis when they are complete."""
+    max_minutes = RECENT_POSITIONS_HOURS * 60
+    try:
+        minutes = int(request.GET.get('minutes', max_minutes))
+    except ValueError:
+        minutes = 0
+    if not 1 <= minutes <= max_minutes:
+        raise ValidationError({'minutes': f'Must be a number of minutes between 1 and {max_minutes}.'})
+    since = now() - timedelta(minutes=minutes)
+
+    recent = get_recent_positions('team' if isinstance(owner, Team) else 'member', [owner.pk], since)
+    if recent is not None:
+        rows = sorted(recent[owner.pk], key=lambda row: row.timestamp)
+    else:
+        positions = owner.positions.annotate(last_seen=Coalesce('end_timestamp', 'timestamp'))
+        rows = position_rows(positions.filter(last_seen__gte=since).order_by('timestamp'))
+
+    return JsonResponse(
+        [
+            {
+                'timestamp': row.timestamp,
+                'end_timestamp': row.end_timestamp,
+                'point': {'type': 'Point', 'coordinates': [row.longitude, row.latitude]},
+                'source': str(row.source),
+                'team_id': row.team_id,
+                'organization_member_id': row.organization_member_id,
+            }
+            for row in rows
+        ],
+        safe=False,
+    )
+
+
 class TeamViewSet(viewsets.ModelViewSet[Team]):
     def get_serializer_class(self) -> type[Serializer[Team]]:
         if self.request.user.has_perm('people.view_team_details') and self.request.user.has_perm(
@@ -95,11 +157,21 @@ class TeamViewSet(viewsets.ModelViewSet[Team]):
 
     @action(detail=True, methods=['get'], permission_classes=(IsAuthenticated, CanViewPositions))
     def track(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
-        return HttpResponse(self.get_object().get_track_geojson(), content_type='application/geo+json')
+        track = self.get_object().get_track_geojson(get_resolution(request))
+        return HttpResponse(track, content_type='application/geo+json')
 
     @action(detail=True, methods=['get'], permission_classes=(IsAuthenticated, CanViewPositions))
     def positions(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
-        return positions_response(self.get_object().positions)
+        return positions_response(owner_positions(self.get_object(), get_resolution(request)))
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='recent-positions',
+        permission_classes=(IsAuthenticated, CanViewPositions),
+    )
+    def recent_positions(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
+        return recent_positions_response(request, self.get_object())
 
 
 class OrganizationMemberViewSet(viewsets.ReadOnlyModelViewSet[OrganizationMember]):
@@ -116,11 +188,21 @@ class OrganizationMemberViewSet(viewsets.ReadOnlyModelViewSet[OrganizationMember
 
     @action(detail=True, methods=['get'], permission_classes=(IsAuthenticated, CanViewPositions))
     def track(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
-        return HttpResponse(self.get_object().get_track_geojson(), content_type='application/geo+json')
+        track = self.get_object().get_track_geojson(get_resolution(request))
+        return HttpResponse(track, content_type='application/geo+json')
 
     @action(detail=True, methods=['get'], permission_classes=(IsAuthenticated, CanViewPositions))
     def positions(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
-        return positions_response(self.get_object().positions)
+        return positions_response(owner_positions(self.get_object(), get_resolution(request)))
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='recent-positions',
+        permission_classes=(IsAuthenticated, CanViewPositions),
+    )
+    def recent_positions(self, request: HttpRequest, pk: int | None = None) -> HttpResponse:
+        return recent_positions_response(request, self.get_object())
 
 
 class TeamNoteViewSet(viewsets.ModelViewSet[TeamNote]):
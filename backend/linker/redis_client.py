@@ -0,0 +1,16 @@
+import os
+
+from django.conf import settings
+from redis import Redis
+
+_redis: Redis | None = None
+_redis_pid: int | None = None
+
+
+def get_redis() -> Redis:
+    # One connection pool per process: Celery and gunicorn fork their workers after importing this module
+    global _redis, _redis_pid
+    if _redis is None or _redis_pid != os.getpid():
+        _redis = Redis.from_url(settings.CELERY_BROKER_URL)
+        _redis_pid = os.getpid()
+    return _redis
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_gis',
     'django_extensions',
@@ -169,6 +170,30 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 #         'task': 'linker.trackers.tasks.download_tracker_data_api',
 #         'schedule': datetime.timedelta(minutes=1),
 #     },
+#     'import-ingest-stream': {
+#         'task': 'linker.trackers.tasks.import_ingest_stream',
+#         'schedule': datetime.timedelta(minutes=1),
+#     },
+#     'flush-buffered-positions': {
+#         'task': 'linker.trackers.tasks.flush_buffered_positions',
+#         'schedule': datetime.timedelta(minutes=1),
+#     },
+#     'maintain-partitions': {
+#         'task': 'linker.trackers.tasks.maintain_partitions',
+#         'schedule': datetime.timedelta(hours=1),
+#     },
+#     'archive-tracker-logs': {
+#         'task': 'linker.trackers.tasks.archive_old_tracker_logs',
+#         'schedule': datetime.timedelta(days=1),
+#     },
+#     'rebuild-team-safety-intervals': {
+#         'task': 'linker.people.tasks.rebuild_team_safety_intervals',
+#         'schedule': datetime.timedelta(hours=1),
+#     },
+#     'fill-recent-positions': {
+#         'task': 'linker.trackers.tasks.fill_recent_positions',
+#         'schedule': datetime.timedelta(minutes=1),
+#     },
 #     'trace-teams': {
 #         'task': 'linker.tracing.tasks.trace_teams',
 #         'schedule': datetime.timedelta(minutes=1),
@@ -229,4 +254,22 @@ GEODYNAMICS_MINISITE_URL = env('GEODYNAMICS_MINISITE_URL', default=None)
 GEODYNAMICS_API_BASE_URL = env('GEODYNAMICS_API_BASE_URL', default=None)
 GEODYNAMICS_API_AUTH = env.tuple('GEODYNAMICS_API_AUTH', default=None)
 
+# Where to remember recently imported tracker logs to skip duplicates before inserting: memory, redis or off
+TRACKER_LOG_DEDUP_BACKEND = env('TRACKER_LOG_DEDUP_BACKEND', default='memory')
+
+# Bearer token with which Prometheus can scrape /api/metrics/ without logging in
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
+# Directory in which every raw upstream payload is archived for replays, or None to not archive them
+PAYLOAD_ARCHIVE_PATH = env('PAYLOAD_ARCHIVE_PATH', default=None)
+
+# Tracker logs and positions older than this many days are removed by dropping their partitions, or None to keep them
+PARTITION_RETENTION_DAYS = env.int('PARTITION_RETENTION_DAYS', default=None)
+# Directory to which removed partitions are written first, or None to drop them without archiving
+PARTITION_ARCHIVE_PATH = env('PARTITION_ARCHIVE_PATH', default=None)
+# Directory of the columnar archive of old tracker logs, and the number of days after which tracker logs are moved to
+# it, or None to keep them in the database
+TRACKER_LOG_ARCHIVE_PATH = env('TRACKER_LOG_ARCHIVE_PATH', default=None)
+TRACKER_LOG_ARCHIVE_AFTER_DAYS = env.int('TRACKER_LOG_ARCHIVE_AFTER_DAYS', default=None)
+
 HEATMAP_MBTILES_PATH = env('HEATMAP_MBTILES_PATH', default='/heatmap/heatmap.mbtiles')
@@ -6,6 +6,10 @@ WEIDE_MAX_DISTANCE = 100
 GEBIED_MAX_DISTANCE = 300_000
 SKIP_BASIS_DISTANCE = 50
 
+# Belgian Lambert 72, in metres. Distance filters use geometries stored in this projection, so they can use a GiST
+# index instead of computing a spherical distance for every row.
+PROJECTED_SRID = 31370
+
 TRACKER_FAR_AWAY_METERS = 1000
 TRACKER_FORBIDDEN_AREA_AWAY_FROM_ROUTE_METERS = 50
 
@@ -1,15 +1,18 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from logging import getLogger
 
 from celery import shared_task
 from django.contrib.gis.measure import D
-from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 
 from linker.config.models import Switch
 from linker.map.models import ForbiddenArea, Tocht
-from linker.people.models import Team, TeamSafetyLog
+from linker.people.models import Team, TeamSafetyInterval
 from linker.tracing.constants import (
+    PROJECTED_SRID,
     SWITCH_TRACE_TEAMS,
     TRACKER_FAR_AWAY_METERS,
     TRACKER_FORBIDDEN_AREA_AWAY_FROM_ROUTE_METERS,
@@ -19,6 +22,7 @@ from linker.tracing.models import Notification
 from linker.tracing.utils import trace_team
 from linker.trackers.constants import TRACKER_LOG_BATTERY_LOW_TYPES, TRACKER_LOG_SOS_TYPES, TRACKER_OFFLINE_MINUTES
 from linker.trackers.models import Position, Tracker, TrackerLog
+from linker.trackers.recent_positions import get_recent_positions
 
 logger = getLogger(__name__)
 
@@ -85,27 +89,71 @@ def tracker_battery_notifications() -> None:
         )
 
 
-@shared_task
-def tracker_far_away_notifications() -> None:
-    safety_location_subquery = Subquery(
-        TeamSafetyLog.objects.filter(
-            team=OuterRef('team'),
-            created__lte=OuterRef('timestamp'),
-        )
-        .order_by('-created')
-        .values('location')[:1]
-    )
-    teams_far_away = (
-        Position.objects.annotate(team_safe_at_time=safety_location_subquery)
+def _teams_far_away_from_database(since: datetime) -> QuerySet[Position, int]:
+    return (
+        Position.objects.annotate(last_seen=Coalesce('end_timestamp', 'timestamp'))
         .filter(
-            ~Exists(Tocht.objects.filter(route__distance_lte=(OuterRef('point'), D(m=TRACKER_FAR_AWAY_METERS)))),
-            Q(team_safe_at_time='') | Q(team_safe_at_time__isnull=True),
-            timestamp__gte=now() - timedelta(minutes=10),
+            ~Exists(
+                Tocht.objects.filter(
+                    route_projected__dwithin=(OuterRef('point_projected'), D(m=TRACKER_FAR_AWAY_METERS))
+                )
+            ),
+            ~Exists(TeamSafetyInterval.objects.filter(team=OuterRef('team'), during__contains=OuterRef('timestamp'))),
+            last_seen__gte=since,
             team__isnull=False,
         )
         .values_list('team_id', flat=True)
     )
 
+
+TEAMS_FAR_AWAY_SQL = f"""
+    SELECT DISTINCT recent.team_id
+    FROM unnest(%s::bigint[], %s::timestamptz[], %s::float8[], %s::float8[])
+             AS recent(team_id, timestamp, longitude, latitude)
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM map_tocht
+        WHERE ST_DWithin(
+            map_tocht.route_projected,
+            ST_Transform(ST_SetSRID(ST_MakePoint(recent.longitude, recent.latitude), 4326), {PROJECTED_SRID}),
+            %s
+        )
+    )
+      AND NOT EXISTS (
+        SELECT 1 FROM people_teamsafetyinterval
+        WHERE team_id = recent.team_id
+        AND during @> recent.timestamp
+    )
+"""
+
+
+def _teams_far_away_from_recent_positions(since: datetime) -> list[int] | None:
+    recent = get_recent_positions('team', Team.objects.values_list('id', flat=True), since)
+    if recent is None:
+        return None
+    rows = [row for team_rows in recent.values() for row in team_rows]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TEAMS_FAR_AWAY_SQL,
+            [
+                [row.team_id for row in rows],
+                [row.timestamp for row in rows],
+                [row.longitude for row in rows],
+                [row.latitude for row in rows],
+                TRACKER_FAR_AWAY_METERS,
+            ],
+        )
+        return [team_id for (team_id,) in cursor.fetchall()]
+
+
+@shared_task
+def tracker_far_away_notifications() -> None:
+    since = now() - timedelta(minutes=10)
+    teams_far_away = _teams_far_away_from_recent_positions(since)
+    if teams_far_away is None:
+        # The recent positions are not complete, the fill_recent_positions task fills them for a next run
+        teams_far_away = list(_teams_far_away_from_database(since))
+
     for team_id in teams_far_away:
         Notification.objects.get_or_create(notification_type=NotificationType.TRACKER_FAR_AWAY, team_id=team_id)
 
@@ -118,30 +166,24 @@ def tracker_far_away_notifications() -> None:
 @shared_task
 def tracker_forbidden_area_notifications() -> None:
     in_forbidden_area_route_not_allowed = Exists(
-        ForbiddenArea.objects.filter(route_allowed=False, area__contains=OuterRef('point'))
+        ForbiddenArea.objects.filter(route_allowed=False, area_projected__contains=OuterRef('point_projected'))
     )
     in_forbidden_area_route_allowed = Exists(
-        ForbiddenArea.objects.filter(route_allowed=True, area__contains=OuterRef('point'))
+        ForbiddenArea.objects.filter(route_allowed=True, area_projected__contains=OuterRef('point_projected'))
     )
     close_to_route = Exists(
         Tocht.objects.filter(
-            route__distance_lte=(OuterRef('point'), D(m=TRACKER_FORBIDDEN_AREA_AWAY_FROM_ROUTE_METERS))
+            route_projected__dwithin=(OuterRef('point_projected'), D(m=TRACKER_FORBIDDEN_AREA_AWAY_FROM_ROUTE_METERS))
         )
     )
 
-    safety_location_subquery = Subquery(
-        TeamSafetyLog.objects.filter(
-            team=OuterRef('team'),
-            created__lte=OuterRef('timestamp'),
-        )
-        .order_by('-created')
-        .values('location')[:1]
+    team_safe_at_time = Exists(
+        TeamSafetyInterval.objects.filter(team=OuterRef('team'), during__contains=OuterRef('timestamp'))
     )
     team_ids = set(
-        Position.objects.annotate(team_safe_at_time=safety_location_subquery)
-        .filter(
+        Position.objects.filter(
             in_forbidden_area_route_not_allowed | (in_forbidden_area_route_allowed & ~close_to_route),
-            Q(team_safe_at_time='') | Q(team_safe_at_time__isnull=True),
+            ~team_safe_at_time,
             team__isnull=False,
         )
         .values_list('team_id', flat=True)
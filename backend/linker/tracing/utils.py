@@ -2,10 +2,11 @@ from datetime import timedelta
 from logging import getLogger
 
 from django.contrib.gis.measure import D
-from django.db.models import OuterRef, Q, Subquery
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 
 from linker.map.models import Fiche
-from linker.people.models import Team, TeamSafetyLog
+from linker.people.models import Team, TeamSafetyInterval
 from linker.tracing.constants import FICHE_MAX_DISTANCE
 from linker.tracing.models import CheckpointLog
 from linker.trackers.models import Position
@@ -17,40 +18,34 @@ def trace_team(team: Team) -> None:
     logger.info(f'Tracing team {team}')
     closest_fiche = Subquery(
         Fiche.objects.filter(
-            tocht__is_alternative=False, point__distance_lte=(OuterRef('point'), D(m=FICHE_MAX_DISTANCE))
+            tocht__is_alternative=False,
+            point_projected__dwithin=(OuterRef('point_projected'), D(m=FICHE_MAX_DISTANCE)),
         ).values('pk')[:1]
     )
 
-    positions = (
-        Position.objects.filter(team=team)
-        .annotate(
-            team_safe_at_time=Subquery(
-                TeamSafetyLog.objects.filter(
-                    team=team,
-                    created__lte=OuterRef('timestamp'),
-                )
-                .order_by('-created')
-                .values('location')[:1]
-            )
-        )
-        .filter(Q(team_safe_at_time='') | Q(team_safe_at_time__isnull=True))
+    positions = Position.objects.filter(
+        ~Exists(TeamSafetyInterval.objects.filter(team=team, during__contains=OuterRef('timestamp'))),
+        team=team,
     )
     try:
         last_checkpoint = team.checkpointlogs.latest('left')
     except CheckpointLog.DoesNotExist:
         pass
     else:
-        positions = positions.filter(timestamp__gte=last_checkpoint.arrived)
+        positions = positions.annotate(last_seen=Coalesce('end_timestamp', 'timestamp')).filter(
+            last_seen__gte=last_checkpoint.arrived
+        )
 
     positions = positions.annotate(closest_fiche=closest_fiche).order_by('timestamp')
 
     if not positions.exists():
         return
 
-    positions_values = list(positions.values('timestamp', 'closest_fiche'))
+    # A dwell position covers the whole time the team stayed at the same place
+    positions_values = list(positions.values('timestamp', 'end_timestamp', 'closest_fiche'))
     current_fiche = positions_values[0]['closest_fiche']
     current_arrived = positions_values[0]['timestamp']
-    current_left = positions_values[0]['timestamp']
+    current_left = positions_values[0]['end_timestamp'] or positions_values[0]['timestamp']
     for position in positions_values:
         if position['closest_fiche'] != current_fiche:
             if current_fiche is not None:
@@ -73,10 +68,10 @@ def trace_team(team: Team) -> None:
                         team=team,
                     )
             current_arrived = position['timestamp']
-            current_left = position['timestamp']
+            current_left = position['end_timestamp'] or position['timestamp']
             current_fiche = position['closest_fiche']
         else:
-            current_left = position['timestamp']
+            current_left = position['end_timestamp'] or position['timestamp']
 
     if current_fiche is not None and (
         CheckpointLog.objects.filter(team=team, fiche_id=current_fiche)
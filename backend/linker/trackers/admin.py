@@ -1,10 +1,14 @@
+import csv
+
 from django.contrib.gis import admin
 from django.db.models.query import QuerySet
+from django.http import HttpResponse
 from django.http.request import HttpRequest
 from django.urls import reverse
 from django.utils.html import format_html
 
-from linker.trackers.models import Position, Tracker, TrackerLog
+from linker.trackers.log_archive import FIELDS, iter_tracker_logs
+from linker.trackers.models import Position, PositionProvenance, Tracker, TrackerLog
 
 
 @admin.register(Tracker)
@@ -15,6 +19,7 @@ class TrackerAdmin(admin.ModelAdmin[Tracker]):
         'tracker_name',
         'tracker_id',
     )
+    actions = ('download_tracker_logs',)
 
     def get_queryset(self, request: HttpRequest) -> QuerySet[Tracker]:
         qs = super().get_queryset(request)
@@ -33,6 +38,17 @@ class TrackerAdmin(admin.ModelAdmin[Tracker]):
         else:
             return '-'
 
+    @admin.action(description='Download tracker logs, including the archived ones')
+    def download_tracker_logs(self, request: HttpRequest, queryset: QuerySet[Tracker]) -> HttpResponse:
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="tracker_logs.csv"'
+        writer = csv.writer(response)
+        writer.writerow(['tracker_id', 'longitude', 'latitude', *FIELDS])
+        for tracker in queryset:
+            for log in iter_tracker_logs(tracker.id):
+                writer.writerow([tracker.tracker_id, log['point'].x, log['point'].y, *(log[field] for field in FIELDS)])
+        return response
+
 
 @admin.register(TrackerLog)
 class TrackerLogAdmin(admin.GISModelAdmin):
@@ -82,3 +98,9 @@ class TrackerLogAdmin(admin.GISModelAdmin):
 @admin.register(Position)
 class PositionAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(PositionProvenance)
+class PositionProvenanceAdmin(admin.ModelAdmin[PositionProvenance]):
+    list_display = ('timestamp', 'source', 'team', 'organization_member', 'created')
+    list_filter = ('source',)
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class TrackersConfig(AppConfig):
+    name = 'linker.trackers'
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401
@@ -0,0 +1,129 @@
+import fcntl
+import gzip
+import struct
+import zlib
+from bisect import bisect_left
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from pathlib import Path
+
+from django.conf import settings
+
+from .constants import PAYLOAD_ARCHIVE_SEGMENT_SECONDS, RawPayloadKind
+from .ingest_stream import RawPayload
+
+logger = getLogger(__name__)
+
+# Every index entry is the fetch time in milliseconds, the offset and length of the compressed body in the data
+# file, and the payload kind.
+INDEX_ENTRY = struct.Struct('<qQIB')
+KINDS = list(RawPayloadKind)
+
+
+def _segment_start(timestamp_ms: int) -> int:
+    segment_ms = PAYLOAD_ARCHIVE_SEGMENT_SECONDS * 1000
+    return timestamp_ms - timestamp_ms % segment_ms
+
+
+def _segment_paths(directory: Path, segment_start_ms: int) -> tuple[Path, Path]:
+    name = datetime.fromtimestamp(segment_start_ms / 1000, tz=UTC).strftime('%Y%m%dT%H%M%S')
+    return directory / f'{name}.data', directory / f'{name}.idx'
+
+
+def _timestamp_ms(value: datetime) -> int:
+    return round(value.timestamp() * 1000)
+
+
+class PayloadArchive:
+    """Append-only archive of raw upstream payloads, split in segments of a fixed duration.
+
+    Every segment has a data file with the zlib-compressed bodies and an index with fixed-width entries, sorted by
+    fetch time, so a replay can jump to any timestamp with a binary search instead of listing files.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def append(self, payload: RawPayload) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        timestamp_ms = _timestamp_ms(payload.fetch_datetime)
+        data_path, index_path = _segment_paths(self.directory, _segment_start(timestamp_ms))
+        body = zlib.compress(payload.body)
+
+        # The index is locked while appending, so fetchers in other processes can archive at the same time
+        with index_path.open('ab') as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                index_size = index_file.seek(0, 2)
+                if index_size >= INDEX_ENTRY.size:
+                    with index_path.open('rb') as reader:
+                        reader.seek(index_size - INDEX_ENTRY.size)
+                        last_timestamp_ms = INDEX_ENTRY.unpack(reader.read(INDEX_ENTRY.size))[0]
+                    # Concurrent fetchers can finish out of order; keep the index sorted
+                    timestamp_ms = max(timestamp_ms, last_timestamp_ms)
+                with data_path.open('ab') as data_file:
+                    offset = data_file.seek(0, 2)
+                    data_file.write(body)
+                index_file.write(INDEX_ENTRY.pack(timestamp_ms, offset, len(body), KINDS.index(payload.kind)))
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+    def _read_segment(self, segment_start_ms: int, start_ms: int, end_ms: int) -> Iterator[RawPayload]:
+        data_path, index_path = _segment_paths(self.directory, segment_start_ms)
+        if not index_path.exists():
+            return
+        index = index_path.read_bytes()
+        # Ignore a partially written last entry
+        index = index[: len(index) - len(index) % INDEX_ENTRY.size]
+        entries = list(INDEX_ENTRY.iter_unpack(index))
+        first = bisect_left(entries, start_ms, key=lambda entry: entry[0])
+
+        with data_path.open('rb') as data_file:
+            for timestamp_ms, offset, length, kind in entries[first:]:
+                if timestamp_ms > end_ms:
+                    return
+                data_file.seek(offset)
+                yield RawPayload(
+                    kind=KINDS[kind],
+                    body=zlib.decompress(data_file.read(length)),
+                    fetch_datetime=datetime.fromtimestamp(timestamp_ms / 1000, tz=UTC),
+                )
+
+    def iter_payloads(self, start: datetime, end: datetime) -> Iterator[RawPayload]:
+        """Yield the payloads fetched between start and end (both inclusive) in order."""
+        start_ms = _timestamp_ms(start)
+        end_ms = _timestamp_ms(end)
+        segment_start_ms = _segment_start(start_ms)
+        while segment_start_ms <= end_ms:
+            yield from self._read_segment(segment_start_ms, start_ms, end_ms)
+            segment_start_ms += PAYLOAD_ARCHIVE_SEGMENT_SECONDS * 1000
+
+
+def get_payload_archive() -> PayloadArchive | None:
+    if settings.PAYLOAD_ARCHIVE_PATH is None:
+        return None
+    return PayloadArchive(Path(settings.PAYLOAD_ARCHIVE_PATH))
+
+
+def archive_payload(payload: RawPayload) -> None:
+    archive = get_payload_archive()
+    if archive is None:
+        return
+    try:
+        archive.append(payload)
+    except OSError as e:
+        # Failing to archive should never stop the import
+        logger.error(f'Could not archive {payload.kind} payload: {e}')
+
+
+def convert_simulation_files(directory: Path, archive: PayloadArchive) -> int:
+    """Add the legacy `<epoch>.json.gz` minisite files from the simulation directory to the archive."""
+    files = sorted(directory.glob('*.json.gz'), key=lambda file: int(file.name.removesuffix('.json.gz')))
+    for file in files:
+        fetch_datetime = datetime(1970, 1, 1, tzinfo=UTC) + timedelta(seconds=int(file.name.removesuffix('.json.gz')))
+        with gzip.open(file, 'rb') as f:
+            body = f.read()
+        archive.append(RawPayload(kind=RawPayloadKind.MINISITE, body=body, fetch_datetime=fetch_datetime))
+    logger.info(f'Archived {len(files)} simulation files from {directory}')
+    return len(files)
@@ -0,0 +1,322 @@
+import gzip
+import json
+import sys
+from collections.abc import Callable, Iterator, Sequence
+from datetime import datetime, timedelta
+from io import BytesIO
+from logging import getLogger
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from dateutil.parser import isoparse
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Exists, Max, OuterRef, QuerySet
+from django.db.models.functions import Coalesce
+from django.utils.timezone import is_aware, make_aware, now
+
+from linker.config.models import Switch
+from linker.people.constants import Direction
+from linker.people.models import OrganizationMember, Team
+
+from . import phone_ingest
+from .constants import (
+    PHONE_GPS_INGEST_PATH,
+    SWITCH_INGEST_STREAM,
+    SWITCH_POSITION_BUFFER,
+    PositionSource,
+    TrackerLogSource,
+)
+from .dedup import get_recent_keys, tracker_log_key
+from .geodynamics import _parse_date
+from .loader import copy_tracker_logs, insert_tracker_logs, store_tracker_logs
+from .models import Position, PositionProvenance, Tracker, TrackerLog
+from .rows import PositionRow, TrackerLogRow
+
+logger = getLogger(__name__)
+
+BENCHMARK_START = datetime(2000, 1, 1, tzinfo=ZoneInfo('UTC'))
+
+
+def _tracker_log_rows(tracker_id: int, size: int) -> list[TrackerLogRow]:
+    return [
+        TrackerLogRow(
+            tracker_id=tracker_id,
+            gps_datetime=BENCHMARK_START + timedelta(seconds=i),
+            longitude=round(4.0 + i * 1e-6, 6),
+            latitude=round(51.0 + i * 1e-6, 6),
+            source=TrackerLogSource.GEODYNAMICS_API,
+            tracker_type=0,
+            satellites=8,
+            heading=90,
+            speed=4,
+        )
+        for i in range(size)
+    ]
+
+
+def benchmark_tracker_log_loaders(sizes: Sequence[int] = (1_000, 10_000, 100_000)) -> None:
+    """Compare the insert of arrays with the COPY loader. Every run is rolled back afterwards."""
+    loaders: list[tuple[str, Callable[[Sequence[TrackerLogRow]], int]]] = [
+        ('insert', insert_tracker_logs),
+        ('copy', copy_tracker_logs),
+    ]
+    for size in sizes:
+        for name, loader in loaders:
+            with transaction.atomic():
+                tracker = Tracker.objects.create(tracker_id='benchmark', tracker_name='benchmark')
+                rows = _tracker_log_rows(tracker.id, size)
+
+                start = perf_counter()
+                inserted = loader(rows)
+                # Load half of the rows again, to include the cost of conflicting rows
+                inserted += loader(rows[: size // 2])
+                duration = perf_counter() - start
+
+                transaction.set_rollback(True)
+            rows_per_second = (size + size // 2) / duration
+            logger.info(
+                f'{name:<12} {size:>7} rows: {duration:7.2f} s, {rows_per_second:9.0f} rows/s, {inserted} reported'
+            )
+
+
+def _recorded_date_strings(max_files: int) -> list[str]:
+    date_strings = []
+    files = sorted((Path(settings.SIMULATION_PATH) / 'geodynamics').glob('*.json.gz'))[:max_files]
+    for filename in files:
+        with gzip.open(filename, 'rb') as file:
+            data = json.load(file)
+        for tracker_data in data['Data']:
+            last_location: dict[str, Any] = tracker_data.get('LastLocation') or {}
+            for date_str in (
+                last_location.get('GpsDateTime'),
+                last_location.get('LocalDateTime'),
+                tracker_data.get('LastSyncDate'),
+            ):
+                if date_str is not None:
+                    date_strings.append(date_str)
+    return date_strings
+
+
+def benchmark_date_parsing(max_files: int = 500) -> None:
+    """Compare dateutil with the fast path of try_parse_date on the timestamps of recorded minisite payloads."""
+    date_strings = _recorded_date_strings(max_files)
+    logger.info(f'{len(date_strings)} timestamps from {max_files} files at most')
+    if not date_strings:
+        return
+
+    def parse_with_dateutil(date_str: str) -> datetime:
+        parsed = isoparse(date_str)
+        return parsed if is_aware(parsed) else make_aware(parsed)
+
+    _parse_date.cache_clear()
+    for name, parse in (('dateutil', parse_with_dateutil), ('fast path', _parse_date)):
+        start = perf_counter()
+        for date_str in date_strings:
+            parse(date_str)
+        duration = perf_counter() - start
+        logger.info(f'{name:<10} {duration:7.3f} s, {duration / len(date_strings) * 1e6:6.2f} us per timestamp')
+    logger.info(f'fast path cache: {_parse_date.cache_info()}')
+
+
+def _wsgi_environ(path: str, body: bytes) -> dict[str, Any]:
+    host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+    return {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': host,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+
+
+def benchmark_phone_gps_endpoints(token: str, duration: float = 10.0) -> None:
+    """Compare the requests per second of one worker on /api/phone-gps/ and on the minimal ingest path.
+
+    The requests are sent straight to the WSGI application, so this measures the work of the worker itself without
+    the network. Every run is rolled back afterwards. The ingest stream and the position buffer are switched off in
+    that transaction, so both paths store the positions in the database and nothing is left behind in Redis.
+    """
+    from linker.wsgi import application
+
+    def start_response(status: str, headers: list[tuple[str, str]]) -> None:
+        if not status.startswith('2'):
+            raise RuntimeError(f'Request failed with {status}')
+
+    # Like the test client: the request signals must not close the connection of the transaction
+    signals.request_started.disconnect(close_old_connections)
+    signals.request_finished.disconnect(close_old_connections)
+    try:
+        for path in ('/api/phone-gps/', PHONE_GPS_INGEST_PATH):
+            with transaction.atomic():
+                Switch.objects.filter(name__in=[SWITCH_INGEST_STREAM, SWITCH_POSITION_BUFFER]).update(active=False)
+                phone_ingest._switches.clear()
+                nb_requests = 0
+                start = perf_counter()
+                while perf_counter() - start < duration:
+                    # Every request needs its own timestamp, the positions are unique per owner and timestamp
+                    timestamp = datetime.now(ZoneInfo('UTC')) + timedelta(microseconds=nb_requests)
+                    body = json.dumps(
+                        {
+                            'token': token,
+                            'timestamp': timestamp.isoformat(),
+                            'point': {'type': 'Point', 'coordinates': [4.0, 51.0]},
+                        }
+                    ).encode()
+                    b''.join(application(_wsgi_environ(path, body), start_response))
+                    nb_requests += 1
+                elapsed = perf_counter() - start
+                transaction.set_rollback(True)
+            logger.info(f'{path:<28} {nb_requests:>7} requests, {nb_requests / elapsed:8.0f} requests/s per worker')
+    finally:
+        phone_ingest._switches.clear()
+        signals.request_started.connect(close_old_connections)
+        signals.request_finished.connect(close_old_connections)
+
+
+def _scan_nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    if plan.get('Relation Name', '').startswith(('trackers_position', 'trackers_trackerlog')):
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from _scan_nodes(child)
+
+
+def check_position_query_plans() -> None:
+    """EXPLAIN the hot position queries and check that they read positions and tracker logs through their indexes.
+
+    The team and member endpoints must not read positions at all, they join LatestPosition. Refreshing LatestPosition
+    must read the last position of an owner with an index-only scan on the covering indexes. Sequential scans are
+    disabled while explaining, so the check tells whether the indexes can serve the queries regardless of how much
+    data there is. Raise ImproperlyConfigured when an index is missing.
+    """
+    cutoff = now() - timedelta(minutes=10)
+    no_positions: set[str] = set()
+    index_only = {'Index Only Scan'}
+    index = {'Index Only Scan', 'Index Scan', 'Bitmap Heap Scan'}
+    latest_fields = ('timestamp', 'end_timestamp', 'point', 'source')
+    queries: dict[str, tuple[QuerySet[Any], set[str]]] = {
+        'team last position': (
+            Team.objects.with_last_position_point().with_last_position_timestamp().with_last_position_source(),
+            no_positions,
+        ),
+        'member last position': (
+            OrganizationMember.objects.with_last_position_point()
+            .with_last_position_timestamp()
+            .with_last_position_source(),
+            no_positions,
+        ),
+        'refresh team latest position': (
+            Position.objects.filter(team_id=0).order_by('-timestamp').values(*latest_fields)[:1],
+            index_only,
+        ),
+        'refresh member latest position': (
+            Position.objects.filter(organization_member_id=0).order_by('-timestamp').values(*latest_fields)[:1],
+            index_only,
+        ),
+        'recent positions': (
+            Position.objects.annotate(last_seen=Coalesce('end_timestamp', 'timestamp')).filter(last_seen__gte=cutoff),
+            index,
+        ),
+        'recent tracker logs': (
+            Tracker.objects.filter(Exists(TrackerLog.objects.filter(tracker=OuterRef('pk'), gps_datetime__gte=cutoff))),
+            index_only,
+        ),
+    }
+
+    failures = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        for name, (queryset, allowed) in queries.items():
+            plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+            scans = sorted({node['Node Type'] for node in _scan_nodes(plan)})
+            ok = set(scans) <= allowed and (bool(scans) or not allowed)
+            logger.info(f'{name:<32} {"ok" if ok else "FAIL":<5} {", ".join(scans)}')
+            if not ok:
+                failures.append(name)
+    if failures:
+        raise ImproperlyConfigured(f'Queries without the expected index scans: {", ".join(failures)}')
+
+
+TEAM_SAFETY_FILTERS = {
+    'latest log subquery': """
+        COALESCE((
+            SELECT location FROM people_teamsafetylog
+            WHERE team_id = p.team_id
+            AND created <= p.timestamp
+            ORDER BY created DESC
+            LIMIT 1
+        ), '') = ''
+    """,
+    'safety intervals': """
+        NOT EXISTS (
+            SELECT 1 FROM people_teamsafetyinterval
+            WHERE team_id = p.team_id
+            AND during @> p.timestamp
+        )
+    """,
+}
+
+
+def benchmark_team_safety_filters(repeat: int = 3) -> None:
+    """Compare the latest safety log subquery with the safety intervals, by counting the positions of unsafe teams.
+
+    Run it on a database with the positions of a whole event, the difference grows with the number of positions.
+    Raise RuntimeError when the filters count a different number of positions.
+    """
+    counts = {}
+    with connection.cursor() as cursor:
+        for name, condition in TEAM_SAFETY_FILTERS.items():
+            durations = []
+            for _ in range(repeat):
+                start = perf_counter()
+                cursor.execute(f'SELECT COUNT(*) FROM trackers_position p WHERE p.team_id IS NOT NULL AND {condition}')
+                (counts[name],) = cursor.fetchone()
+                durations.append(perf_counter() - start)
+            logger.info(f'{name:<20} {min(durations):7.3f} s, {counts[name]} positions of unsafe teams')
+    if len(set(counts.values())) > 1:
+        raise RuntimeError(f'The filters disagree: {counts}')
+
+
+def check_position_source_precedence() -> None:
+    """Store a fix from the minisite and then the same fix from the API, and check that the API position is kept.
+
+    Which source is stored must follow TRACKER_POSITION_SOURCE_PRECEDENCE, not the order in which the feeds report a
+    fix. Everything is rolled back afterwards. Raise RuntimeError when the minisite position is kept, or when a source
+    has no provenance.
+    """
+    feeds = [
+        (TrackerLogSource.MINISITE_API, PositionSource.MINISITE_API),
+        (TrackerLogSource.GEODYNAMICS_API, PositionSource.GEODYNAMICS_API),
+    ]
+    with transaction.atomic():
+        tracker = Tracker.objects.create(tracker_id='precedence-check', tracker_name='precedence-check')
+        number = (Team.objects.aggregate(Max('number'))['number__max'] or 0) + 1
+        team = Team.objects.create(direction=Direction.RED, number=number, name='check', chiro='check')
+        timestamp = now().replace(microsecond=0)
+        for tracker_log_source, position_source in feeds:
+            tracker_log = TrackerLogRow(tracker.id, timestamp, 4.0, 51.0, tracker_log_source, tracker_type=0)
+            store_tracker_logs([tracker_log], [PositionRow(team.id, None, timestamp, 4.0, 51.0, position_source)])
+            # The keys of stored tracker logs are only remembered on commit, which never happens here
+            get_recent_keys().add([tracker_log_key(tracker.id, timestamp, 0, str(tracker_log_source))])
+        source = Position.objects.get(team=team, timestamp=timestamp).source
+        provenance = set(
+            PositionProvenance.objects.filter(team=team, timestamp=timestamp).values_list('source', flat=True)
+        )
+        transaction.set_rollback(True)
+
+    logger.info(f'Stored source {source}, provenance {", ".join(sorted(map(str, provenance)))}')
+    if source != PositionSource.GEODYNAMICS_API:
+        raise RuntimeError(f'The API fix did not replace the minisite fix, the stored source is {source}')
+    if provenance != {position_source for _, position_source in feeds}:
+        raise RuntimeError(f'Missing provenance, only found {provenance}')
@@ -0,0 +1,145 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from math import asin, cos, radians, sin, sqrt
+
+from django.db import connection
+
+from .constants import DWELL_MAX_GAP_MINUTES, DWELL_RADIUS_METERS, TRACKER_POSITION_SOURCE_PRECEDENCE
+from .rows import PositionRow
+
+EARTH_RADIUS_METERS = 6_371_000
+
+Owner = tuple[int | None, int | None]
+# A stored position: its id and timestamp, which together are the primary key of the partitioned table
+PositionKey = tuple[int, datetime]
+
+# The last tracker position of every owner, read from the (owner, -timestamp) index
+STORED_DWELLS_SQL = """
+    SELECT owner.id, p.id, p.timestamp, p.end_timestamp, ST_X(p.point), ST_Y(p.point), p.source
+    FROM unnest(%s::bigint[]) AS owner(id)
+             CROSS JOIN LATERAL (
+        SELECT id, timestamp, end_timestamp, point, source
+        FROM trackers_position
+        WHERE {owner_column} = owner.id
+          AND source = ANY(%s)
+        ORDER BY timestamp DESC
+        LIMIT 1
+        ) p
+"""
+
+
+def distance_meters(longitude1: float, latitude1: float, longitude2: float, latitude2: float) -> float:
+    a = sin(radians(latitude2 - latitude1) / 2) ** 2 + cos(radians(latitude1)) * cos(radians(latitude2)) * (
+        sin(radians(longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * asin(sqrt(a))
+
+
+@dataclass
+class _Dwell:
+    longitude: float
+    latitude: float
+    start: datetime
+    end: datetime
+    source: str
+    # Either the pk of the stored position, or the index of the new row
+    position_id: int | None = None
+    row_index: int | None = None
+
+
+def _stored_dwells(owners: set[Owner]) -> dict[Owner, _Dwell]:
+    team_ids = sorted({team_id for team_id, _ in owners if team_id is not None})
+    member_ids = sorted({member_id for _, member_id in owners if member_id is not None})
+    sources = [str(source) for source in TRACKER_POSITION_SOURCE_PRECEDENCE]
+    dwells = {}
+    with connection.cursor() as cursor:
+        for owner_column, ids in (('team_id', team_ids), ('organization_member_id', member_ids)):
+            if not ids:
+                continue
+            cursor.execute(STORED_DWELLS_SQL.format(owner_column=owner_column), [ids, sources])
+            for owner_id, pk, timestamp, end_timestamp, longitude, latitude, source in cursor.fetchall():
+                owner = (owner_id, None) if owner_column == 'team_id' else (None, owner_id)
+                dwells[owner] = _Dwell(
+                    longitude=longitude,
+                    latitude=latitude,
+                    start=timestamp,
+                    end=end_timestamp or timestamp,
+                    source=source,
+                    position_id=pk,
+                )
+    return dwells
+
+
+def compact_positions(rows: Sequence[PositionRow]) -> tuple[list[PositionRow], dict[PositionKey, datetime]]:
+    """Fold consecutive fixes of an owner within DWELL_RADIUS_METERS of each other into one dwell position.
+
+    Return the positions that still have to be inserted, and the new end_timestamp of stored dwell positions that
+    were extended by this batch.
+    """
+    if not rows:
+        return [], {}
+
+    dwells = _stored_dwells({(row.team_id, row.organization_member_id) for row in rows})
+    max_gap = timedelta(minutes=DWELL_MAX_GAP_MINUTES)
+    new_rows: list[PositionRow] = []
+    extended: dict[PositionKey, datetime] = {}
+
+    for row in sorted(rows, key=lambda row: row.timestamp):
+        owner = (row.team_id, row.organization_member_id)
+        dwell = dwells.get(owner)
+        if dwell is not None and (row.timestamp < dwell.start or str(row.source) != dwell.source):
+            # A late fix from before the current dwell is stored as it is. So is a fix of another feed: storing it
+            # applies the source precedence and records its provenance.
+            new_rows.append(row)
+            continue
+
+        if (
+            dwell is not None
+            and row.timestamp - dwell.end <= max_gap
+            and distance_meters(dwell.longitude, dwell.latitude, row.longitude, row.latitude) <= DWELL_RADIUS_METERS
+        ):
+            if row.timestamp > dwell.end:
+                dwell.end = row.timestamp
+                if dwell.position_id is not None:
+                    extended[(dwell.position_id, dwell.start)] = row.timestamp
+                elif dwell.row_index is not None:
+                    new_rows[dwell.row_index] = new_rows[dwell.row_index]._replace(end_timestamp=row.timestamp)
+            continue
+
+        dwells[owner] = _Dwell(
+            longitude=row.longitude,
+            latitude=row.latitude,
+            start=row.timestamp,
+            end=row.timestamp,
+            source=str(row.source),
+            row_index=len(new_rows),
+        )
+        new_rows.append(row)
+
+    return new_rows, extended
+
+
+def extend_dwells(end_timestamps: dict[PositionKey, datetime]) -> list[tuple[int | None, int | None, datetime]]:
+    """Extend the stored dwell positions, and return the (team_id, organization_member_id, timestamp) of them."""
+    if not end_timestamps:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE trackers_position
+            SET end_timestamp = dwells.end_timestamp
+            FROM unnest(%s::bigint[], %s::timestamptz[], %s::timestamptz[]) AS dwells(id, timestamp, end_timestamp)
+            WHERE trackers_position.id = dwells.id
+              AND trackers_position.timestamp = dwells.timestamp
+              AND (trackers_position.end_timestamp IS NULL
+                   OR trackers_position.end_timestamp < dwells.end_timestamp)
+            RETURNING trackers_position.team_id, trackers_position.organization_member_id, trackers_position.timestamp
+            """,
+            [
+                [pk for pk, _ in end_timestamps],
+                [timestamp for _, timestamp in end_timestamps],
+                list(end_timestamps.values()),
+            ],
+        )
+        return cursor.fetchall()
@@ -7,6 +7,12 @@ SWITCH_SIMULATE = 'simulate'
 SWITCH_FETCH_TRACKERS_MINISITE = 'fetch_trackers_minisite'
 SWITCH_FETCH_TRACKERS_API = 'fetch_trackers_api'
 SWITCH_EXCLUDE_BASIS_FROM_TRACK = 'exclude_basis_from_track'
+SWITCH_STREAM_GEODYNAMICS_API = 'stream_geodynamics_api'
+SWITCH_COPY_LOADER = 'copy_loader'
+SWITCH_INGEST_STREAM = 'ingest_stream'
+SWITCH_DERIVE_POSITIONS_IN_DATABASE = 'derive_positions_in_database'
+SWITCH_COMPACT_POSITIONS = 'compact_positions'
+SWITCH_POSITION_BUFFER = 'position_buffer'
 
 TRACKER_OFFLINE_MINUTES = 12
 
@@ -14,14 +20,107 @@ TRACKER_LOG_BATTERY_LOW_TYPES = [1000, 1001, 1002]
 TRACKER_LOG_SOS_TYPES = [17006, 200]
 TRACKER_VOLTAGE_RANGE = (3.65, 4.2)
 
+# (connect, read) timeouts in seconds for upstream requests
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = 8
+HTTP_MAX_CONCURRENT_REQUESTS = 4
+
+GEODYNAMICS_API_TRACKERS_PER_REQUEST = 50
+GEODYNAMICS_API_STREAM_CHUNK_SIZE = 64 * 1024
+GEODYNAMICS_IMPORT_BATCH_SIZE = 5000
+# Positions can arrive late, so every request starts a bit before the last stored position
+GEODYNAMICS_API_CURSOR_OVERLAP_SECONDS = 120
+# Trackers with a cursor in the same bucket are fetched in one request
+GEODYNAMICS_API_CURSOR_BUCKET_SECONDS = 300
+GEODYNAMICS_API_MAX_BACKFILL_SECONDS = 6 * 60 * 60
+
+TRACKER_LOG_DEDUP_TTL_SECONDS = 60 * 60
+TRACKER_LOG_DEDUP_MAX_KEYS = 100_000
+
+INGEST_STREAM_KEY = 'linker:ingest'
+INGEST_STREAM_DEAD_LETTER_KEY = 'linker:ingest:dead'
+INGEST_CONSUMER_GROUP = 'ingest'
+# Fetching pauses when this many payloads are waiting to be imported
+INGEST_STREAM_MAX_LENGTH = 500
+INGEST_CONSUMER_BATCH_SIZE = 20
+INGEST_CONSUMER_RUN_SECONDS = 55
+# Payloads of a consumer that did not acknowledge them for this long are taken over by another consumer
+INGEST_CLAIM_IDLE_SECONDS = 120
+INGEST_MAX_DELIVERIES = 5
+
+# The readiness check fails when no ingestion run succeeded or no tracker log came in for this long
+INGEST_STALE_SECONDS = 180
+# The lag of a tracker is no longer reported when it sent nothing for this long, e.g. because it is not in use anymore
+TRACKER_LAG_MAX_AGE_SECONDS = 60 * 60
+
+PHONE_GPS_TIMESTAMP_TOLERANCE_MINUTES = 5
+# Phones without connection buffer their positions, a batch upload may contain positions up to this old
+PHONE_GPS_BUFFERED_MAX_AGE_HOURS = 12
+PHONE_GPS_BATCH_MAX_SIZE = 1000
+PHONE_GPS_INGEST_PATH = '/api/phone-gps/ingest/'
+PHONE_GPS_INGEST_MAX_BODY_BYTES = 256 * 1024
+# The ingest path checks the ingest stream switch at most this often
+PHONE_GPS_INGEST_SWITCH_TTL_SECONDS = 5
+
+# Phone tracker tokens are cached in every process for a short time, because other processes can not invalidate
+# those entries. The Redis entries are removed when a team or organization member changes.
+TRACKER_TOKEN_CACHE_MAX_KEYS = 10_000
+TRACKER_TOKEN_LOCAL_TTL_SECONDS = 30
+TRACKER_TOKEN_REDIS_TTL_SECONDS = 60 * 60
+TRACKER_TOKEN_NEGATIVE_TTL_SECONDS = 5 * 60
+
+POSITION_BUFFER_KEY = 'linker:positions'
+POSITION_BUFFER_DEAD_LETTER_KEY = 'linker:positions:dead'
+POSITION_BUFFER_GROUP = 'flush'
+# Positions are stored directly when this many positions are waiting in the buffer
+POSITION_BUFFER_MAX_LENGTH = 100_000
+POSITION_BUFFER_FLUSH_SIZE = 500
+POSITION_BUFFER_FLUSH_SECONDS = 1
+POSITION_BUFFER_FLUSH_RUN_SECONDS = 55
+POSITION_BUFFER_CLAIM_IDLE_SECONDS = 30
+
+# Partitions of tracker logs and positions are created this many days in advance
+PARTITION_DAYS_AHEAD = 7
+
+# Positions are rolled up to one position per owner per bucket of this many seconds, see rollups.py. The keys are
+# the values of the resolution parameter of the track and positions endpoints.
+POSITION_ROLLUP_RESOLUTIONS = {'1m': 60, '5m': 5 * 60}
+
+# Redis keeps the positions of the last hours of every owner for recent trails and the tracing tasks, see
+# recent_positions.py
+RECENT_POSITIONS_HOURS = 3
+RECENT_POSITIONS_MAX_PER_OWNER = 5000
+RECENT_POSITIONS_COMPLETE_SINCE_KEY = 'linker:recent:complete-since'
+RECENT_POSITIONS_TRIMMED_SINCE_KEY = 'linker:recent:trimmed-since'
+
+# Every segment of the payload archive covers this many seconds
+PAYLOAD_ARCHIVE_SEGMENT_SECONDS = 60 * 60
+
 
 class TrackerLogSource(StrEnum):
     MINISITE_API = 'minisite_api'
     GEODYNAMICS_API = 'geodynamics_api'
 
 
+class RawPayloadKind(StrEnum):
+    MINISITE = 'minisite'
+    GEODYNAMICS_API = 'geodynamics_api'
+    PHONE_GPS = 'phone_gps'
+
+
 class PositionSource(StrEnum):
     MINISITE_API = 'minisite_api'
     GEODYNAMICS_API = 'geodynamics_api'
     MANUAL = 'manual'
     PHONE_GPS = 'phone_gps'
+
+
+# Consecutive fixes of a tracker within this distance of the first one are stored as one dwell position, as long as
+# there is no gap of more than DWELL_MAX_GAP_MINUTES between them
+DWELL_RADIUS_METERS = 10
+DWELL_MAX_GAP_MINUTES = 15
+
+# Positions of the same fix reported by several tracker feeds are stored once, from the first source in this list
+TRACKER_POSITION_SOURCE_PRECEDENCE = (PositionSource.GEODYNAMICS_API, PositionSource.MINISITE_API)
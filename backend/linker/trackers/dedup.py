@@ -0,0 +1,125 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from datetime import datetime
+from logging import getLogger
+
+from django.conf import settings
+
+from linker.lru import TTLCache
+from linker.redis_client import get_redis
+
+from .constants import TRACKER_LOG_DEDUP_MAX_KEYS, TRACKER_LOG_DEDUP_TTL_SECONDS
+
+logger = getLogger(__name__)
+
+REDIS_KEY_PREFIX = 'linker:dedup:trackerlog:'
+
+
+def tracker_log_key(tracker_pk: int, gps_datetime: datetime, tracker_type: int | None, source: str) -> str:
+    # The unique_together of TrackerLog and the source: the same fix from another feed must still reach the position
+    # precedence merge, even though its tracker log is a duplicate
+    return f'{tracker_pk}:{gps_datetime.timestamp()}:{tracker_type}:{source}'
+
+
+class RecentKeys(ABC):
+    """Remembers the keys of recently stored tracker logs, so duplicates never have to reach the database."""
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, keys: Sequence[str]) -> list[bool]:
+        result = self._seen(keys)
+        nb_hits = sum(result)
+        self.hits += nb_hits
+        self.misses += len(result) - nb_hits
+        return result
+
+    @abstractmethod
+    def _seen(self, keys: Sequence[str]) -> list[bool]: ...
+
+    @abstractmethod
+    def add(self, keys: Sequence[str]) -> None: ...
+
+    @abstractmethod
+    def clear(self) -> None: ...
+
+
+class NoRecentKeys(RecentKeys):
+    def _seen(self, keys: Sequence[str]) -> list[bool]:
+        return [False] * len(keys)
+
+    def add(self, keys: Sequence[str]) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class MemoryRecentKeys(RecentKeys):
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__()
+        self._cache: TTLCache[str, bool] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _seen(self, keys: Sequence[str]) -> list[bool]:
+        result = []
+        for key in keys:
+            hit = key in self._cache
+            if hit:
+                # The minisite repeats the last location of idle trackers, so keep those keys alive
+                self._cache.set(key, True)
+            result.append(hit)
+        return result
+
+    def add(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self._cache.set(key, True)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class RedisRecentKeys(RecentKeys):
+    """Shared between all worker processes, entries expire through a Redis TTL."""
+
+    def __init__(self, ttl: int) -> None:
+        super().__init__()
+        self.ttl = ttl
+
+    def _seen(self, keys: Sequence[str]) -> list[bool]:
+        if not keys:
+            return []
+        pipeline = get_redis().pipeline(transaction=False)
+        for key in keys:
+            # EXPIRE returns whether the key exists, and refreshes it at the same time
+            pipeline.expire(REDIS_KEY_PREFIX + key, self.ttl)
+        return [bool(result) for result in pipeline.execute()]
+
+    def add(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        pipeline = get_redis().pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(REDIS_KEY_PREFIX + key, 1, ex=self.ttl)
+        pipeline.execute()
+
+    def clear(self) -> None:
+        redis = get_redis()
+        for key in redis.scan_iter(match=REDIS_KEY_PREFIX + '*', count=1000):
+            redis.delete(key)
+
+
+_recent_keys: RecentKeys | None = None
+
+
+def get_recent_keys() -> RecentKeys:
+    global _recent_keys
+    if _recent_keys is None:
+        backend = settings.TRACKER_LOG_DEDUP_BACKEND
+        if backend == 'redis':
+            _recent_keys = RedisRecentKeys(ttl=TRACKER_LOG_DEDUP_TTL_SECONDS)
+        elif backend == 'memory':
+            _recent_keys = MemoryRecentKeys(maxsize=TRACKER_LOG_DEDUP_MAX_KEYS, ttl=TRACKER_LOG_DEDUP_TTL_SECONDS)
+        else:
+            _recent_keys = NoRecentKeys()
+    return _recent_keys
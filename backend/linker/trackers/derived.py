@@ -0,0 +1,26 @@
+# LatestPosition, the position rollups and the recent positions are derived from the stored positions. Every code
+# path that writes positions calls after_positions_written() in the same transaction to keep them up to date.
+
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+
+from .latest import refresh_latest_positions
+from .recent_positions import add_recent_positions
+from .rollups import refresh_position_rollups
+from .rows import PositionRow
+
+Change = tuple[int | None, int | None, datetime]
+
+
+def after_positions_written(rows: Sequence[PositionRow], changes: Iterable[Change] = ()) -> None:
+    """Update what is derived from positions for the written rows, and for the changes to already stored positions.
+
+    A change is the (team_id, organization_member_id, timestamp) of a stored position that was updated, e.g. a dwell
+    that was extended. The recent positions are added once the transaction committed.
+    """
+    changes = [(row.team_id, row.organization_member_id, row.timestamp) for row in rows] + list(changes)
+    if not changes:
+        return
+    refresh_latest_positions({(team_id, organization_member_id) for team_id, organization_member_id, _ in changes})
+    refresh_position_rollups(changes)
+    add_recent_positions(rows)
@@ -1,18 +1,42 @@
+import json
+from collections.abc import Iterable, Iterator
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import batched
 from logging import getLogger
 from time import time
 from typing import Any
 from zoneinfo import ZoneInfo
 
-import requests
 from dateutil.parser import isoparse
 from django.conf import settings
-from django.contrib.gis.geos import Point
-from django.utils.timezone import now
-
-from linker.config.models import Setting
-from linker.trackers.constants import SETTING_GEODYNAMICS_API_HISTORY_SECONDS, TrackerLogSource
-from linker.trackers.models import Position, Tracker, TrackerLog
+from django.db import connection
+from django.utils.timezone import is_aware, make_aware, now
+from requests import Response
+
+from linker.config.models import Setting, Switch
+from linker.trackers.archive import archive_payload, get_payload_archive
+from linker.trackers.constants import (
+    GEODYNAMICS_API_CURSOR_BUCKET_SECONDS,
+    GEODYNAMICS_API_CURSOR_OVERLAP_SECONDS,
+    GEODYNAMICS_API_MAX_BACKFILL_SECONDS,
+    GEODYNAMICS_API_STREAM_CHUNK_SIZE,
+    GEODYNAMICS_API_TRACKERS_PER_REQUEST,
+    GEODYNAMICS_IMPORT_BATCH_SIZE,
+    SETTING_GEODYNAMICS_API_HISTORY_SECONDS,
+    SWITCH_INGEST_STREAM,
+    SWITCH_STREAM_GEODYNAMICS_API,
+    RawPayloadKind,
+    TrackerLogSource,
+)
+from linker.trackers.ingest_stream import RawPayload, enqueue_payload, ingest_stream_has_capacity
+from linker.trackers.jsonstream import iter_json_array
+from linker.trackers.loader import store_tracker_logs
+from linker.trackers.models import Tracker
+from linker.trackers.phone_ingest import import_phone_gps_payload
+from linker.trackers.registry import TrackerOwner, get_tracker_registry, register_trackers
+from linker.trackers.rows import PositionRow, TrackerLogRow
+from linker.trackers.upstream import UpstreamRequest, send, send_all
 
 logger = getLogger(__name__)
 
@@ -20,34 +44,47 @@ logger = getLogger(__name__)
 def try_parse_date(date_str: str | None) -> datetime | None:
     if date_str is None:
         return None
-    try:
-        return isoparse(date_str)
-    except Exception:
-        return None
+    return _parse_date(date_str)
 
 
-def import_geodynamics_minisite_data(data: dict[str, Any], fetch_datetime: datetime | None = None) -> None:
-    if fetch_datetime is None:
-        fetch_datetime = now()
+@lru_cache(maxsize=4096)
+def _parse_date(date_str: str) -> datetime | None:
+    # Geodynamics sends plain ISO 8601 timestamps, which fromisoformat parses a lot faster than dateutil.
+    # Values such as LastSyncDate repeat for every tracker in a payload, hence the cache.
+    try:
+        parsed = datetime.fromisoformat(date_str)
+    except ValueError:
+        try:
+            parsed = isoparse(date_str)
+        except Exception:
+            return None
+    # Naive timestamps are interpreted in the default timezone, like Django does when saving them
+    return parsed if is_aware(parsed) else make_aware(parsed)
+
+
+def _position_row(tracker: TrackerOwner, row: TrackerLogRow) -> PositionRow | None:
+    if not tracker.in_use:
+        return None
+    return PositionRow(
+        team_id=tracker.team_id,
+        organization_member_id=tracker.organization_member_id,
+        timestamp=row.gps_datetime,
+        longitude=row.longitude,
+        latitude=row.latitude,
+        source=row.source,
+    )
 
-    # tocht_centroid = Tocht.centroid()
 
-    new_tracker_logs = []
-    new_positions = []
+def parse_geodynamics_minisite_data(
+    data: dict[str, Any], fetch_datetime: datetime
+) -> tuple[list[TrackerLogRow], list[PositionRow | None]]:
+    new_tracker_logs: list[TrackerLogRow] = []
+    new_positions: list[PositionRow | None] = []
 
-    trackers = {
-        tracker.tracker_id: tracker for tracker in Tracker.objects.prefetch_related('team', 'organizationmember').all()
-    }
+    trackers = register_trackers({tracker_data['Id']: tracker_data['Name'] for tracker_data in data['Data']})
 
     for tracker_data in data['Data']:
-        tracker_id = tracker_data['Id']
-        tracker_name = tracker_data['Name']
-
-        if tracker_id not in trackers:
-            logger.info(f'Tracker id {tracker_id} not yet in tracker list. Creating new tracker')
-            trackers[tracker_id] = Tracker.objects.create(tracker_id=tracker_id, tracker_name=tracker_name)
-
-        tracker = trackers[tracker_id]
+        tracker = trackers[tracker_data['Id']]
 
         if tracker_data.get('LastLocation') is None:
             continue
@@ -60,45 +97,38 @@ def import_geodynamics_minisite_data(data: dict[str, Any], fetch_datetime: datet
             )
             continue
 
-        point = Point(round(last_location['Longitude'], 6), round(last_location['Latitude'], 6))
-        # if distance(point, tocht_centroid).km > 50:
-        #     logger.info('Location too far away from tocht. Skipping adding log')
-        #     continue
-
-        new_tracker_logs.append(
-            TrackerLog(
-                tracker=tracker,
-                gps_datetime=gps_datetime,
-                source=TrackerLogSource.MINISITE_API,
-                fetch_datetime=fetch_datetime,
-                local_datetime=try_parse_date(last_location.get('LocalDateTime')),
-                last_sync_date=try_parse_date(tracker_data.get('LastSyncDate')),
-                satellites=last_location.get('Satellites'),
-                point=point,
-                analog_input=last_location.get('AnalogInput1'),
-                tracker_type=last_location.get('Type'),
-                heading=last_location.get('Heading'),
-                speed=last_location.get('Speed'),
-                has_gps=tracker_data.get('HasGps'),
-                has_power=tracker_data.get('HasPower'),
-            )
+        tracker_log = TrackerLogRow(
+            tracker_id=tracker.id,
+            gps_datetime=gps_datetime,
+            longitude=round(last_location['Longitude'], 6),
+            latitude=round(last_location['Latitude'], 6),
+            source=TrackerLogSource.MINISITE_API,
+            fetch_datetime=fetch_datetime,
+            local_datetime=try_parse_date(last_location.get('LocalDateTime')),
+            last_sync_date=try_parse_date(tracker_data.get('LastSyncDate')),
+            satellites=last_location.get('Satellites'),
+            analog_input=last_location.get('AnalogInput1'),
+            tracker_type=last_location.get('Type'),
+            heading=last_location.get('Heading'),
+            speed=last_location.get('Speed'),
+            has_gps=tracker_data.get('HasGps'),
+            has_power=tracker_data.get('HasPower'),
         )
-        if hasattr(tracker, 'team') or hasattr(tracker, 'organizationmember'):
-            new_positions.append(
-                Position(
-                    team=getattr(tracker, 'team', None),
-                    organization_member=getattr(tracker, 'organizationmember', None),
-                    timestamp=gps_datetime,
-                    point=point,
-                    source=TrackerLogSource.MINISITE_API,
-                )
-            )
+        new_tracker_logs.append(tracker_log)
+        new_positions.append(_position_row(tracker, tracker_log))
+
+    return new_tracker_logs, new_positions
 
-    tracker_logs = TrackerLog.objects.bulk_create(new_tracker_logs, ignore_conflicts=True)
-    logger.info(f'Created {len(tracker_logs)} tracker logs')
 
-    positions = Position.objects.bulk_create(new_positions, ignore_conflicts=True)
-    logger.info(f'Created {len(positions)} positions')
+def import_geodynamics_minisite_data(data: dict[str, Any], fetch_datetime: datetime | None = None) -> None:
+    if fetch_datetime is None:
+        fetch_datetime = now()
+
+    new_tracker_logs, new_positions = parse_geodynamics_minisite_data(data, fetch_datetime)
+
+    nb_tracker_logs, nb_positions = store_tracker_logs(new_tracker_logs, new_positions)
+    logger.info(f'Created {nb_tracker_logs} tracker logs')
+    logger.info(f'Created {nb_positions} positions')
 
 
 def fetch_geodynamics_minisite_data() -> None:
@@ -106,21 +136,34 @@ def fetch_geodynamics_minisite_data() -> None:
     if url is None:
         logger.warning('GEODYNAMICS_MINISITE_URL is not configured in the settings')
         return
+    use_ingest_stream = Switch.switch_is_active(SWITCH_INGEST_STREAM)
+    if use_ingest_stream and not ingest_stream_has_capacity():
+        logger.warning('Ingest stream is full, skipping fetching the geodynamics minisite')
+        return
+
     logger.info('Fetching tracker data from geodynamics minisite...')
-    response = requests.get(
-        url, params={'_': round(time() * 1000)}, headers={'User-Agent': 'https://github.com/Tijs-B/linker'}
+    fetch_datetime = now()
+    response = send(
+        UpstreamRequest(method='GET', url=url, label='Geodynamics minisite', params={'_': round(time() * 1000)})
     )
     logger.info(f'Geodynamics minisite status {response.status_code}, length {len(response.content)}')
+    response.raise_for_status()
 
-    import_geodynamics_minisite_data(data=response.json())
+    payload = RawPayload(RawPayloadKind.MINISITE, response.content, fetch_datetime)
+    archive_payload(payload)
+    if use_ingest_stream:
+        enqueue_payload(payload)
+    else:
+        import_geodynamics_minisite_data(data=response.json(), fetch_datetime=fetch_datetime)
 
 
-def import_geodynamics_api_data(data: list[dict[str, Any]]) -> None:
-    new_tracker_logs = []
-    new_positions = []
-    trackers = {
-        tracker.tracker_id: tracker for tracker in Tracker.objects.prefetch_related('team', 'organizationmember').all()
-    }
+def import_geodynamics_api_data(data: Iterable[dict[str, Any]]) -> None:
+    new_tracker_logs: list[TrackerLogRow] = []
+    new_positions: list[PositionRow | None] = []
+    nb_tracker_logs = 0
+    nb_positions = 0
+    cursors: dict[int, datetime] = {}
+    trackers = get_tracker_registry()
 
     for item in data:
         tracker_id = item['ResourceId']
@@ -135,36 +178,72 @@ def import_geodynamics_api_data(data: list[dict[str, Any]]) -> None:
             gps_datetime = try_parse_date(position.get('GpsDateTime'))
             if gps_datetime is None:
                 continue
-            point = Point(round(position['Longitude'], 6), round(position['Latitude'], 6))
-            new_tracker_logs.append(
-                TrackerLog(
-                    tracker=tracker,
-                    tracker_type=position.get('Type'),
-                    source=TrackerLogSource.GEODYNAMICS_API,
-                    local_datetime=try_parse_date(position.get('RtcDateTime')),
-                    gps_datetime=gps_datetime,
-                    speed=position.get('Speed'),
-                    heading=position.get('Heading'),
-                    point=point,
-                    satellites=position.get('Satellites'),
-                )
+            if tracker.id not in cursors or gps_datetime > cursors[tracker.id]:
+                cursors[tracker.id] = gps_datetime
+
+            tracker_log = TrackerLogRow(
+                tracker_id=tracker.id,
+                tracker_type=position.get('Type'),
+                source=TrackerLogSource.GEODYNAMICS_API,
+                local_datetime=try_parse_date(position.get('RtcDateTime')),
+                gps_datetime=gps_datetime,
+                speed=position.get('Speed'),
+                heading=position.get('Heading'),
+                longitude=round(position['Longitude'], 6),
+                latitude=round(position['Latitude'], 6),
+                satellites=position.get('Satellites'),
             )
-            if hasattr(tracker, 'team') or hasattr(tracker, 'organizationmember'):
-                new_positions.append(
-                    Position(
-                        team=getattr(tracker, 'team', None),
-                        organization_member=getattr(tracker, 'organizationmember', None),
-                        timestamp=gps_datetime,
-                        point=point,
-                        source=TrackerLogSource.GEODYNAMICS_API,
-                    )
-                )
+            new_tracker_logs.append(tracker_log)
+            new_positions.append(_position_row(tracker, tracker_log))
+
+        # Flush per batch so a large (streamed) response never has to be materialised as a whole
+        if len(new_tracker_logs) >= GEODYNAMICS_IMPORT_BATCH_SIZE:
+            created_logs, created_positions = store_tracker_logs(new_tracker_logs, new_positions)
+            nb_tracker_logs += created_logs
+            nb_positions += created_positions
+            new_tracker_logs = []
+            new_positions = []
+
+    created_logs, created_positions = store_tracker_logs(new_tracker_logs, new_positions)
+    logger.info(f'Created {nb_tracker_logs + created_logs} tracker logs')
+    logger.info(f'Created {nb_positions + created_positions} positions')
 
-    result = TrackerLog.objects.bulk_create(new_tracker_logs, ignore_conflicts=True)
-    logger.info(f'Created {len(result)} tracker logs')
+    # Only advance the cursors once everything is stored, so a failed import is fetched again next time
+    _advance_api_cursors(cursors)
 
-    positions = Position.objects.bulk_create(new_positions, ignore_conflicts=True)
-    logger.info(f'Created {len(positions)} positions')
+
+def _advance_api_cursors(cursors: dict[int, datetime]) -> None:
+    if not cursors:
+        return
+    # A tracker with its clock in the future must not move its cursor past fixes that are still to come
+    current_time = now()
+    cursors = {tracker_id: min(gps_datetime, current_time) for tracker_id, gps_datetime in cursors.items()}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE trackers_tracker
+            SET last_api_gps_datetime = cursors.gps_datetime
+            FROM unnest(%s::bigint[], %s::timestamptz[]) AS cursors(id, gps_datetime)
+            WHERE trackers_tracker.id = cursors.id
+              AND (trackers_tracker.last_api_gps_datetime IS NULL
+                   OR trackers_tracker.last_api_gps_datetime < cursors.gps_datetime)
+            """,
+            [list(cursors.keys()), list(cursors.values())],
+        )
+
+
+def _iter_geodynamics_api_items(responses: list[Response], stream: bool) -> Iterator[dict[str, Any]]:
+    for response in responses:
+        with response:
+            if stream:
+                length = response.headers.get('Content-Length', 'unknown')
+                logger.info(f'Geodynamics api status {response.status_code}, streaming length {length}')
+                response.raise_for_status()
+                yield from iter_json_array(response.iter_content(chunk_size=GEODYNAMICS_API_STREAM_CHUNK_SIZE))
+            else:
+                logger.info(f'Geodynamics api status {response.status_code}, length {len(response.content)}')
+                response.raise_for_status()
+                yield from response.json()
 
 
 def fetch_geodynamics_api_data() -> None:
@@ -176,15 +255,90 @@ def fetch_geodynamics_api_data() -> None:
 
     url = base_url.rstrip('/') + '/api/v1/location/position'
 
-    history_seconds = float(Setting.get_value_for_key(SETTING_GEODYNAMICS_API_HISTORY_SECONDS, default='300'))
-    from_ts = (now() - timedelta(seconds=history_seconds)).astimezone(ZoneInfo('UTC')).isoformat()
-    to_ts = (now() + timedelta(seconds=5)).astimezone(ZoneInfo('UTC')).isoformat()
-    params = {'from': from_ts, 'to': to_ts}
+    use_ingest_stream = Switch.switch_is_active(SWITCH_INGEST_STREAM)
+    if use_ingest_stream and not ingest_stream_has_capacity():
+        logger.warning('Ingest stream is full, skipping fetching the geodynamics API')
+        return
 
-    tracker_ids = list(Tracker.objects.values_list('tracker_id', flat=True))
+    history_seconds = float(Setting.get_value_for_key(SETTING_GEODYNAMICS_API_HISTORY_SECONDS, default='300'))
+    fetch_datetime = now()
+    default_from = fetch_datetime - timedelta(seconds=history_seconds)
+    oldest_from = fetch_datetime - timedelta(seconds=GEODYNAMICS_API_MAX_BACKFILL_SECONDS)
+    to_ts = (fetch_datetime + timedelta(seconds=5)).astimezone(ZoneInfo('UTC')).isoformat()
+
+    # Every tracker only needs the positions after its cursor. Trackers with a similar cursor are grouped, and
+    # each group is requested from the oldest cursor in it. After downtime the gap is fetched automatically.
+    groups: dict[int, list[tuple[str, datetime]]] = {}
+    for tracker_id, cursor in Tracker.objects.values_list('tracker_id', 'last_api_gps_datetime'):
+        if cursor is None:
+            from_datetime = default_from
+        else:
+            from_datetime = max(cursor - timedelta(seconds=GEODYNAMICS_API_CURSOR_OVERLAP_SECONDS), oldest_from)
+        bucket = int(from_datetime.timestamp() // GEODYNAMICS_API_CURSOR_BUCKET_SECONDS)
+        groups.setdefault(bucket, []).append((tracker_id, from_datetime))
+
+    # The ingest stream and the archive store the raw body, so then there is nothing to gain from parsing it while
+    # it arrives
+    keep_body = use_ingest_stream or get_payload_archive() is not None
+    stream = not keep_body and Switch.switch_is_active(SWITCH_STREAM_GEODYNAMICS_API)
+
+    upstream_requests = []
+    for group in groups.values():
+        from_ts = min(from_datetime for _, from_datetime in group).astimezone(ZoneInfo('UTC')).isoformat()
+        logger.info(f'Fetching tracker data from geodynamics API... range {from_ts} - {to_ts}, {len(group)} trackers')
+        for chunk in batched([tracker_id for tracker_id, _ in group], GEODYNAMICS_API_TRACKERS_PER_REQUEST):
+            upstream_requests.append(
+                UpstreamRequest(
+                    method='POST',
+                    url=url,
+                    label='Geodynamics api',
+                    params={'from': from_ts, 'to': to_ts},
+                    json=list(chunk),
+                    auth=auth,
+                    stream=stream,
+                )
+            )
+    responses = send_all(upstream_requests)
 
-    logger.info(f'Fetching tracker data from geodynamics API... range {from_ts} - {to_ts}')
-    response = requests.post(url, params=params, json=tracker_ids, auth=auth)
-    logger.info(f'Geodynamics api status {response.status_code}, length {len(response.content)}')
+    if not keep_body:
+        import_geodynamics_api_data(data=_iter_geodynamics_api_items(responses, stream))
+        return
 
-    import_geodynamics_api_data(data=response.json())
+    payloads = []
+    for response in responses:
+        logger.info(f'Geodynamics api status {response.status_code}, length {len(response.content)}')
+        response.raise_for_status()
+        payload = RawPayload(RawPayloadKind.GEODYNAMICS_API, response.content, fetch_datetime)
+        archive_payload(payload)
+        payloads.append(payload)
+    if use_ingest_stream:
+        for payload in payloads:
+            enqueue_payload(payload)
+    else:
+        import_raw_payloads(payloads)
+
+
+def import_raw_payloads(payloads: list[RawPayload]) -> None:
+    """Import a batch of payloads that were fetched earlier and queued on the ingest stream."""
+    tracker_logs: list[TrackerLogRow] = []
+    positions: list[PositionRow | None] = []
+    api_payloads: list[RawPayload] = []
+
+    for payload in payloads:
+        if payload.kind == RawPayloadKind.MINISITE:
+            new_tracker_logs, new_positions = parse_geodynamics_minisite_data(
+                json.loads(payload.body), payload.fetch_datetime
+            )
+            tracker_logs += new_tracker_logs
+            positions += new_positions
+        elif payload.kind == RawPayloadKind.GEODYNAMICS_API:
+            api_payloads.append(payload)
+        elif payload.kind == RawPayloadKind.PHONE_GPS:
+            import_phone_gps_payload(payload)
+
+    # Consecutive minisite payloads are stored in one go
+    if tracker_logs:
+        nb_tracker_logs, nb_positions = store_tracker_logs(tracker_logs, positions)
+        logger.info(f'Created {nb_tracker_logs} tracker logs and {nb_positions} positions from the minisite')
+    if api_payloads:
+        import_geodynamics_api_data(item for payload in api_payloads for item in json.loads(payload.body))
@@ -9,18 +9,23 @@ from django.db import connection
 from linker.map.models import Basis, Tocht
 from linker.tracing.constants import GEBIED_MAX_DISTANCE
 
+from .constants import POSITION_ROLLUP_RESOLUTIONS
+from .rollups import position_table_sql
+
 HEATMAP_SOURCE_LAYER = 'heatmap'
 HEATMAP_MAXZOOM = 16
+# The heatmap only needs the shape of the tracks, one position per minute is plenty
+HEATMAP_RESOLUTION = POSITION_ROLLUP_RESOLUTIONS['1m']
 
 
-def get_all_tracks() -> str:
-    tocht_centroid = Tocht.centroid()
+def get_all_tracks(resolution: int | None = HEATMAP_RESOLUTION) -> str:
+    tocht_centroid = Tocht.centroid(projected=True)
     centroid_ewkb = tocht_centroid.hexewkb.decode('utf-8') if tocht_centroid else None
-    basis = Basis.objects.get().point
+    basis = Basis.objects.get().point_projected
 
     with connection.cursor() as cursor:
         cursor.execute(
-            """
+            f"""
 SELECT json_build_object(
     'type', 'FeatureCollection',
     'features', COALESCE(json_agg(
@@ -33,21 +38,19 @@ SELECT json_build_object(
 )::text
 FROM (
     SELECT
-        ST_MakeLine(trackers_position.point ORDER BY trackers_position.timestamp) as line
-    FROM trackers_position
+        ST_MakeLine(p.point ORDER BY p.timestamp) as line
+    FROM {position_table_sql(resolution)} p
     WHERE (
-        trackers_position.team_id IS NOT NULL
-        AND (%s IS NULL OR ST_DistanceSphere(trackers_position.point, %s::geometry) < %s)
-        AND ST_DistanceSphere(trackers_position.point, %s::geometry) > %s
-        AND COALESCE((
-            SELECT location FROM people_teamsafetylog
-            WHERE team_id = trackers_position.team_id
-            AND created <= trackers_position.timestamp
-            ORDER BY created DESC
-            LIMIT 1
-        ), '') = ''
+        p.team_id IS NOT NULL
+        AND (%s IS NULL OR ST_DWithin(p.point_projected, %s::geometry, %s))
+        AND NOT ST_DWithin(p.point_projected, %s::geometry, %s)
+        AND NOT EXISTS (
+            SELECT 1 FROM people_teamsafetyinterval
+            WHERE team_id = p.team_id
+            AND during @> p.timestamp
+        )
     )
-    GROUP BY trackers_position.team_id
+    GROUP BY p.team_id
 ) as f
 WHERE f.line IS NOT NULL;
             """,
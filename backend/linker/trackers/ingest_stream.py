@@ -0,0 +1,179 @@
+import os
+import socket
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+from logging import getLogger
+from time import monotonic, time
+
+from redis import Redis, ResponseError
+
+from linker.redis_client import get_redis
+
+from .constants import (
+    INGEST_CLAIM_IDLE_SECONDS,
+    INGEST_CONSUMER_BATCH_SIZE,
+    INGEST_CONSUMER_GROUP,
+    INGEST_MAX_DELIVERIES,
+    INGEST_STREAM_DEAD_LETTER_KEY,
+    INGEST_STREAM_KEY,
+    INGEST_STREAM_MAX_LENGTH,
+    RawPayloadKind,
+)
+
+logger = getLogger(__name__)
+
+StreamMessage = tuple[bytes, dict[bytes, bytes]]
+
+
+@dataclass
+class RawPayload:
+    kind: RawPayloadKind
+    body: bytes
+    fetch_datetime: datetime
+
+
+def ingest_stream_has_capacity() -> bool:
+    return get_redis().xlen(INGEST_STREAM_KEY) < INGEST_STREAM_MAX_LENGTH
+
+
+def enqueue_payload(payload: RawPayload) -> None:
+    get_redis().xadd(
+        INGEST_STREAM_KEY,
+        {'kind': payload.kind.value, 'fetched': payload.fetch_datetime.isoformat(), 'body': payload.body},
+    )
+
+
+def _decode(fields: dict[bytes, bytes]) -> RawPayload:
+    return RawPayload(
+        kind=RawPayloadKind(fields[b'kind'].decode()),
+        body=fields[b'body'],
+        fetch_datetime=datetime.fromisoformat(fields[b'fetched'].decode()),
+    )
+
+
+def _ensure_group(redis: Redis) -> None:
+    try:
+        redis.xgroup_create(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _remove(redis: Redis, message_ids: list[bytes]) -> None:
+    # Acknowledged payloads are deleted, so the length of the stream is the number of payloads still to import
+    pipeline = redis.pipeline()
+    pipeline.xack(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, *message_ids)
+    pipeline.xdel(INGEST_STREAM_KEY, *message_ids)
+    pipeline.execute()
+
+
+def _claim_stale(redis: Redis, consumer: str) -> list[StreamMessage]:
+    # Take over the payloads of consumers that died before acknowledging them
+    _, messages, _ = redis.xautoclaim(
+        INGEST_STREAM_KEY,
+        INGEST_CONSUMER_GROUP,
+        consumer,
+        min_idle_time=INGEST_CLAIM_IDLE_SECONDS * 1000,
+        count=INGEST_CONSUMER_BATCH_SIZE,
+    )
+    if not messages:
+        return []
+
+    pending = redis.xpending_range(
+        INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, min=messages[0][0], max=messages[-1][0], count=len(messages)
+    )
+    times_delivered = {entry['message_id']: entry['times_delivered'] for entry in pending}
+    dead = [
+        (message_id, fields)
+        for message_id, fields in messages
+        if times_delivered.get(message_id, 0) > INGEST_MAX_DELIVERIES
+    ]
+    for message_id, fields in dead:
+        logger.error(
+            f'Ingest payload {message_id!r} failed {INGEST_MAX_DELIVERIES} times, moving it to the dead letters'
+        )
+        redis.xadd(INGEST_STREAM_DEAD_LETTER_KEY, fields, maxlen=1000, approximate=True)
+    if dead:
+        _remove(redis, [message_id for message_id, _ in dead])
+    return [message for message in messages if message not in dead]
+
+
+def _handle_one_by_one(handler: Callable[[list[RawPayload]], None], messages: list[StreamMessage]) -> list[bytes]:
+    # A payload that fails on its own stays pending: it is claimed again later, and moved to the dead letters once it
+    # failed INGEST_MAX_DELIVERIES times. The other payloads of its batch are imported now.
+    imported = []
+    for message_id, fields in messages:
+        try:
+            handler([_decode(fields)])
+        except Exception as e:
+            logger.error(f'Could not import ingest payload {message_id!r}, it is retried later: {e}')
+        else:
+            imported.append(message_id)
+    return imported
+
+
+def consume_ingest_stream(handler: Callable[[list[RawPayload]], None], max_seconds: float) -> int:
+    """Hand batches of payloads to the handler until max_seconds have passed, and return the number of payloads.
+
+    Several consumers can run in parallel: the consumer group delivers every payload to only one of them, and a
+    payload is only removed from the stream once the handler has stored it.
+    """
+    redis = get_redis()
+    _ensure_group(redis)
+    consumer = f'{socket.gethostname()}-{os.getpid()}'
+    deadline = monotonic() + max_seconds
+    nb_payloads = 0
+
+    while monotonic() < deadline:
+        messages = _claim_stale(redis, consumer)
+        if not messages:
+            response = redis.xreadgroup(
+                INGEST_CONSUMER_GROUP,
+                consumer,
+                {INGEST_STREAM_KEY: '>'},
+                count=INGEST_CONSUMER_BATCH_SIZE,
+                block=1000,
+            )
+            messages = response[0][1] if response else []
+        if not messages:
+            continue
+
+        try:
+            handler([_decode(fields) for _, fields in messages])
+            imported = [message_id for message_id, _ in messages]
+        except Exception as e:
+            logger.warning(f'Could not import a batch of {len(messages)} payloads, importing them one by one: {e}')
+            imported = _handle_one_by_one(handler, messages)
+        if imported:
+            _remove(redis, imported)
+        nb_payloads += len(imported)
+
+    return nb_payloads
+
+
+def ingest_stream_metrics() -> dict[str, float]:
+    redis = get_redis()
+    oldest = redis.xrange(INGEST_STREAM_KEY, count=1)
+    if oldest:
+        # Stream ids start with the time in milliseconds at which the payload was added
+        oldest_ms = int(oldest[0][0].split(b'-')[0])
+        lag_seconds = max(0.0, time() - oldest_ms / 1000)
+    else:
+        lag_seconds = 0.0
+
+    try:
+        pending = redis.xpending(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP)['pending']
+        consumers = len(redis.xinfo_consumers(INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP))
+    except ResponseError:
+        # The stream or the group does not exist yet
+        pending = 0
+        consumers = 0
+
+    return {
+        'queue_depth': redis.xlen(INGEST_STREAM_KEY),
+        'pending': pending,
+        'consumers': consumers,
+        'consumer_lag_seconds': lag_seconds,
+        'dead_letters': redis.xlen(INGEST_STREAM_DEAD_LETTER_KEY),
+    }
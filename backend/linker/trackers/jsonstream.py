@@ -0,0 +1,57 @@
+import codecs
+import json
+from collections.abc import Iterable, Iterator
+from itertools import chain
+from typing import Any
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array while it is still being received.
+
+    Only the element that is currently being parsed is kept in memory, not the whole document.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+
+    for chunk in chain(chunks, [None]):
+        final = chunk is None
+        buffer = buffer[pos:] + text_decoder.decode(chunk or b'', final=final)
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError(f'Expected a JSON array, got {buffer[pos]!r}')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ',':
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                # The element is not complete yet, wait for the next chunk
+                break
+            if not final and end == len(buffer) and not isinstance(value, dict | list | str):
+                # A number or literal at the end of the buffer might continue in the next chunk
+                break
+            pos = end
+            yield value
+
+    raise ValueError('Unterminated JSON array')
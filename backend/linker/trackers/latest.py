@@ -0,0 +1,42 @@
+from collections.abc import Iterable
+
+from django.db import connection
+
+# Point the LatestPosition of the given owners at their last position. A concurrent writer that committed a newer
+# position first is never overwritten with an older one.
+REFRESH_LATEST_POSITIONS_SQL = """
+    INSERT INTO trackers_latestposition ({owner_column}, timestamp, end_timestamp, point, source)
+    SELECT owner.id, p.timestamp, p.end_timestamp, p.point, p.source
+    FROM unnest(%s::bigint[]) AS owner(id)
+             CROSS JOIN LATERAL (
+        SELECT timestamp, end_timestamp, point, source
+        FROM trackers_position
+        WHERE {owner_column} = owner.id
+        ORDER BY timestamp DESC
+        LIMIT 1
+        ) p
+    ON CONFLICT ({owner_column}) DO UPDATE SET timestamp     = EXCLUDED.timestamp,
+                                             end_timestamp = EXCLUDED.end_timestamp,
+                                             point         = EXCLUDED.point,
+                                             source        = EXCLUDED.source
+    WHERE EXCLUDED.timestamp >= trackers_latestposition.timestamp
+"""
+
+
+def refresh_latest_positions(owners: Iterable[tuple[int | None, int | None]]) -> None:
+    """Update the LatestPosition of every (team_id, organization_member_id) owner whose positions were written.
+
+    Every code path that inserts or updates positions calls this afterwards, in the same transaction.
+    """
+    team_ids: set[int] = set()
+    member_ids: set[int] = set()
+    for team_id, member_id in owners:
+        if team_id is not None:
+            team_ids.add(team_id)
+        if member_id is not None:
+            member_ids.add(member_id)
+
+    with connection.cursor() as cursor:
+        for owner_column, ids in (('team_id', team_ids), ('organization_member_id', member_ids)):
+            if ids:
+                cursor.execute(REFRESH_LATEST_POSITIONS_SQL.format(owner_column=owner_column), [sorted(ids)])
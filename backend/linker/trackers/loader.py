@@ -0,0 +1,336 @@
+from collections.abc import Sequence
+from datetime import datetime
+from logging import getLogger
+from time import perf_counter
+
+from django.db import connection, transaction
+
+from linker.config.models import Switch
+
+from .compaction import PositionKey, compact_positions, extend_dwells
+from .constants import (
+    SWITCH_COMPACT_POSITIONS,
+    SWITCH_COPY_LOADER,
+    SWITCH_DERIVE_POSITIONS_IN_DATABASE,
+    TRACKER_POSITION_SOURCE_PRECEDENCE,
+    PositionSource,
+)
+from .dedup import get_recent_keys, tracker_log_key
+from .derived import after_positions_written
+from .metrics import record, record_tracker_lag
+from .models import PositionProvenance
+from .rows import PositionRow, TrackerLogRow
+
+logger = getLogger(__name__)
+
+
+TRACKER_LOG_STAGING_SQL = """
+CREATE TEMPORARY TABLE trackerlog_staging (
+    tracker_id bigint,
+    gps_datetime timestamp with time zone,
+    longitude double precision,
+    latitude double precision,
+    source varchar(30),
+    tracker_type integer,
+    fetch_datetime timestamp with time zone,
+    local_datetime timestamp with time zone,
+    last_sync_date timestamp with time zone,
+    satellites integer,
+    analog_input double precision,
+    heading integer,
+    speed integer,
+    has_gps boolean,
+    has_power boolean
+) ON COMMIT DROP
+"""
+
+TRACKER_LOG_MERGE_SQL = """
+INSERT INTO trackers_trackerlog (
+    tracker_id, gps_datetime, point, source, tracker_type, fetch_datetime, local_datetime, last_sync_date,
+    satellites, analog_input, heading, speed, has_gps, has_power
+)
+SELECT
+    tracker_id, gps_datetime, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), source, tracker_type,
+    fetch_datetime, local_datetime, last_sync_date, satellites, analog_input, heading, speed, has_gps, has_power
+FROM trackerlog_staging
+ON CONFLICT DO NOTHING
+"""
+
+POSITION_STAGING_SQL = """
+CREATE TEMPORARY TABLE position_staging (
+    team_id bigint,
+    organization_member_id bigint,
+    timestamp timestamp with time zone,
+    longitude double precision,
+    latitude double precision,
+    source varchar(30),
+    end_timestamp timestamp with time zone
+) ON COMMIT DROP
+"""
+
+# Insert rows that are passed as one array per column, in the order of the fields of TrackerLogRow and PositionRow.
+# Unlike bulk_create with ignore_conflicts, the row count of these statements is the number of rows inserted.
+INSERT_TRACKER_LOGS_SQL = """
+INSERT INTO trackers_trackerlog (
+    tracker_id, gps_datetime, point, source, tracker_type, fetch_datetime, local_datetime, last_sync_date,
+    satellites, analog_input, heading, speed, has_gps, has_power
+)
+SELECT
+    tracker_id, gps_datetime, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), source, tracker_type,
+    fetch_datetime, local_datetime, last_sync_date, satellites, analog_input, heading, speed, has_gps, has_power
+FROM unnest(
+    %s::bigint[], %s::timestamptz[], %s::float8[], %s::float8[], %s::varchar[], %s::integer[], %s::timestamptz[],
+    %s::timestamptz[], %s::timestamptz[], %s::integer[], %s::float8[], %s::integer[], %s::integer[], %s::boolean[],
+    %s::boolean[]
+) AS rows(
+    tracker_id, gps_datetime, longitude, latitude, source, tracker_type, fetch_datetime, local_datetime,
+    last_sync_date, satellites, analog_input, heading, speed, has_gps, has_power
+)
+ON CONFLICT DO NOTHING
+"""
+
+INSERT_POSITIONS_SQL = """
+INSERT INTO trackers_position (team_id, organization_member_id, timestamp, point, source, end_timestamp)
+SELECT
+    team_id, organization_member_id, timestamp, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), source,
+    end_timestamp
+FROM unnest(
+    %s::bigint[], %s::bigint[], %s::timestamptz[], %s::float8[], %s::float8[], %s::varchar[], %s::timestamptz[]
+) AS rows(team_id, organization_member_id, timestamp, longitude, latitude, source, end_timestamp)
+ON CONFLICT DO NOTHING
+"""
+
+_TRACKER_SOURCES_SQL = ', '.join(f"'{source}'" for source in TRACKER_POSITION_SOURCE_PRECEDENCE)
+_PRECEDENCE_SQL = f'ARRAY[{_TRACKER_SOURCES_SQL}]::varchar[]'
+
+
+def _position_merge_sql(positions: str) -> str:
+    # Only positions from tracker feeds are merged like this. A fix that is already stored is replaced when it comes
+    # from a source with precedence.
+    return f"""
+    INSERT INTO trackers_position (team_id, organization_member_id, timestamp, point, source, end_timestamp)
+    SELECT DISTINCT ON (timestamp, team_id, organization_member_id)
+        team_id, organization_member_id, timestamp, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), source,
+        end_timestamp
+    FROM {positions} AS positions
+    ORDER BY timestamp, team_id, organization_member_id, array_position({_PRECEDENCE_SQL}, source)
+    ON CONFLICT (timestamp, team_id, organization_member_id) WHERE source IN ({_TRACKER_SOURCES_SQL})
+    DO UPDATE SET
+        point = EXCLUDED.point,
+        source = EXCLUDED.source,
+        end_timestamp = GREATEST(trackers_position.end_timestamp, EXCLUDED.end_timestamp)
+    WHERE array_position({_PRECEDENCE_SQL}, EXCLUDED.source)
+        < array_position({_PRECEDENCE_SQL}, trackers_position.source)
+    """
+
+
+def _position_provenance_sql(positions: str) -> str:
+    return f"""
+    INSERT INTO trackers_positionprovenance (team_id, organization_member_id, timestamp, source, created)
+    SELECT DISTINCT team_id, organization_member_id, timestamp, source, now()
+    FROM {positions} AS positions
+    ON CONFLICT DO NOTHING
+    """
+
+
+# The positions of the staged tracker logs, owned by whoever has the tracker at the moment of the insert
+OWNED_TRACKER_LOG_POSITIONS_SQL = """(
+    SELECT
+        team.id AS team_id,
+        member.id AS organization_member_id,
+        staging.gps_datetime AS timestamp,
+        staging.longitude,
+        staging.latitude,
+        staging.source,
+        NULL::timestamp with time zone AS end_timestamp
+    FROM trackerlog_staging staging
+    LEFT JOIN people_team team ON team.tracker_id = staging.tracker_id
+    LEFT JOIN people_organizationmember member ON member.tracker_id = staging.tracker_id
+    WHERE team.id IS NOT NULL OR member.id IS NOT NULL
+)"""
+
+POSITION_MERGE_SQL = _position_merge_sql('position_staging')
+POSITION_PROVENANCE_SQL = _position_provenance_sql('position_staging')
+DERIVED_POSITION_MERGE_SQL = _position_merge_sql(OWNED_TRACKER_LOG_POSITIONS_SQL)
+DERIVED_POSITION_PROVENANCE_SQL = _position_provenance_sql(OWNED_TRACKER_LOG_POSITIONS_SQL)
+
+PREFER_POSITION_SOURCE_SQL = f"""
+UPDATE trackers_position
+SET point = ST_SetSRID(ST_MakePoint(preferred.longitude, preferred.latitude), 4326), source = preferred.source
+FROM unnest(%s::bigint[], %s::bigint[], %s::timestamptz[], %s::varchar[], %s::float8[], %s::float8[])
+    AS preferred(team_id, organization_member_id, timestamp, source, longitude, latitude)
+WHERE trackers_position.timestamp = preferred.timestamp
+  AND (trackers_position.team_id = preferred.team_id
+       OR trackers_position.organization_member_id = preferred.organization_member_id)
+  AND trackers_position.source IN ({_TRACKER_SOURCES_SQL})
+  AND array_position({_PRECEDENCE_SQL}, preferred.source) < array_position({_PRECEDENCE_SQL}, trackers_position.source)
+"""
+
+
+def _copy_and_merge(
+    staging_table: str, staging_sql: str, rows: Sequence[tuple], merge_sqls: Sequence[str]
+) -> list[int]:
+    # Return the number of rows affected by every merge statement
+    if not rows:
+        return [0] * len(merge_sqls)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS pg_temp.{staging_table}')
+        cursor.execute(staging_sql)
+        with cursor.copy(f'COPY {staging_table} FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+        nb_rows = []
+        for merge_sql in merge_sqls:
+            cursor.execute(merge_sql)
+            nb_rows.append(cursor.rowcount)
+        return nb_rows
+
+
+def copy_tracker_logs(rows: Sequence[TrackerLogRow]) -> int:
+    return _copy_and_merge(
+        'trackerlog_staging',
+        TRACKER_LOG_STAGING_SQL,
+        [row._replace(source=str(row.source)) for row in rows],
+        [TRACKER_LOG_MERGE_SQL],
+    )[0]
+
+
+def copy_tracker_logs_and_derive_positions(rows: Sequence[TrackerLogRow]) -> tuple[int, int]:
+    """Send every fix to the database once, and derive the positions from the staged tracker logs over there."""
+    nb_tracker_logs, nb_positions, _ = _copy_and_merge(
+        'trackerlog_staging',
+        TRACKER_LOG_STAGING_SQL,
+        [row._replace(source=str(row.source)) for row in rows],
+        [TRACKER_LOG_MERGE_SQL, DERIVED_POSITION_MERGE_SQL, DERIVED_POSITION_PROVENANCE_SQL],
+    )
+    return nb_tracker_logs, nb_positions
+
+
+def copy_positions(rows: Sequence[PositionRow]) -> int:
+    return _copy_and_merge(
+        'position_staging',
+        POSITION_STAGING_SQL,
+        [row._replace(source=str(row.source)) for row in rows],
+        [POSITION_MERGE_SQL, POSITION_PROVENANCE_SQL],
+    )[0]
+
+
+def _insert_columns(sql: str, rows: Sequence[tuple]) -> int:
+    if not rows:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(column) for column in zip(*rows, strict=True)])
+        return cursor.rowcount
+
+
+def insert_tracker_logs(rows: Sequence[TrackerLogRow]) -> int:
+    """Insert the tracker logs that are not stored yet, and return their number."""
+    return _insert_columns(INSERT_TRACKER_LOGS_SQL, [row._replace(source=str(row.source)) for row in rows])
+
+
+def insert_positions(rows: Sequence[PositionRow]) -> int:
+    """Insert the positions that are not stored yet, and return their number."""
+    return _insert_columns(INSERT_POSITIONS_SQL, [row._replace(source=str(row.source)) for row in rows])
+
+
+def _source_rank(source: str) -> int:
+    return TRACKER_POSITION_SOURCE_PRECEDENCE.index(PositionSource(source))
+
+
+def bulk_create_positions(rows: Sequence[PositionRow]) -> int:
+    # Within the batch, keep every fix from the source with precedence
+    preferred: dict[tuple[int | None, int | None, datetime], PositionRow] = {}
+    for row in rows:
+        key = (row.team_id, row.organization_member_id, row.timestamp)
+        if key not in preferred or _source_rank(row.source) < _source_rank(preferred[key].source):
+            preferred[key] = row
+
+    provenance = [
+        PositionProvenance(
+            team_id=row.team_id,
+            organization_member_id=row.organization_member_id,
+            timestamp=row.timestamp,
+            source=row.source,
+        )
+        for row in rows
+    ]
+    # Fixes that were stored before from a source without precedence are replaced afterwards
+    lowest_rank = len(TRACKER_POSITION_SOURCE_PRECEDENCE) - 1
+    upgrades = [row for row in preferred.values() if _source_rank(row.source) < lowest_rank]
+
+    with transaction.atomic():
+        nb_positions = insert_positions(list(preferred.values()))
+        if upgrades:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    PREFER_POSITION_SOURCE_SQL,
+                    [
+                        [row.team_id for row in upgrades],
+                        [row.organization_member_id for row in upgrades],
+                        [row.timestamp for row in upgrades],
+                        [str(row.source) for row in upgrades],
+                        [row.longitude for row in upgrades],
+                        [row.latitude for row in upgrades],
+                    ],
+                )
+        PositionProvenance.objects.bulk_create(provenance, ignore_conflicts=True)
+    return nb_positions
+
+
+def use_copy_loader() -> bool:
+    return connection.vendor == 'postgresql' and Switch.switch_is_active(SWITCH_COPY_LOADER)
+
+
+def store_tracker_logs(
+    tracker_log_rows: Sequence[TrackerLogRow], position_rows: Sequence[PositionRow | None]
+) -> tuple[int, int]:
+    # position_rows[i] is the position of tracker_log_rows[i], or None if the tracker is not in use
+    recent_keys = get_recent_keys()
+    keys = [
+        tracker_log_key(row.tracker_id, row.gps_datetime, row.tracker_type, str(row.source)) for row in tracker_log_rows
+    ]
+    seen = recent_keys.seen(keys)
+
+    new_tracker_logs = [row for row, is_seen in zip(tracker_log_rows, seen, strict=True) if not is_seen]
+    new_positions = [row for row, is_seen in zip(position_rows, seen, strict=True) if row is not None and not is_seen]
+    start = perf_counter()
+    # Tracker logs are always stored as they were received, only their positions are compacted
+    compact = Switch.switch_is_active(SWITCH_COMPACT_POSITIONS)
+    fixes = new_positions
+    dwell_ends: dict[PositionKey, datetime] = {}
+    with transaction.atomic():
+        if compact:
+            new_positions, dwell_ends = compact_positions(new_positions)
+        if use_copy_loader() and not compact and Switch.switch_is_active(SWITCH_DERIVE_POSITIONS_IN_DATABASE):
+            nb_tracker_logs, nb_positions = copy_tracker_logs_and_derive_positions(new_tracker_logs)
+        elif use_copy_loader():
+            nb_tracker_logs = copy_tracker_logs(new_tracker_logs)
+            nb_positions = copy_positions(new_positions)
+        else:
+            nb_tracker_logs = insert_tracker_logs(new_tracker_logs)
+            nb_positions = bulk_create_positions(new_positions)
+        # Recent trails keep every fix, also the ones that are folded into a dwell
+        after_positions_written(fixes, extend_dwells(dwell_ends))
+        # Only remember the keys once the logs are committed, a rolled back outer transaction must not skip them
+        new_keys = [key for key, is_seen in zip(keys, seen, strict=True) if not is_seen]
+        transaction.on_commit(lambda: recent_keys.add(new_keys))
+    insert_ms = (perf_counter() - start) * 1000
+
+    record(
+        insert_ms=insert_ms,
+        rows=len(tracker_log_rows),
+        inserted_tracker_logs=nb_tracker_logs,
+        inserted_positions=nb_positions,
+        duplicates=len(tracker_log_rows) - nb_tracker_logs,
+    )
+    newest_gps_timestamps: dict[int, float] = {}
+    for row in new_tracker_logs:
+        gps_timestamp = row.gps_datetime.timestamp()
+        if gps_timestamp > newest_gps_timestamps.get(row.tracker_id, 0):
+            newest_gps_timestamps[row.tracker_id] = gps_timestamp
+    record_tracker_lag(newest_gps_timestamps)
+
+    logger.info(
+        f'Skipped {sum(seen)} recently seen tracker logs (dedup hits {recent_keys.hits}, misses {recent_keys.misses})'
+    )
+    return nb_tracker_logs, nb_positions
@@ -0,0 +1,266 @@
+# Old tracker logs are moved out of the database into a columnar archive: one directory per tracker per day (UTC),
+# with one file per column holding a plain array of fixed-width values in native byte order. The files can be memory
+# mapped and read as typed memoryviews without copying or parsing. Missing values are stored as a sentinel: NaN for
+# floats and the smallest value of the type for integers, timestamps and booleans.
+
+import mmap
+import os
+import shutil
+import tempfile
+from array import array
+from collections.abc import Iterator
+from contextlib import ExitStack
+from datetime import UTC, date, datetime, time, timedelta
+from logging import getLogger
+from math import isnan
+from pathlib import Path
+from typing import Any, Self
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+
+from .constants import TrackerLogSource
+from .models import TrackerLog
+from .partitions import get_partitions
+
+logger = getLogger(__name__)
+
+# Column: array typecode
+COLUMNS = {
+    'gps_datetime': 'q',
+    'longitude': 'd',
+    'latitude': 'd',
+    'source': 'b',
+    'tracker_type': 'i',
+    'fetch_datetime': 'q',
+    'local_datetime': 'q',
+    'last_sync_date': 'q',
+    'satellites': 'i',
+    'analog_input': 'd',
+    'heading': 'i',
+    'speed': 'i',
+    'has_gps': 'b',
+    'has_power': 'b',
+}
+# The columns that are stored as they are in TrackerLog, the point is split in longitude and latitude
+FIELDS = [column for column in COLUMNS if column not in ('longitude', 'latitude')]
+DATETIME_COLUMNS = ('gps_datetime', 'fetch_datetime', 'local_datetime', 'last_sync_date')
+BOOLEAN_COLUMNS = ('has_gps', 'has_power')
+SOURCES = list(TrackerLogSource)
+MISSING = {'q': -(2**63), 'i': -(2**31), 'b': -128, 'd': float('nan')}
+
+ColumnData = dict[str, Any]
+
+
+def get_tracker_log_archive_path() -> Path | None:
+    return Path(settings.TRACKER_LOG_ARCHIVE_PATH) if settings.TRACKER_LOG_ARCHIVE_PATH else None
+
+
+def _day_directory(archive_path: Path, tracker_id: int, day: date) -> Path:
+    return archive_path / str(tracker_id) / f'{day:%Y%m%d}'
+
+
+def _to_microseconds(value: datetime) -> int:
+    return (value - datetime(1970, 1, 1, tzinfo=UTC)) // timedelta(microseconds=1)
+
+
+def _from_microseconds(value: int) -> datetime:
+    return datetime(1970, 1, 1, tzinfo=UTC) + timedelta(microseconds=value)
+
+
+def _encode(log: dict[str, Any]) -> dict[str, Any]:
+    values = {**log, 'longitude': log['point'].x, 'latitude': log['point'].y, 'source': SOURCES.index(log['source'])}
+    for column in DATETIME_COLUMNS:
+        if values[column] is not None:
+            values[column] = _to_microseconds(values[column])
+    for column in BOOLEAN_COLUMNS:
+        if values[column] is not None:
+            values[column] = int(values[column])
+    return {
+        column: MISSING[typecode] if values[column] is None else values[column] for column, typecode in COLUMNS.items()
+    }
+
+
+def _decode(tracker_id: int, columns: ColumnData, index: int) -> dict[str, Any]:
+    values: dict[str, Any] = {}
+    for column, typecode in COLUMNS.items():
+        value = columns[column][index]
+        missing = isnan(value) if typecode == 'd' else value == MISSING[typecode]
+        values[column] = None if missing else value
+    for column in DATETIME_COLUMNS:
+        if values[column] is not None:
+            values[column] = _from_microseconds(values[column])
+    for column in BOOLEAN_COLUMNS:
+        if values[column] is not None:
+            values[column] = bool(values[column])
+    point = Point(values.pop('longitude'), values.pop('latitude'), srid=4326)
+    return {'tracker_id': tracker_id, 'point': point, **values, 'source': SOURCES[values['source']]}
+
+
+def _read_arrays(directory: Path) -> dict[str, array]:
+    columns = {}
+    for column, typecode in COLUMNS.items():
+        values = array(typecode)
+        values.frombytes((directory / column).read_bytes())
+        columns[column] = values
+    return columns
+
+
+def _write_day(directory: Path, logs: list[dict[str, Any]]) -> None:
+    encoded = [_encode(log) for log in logs]
+    if directory.exists():
+        # Logs of this day were archived before: merge them, the newly archived log wins
+        existing = _read_arrays(directory)
+        nb_existing = len(existing['gps_datetime'])
+        encoded = [{column: existing[column][i] for column in COLUMNS} for i in range(nb_existing)] + encoded
+    unique = {(row['gps_datetime'], row['tracker_type']): row for row in encoded}
+    rows = sorted(unique.values(), key=lambda row: row['gps_datetime'])
+
+    # Write a complete new directory next to the old one and swap them, so readers never see a partial day
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    new_directory = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f'.{directory.name}-'))
+    for column, typecode in COLUMNS.items():
+        with (new_directory / column).open('wb') as file:
+            array(typecode, (row[column] for row in rows)).tofile(file)
+            file.flush()
+            os.fsync(file.fileno())
+    if directory.exists():
+        old_directory = directory.with_name(f'.{directory.name}-old')
+        directory.rename(old_directory)
+        new_directory.rename(directory)
+        shutil.rmtree(old_directory)
+    else:
+        new_directory.rename(directory)
+
+
+def archive_tracker_logs(before: date, archive_path: Path | None = None) -> int:
+    """Move the tracker logs of the days before the given day (UTC) into the archive, and return their number.
+
+    Every day is archived and deleted on its own. A day with its own partition is dropped as a whole, the logs of
+    other days are deleted. If deleting fails after the files were written, archiving again merges the same logs into
+    the files without duplicating them.
+    """
+    archive_path = archive_path or get_tracker_log_archive_path()
+    if archive_path is None:
+        raise ValueError('TRACKER_LOG_ARCHIVE_PATH is not configured')
+
+    table = TrackerLog._meta.db_table
+    end = datetime.combine(before, time.min, tzinfo=UTC)
+    nb_archived = 0
+    # Jump from day to day with data, there can be months between two editions
+    while first := TrackerLog.objects.filter(gps_datetime__lt=end).order_by('gps_datetime').first():
+        day = first.gps_datetime.astimezone(UTC).date()
+        day_start = datetime.combine(day, time.min, tzinfo=UTC)
+        day_end = day_start + timedelta(days=1)
+        with transaction.atomic(), connection.cursor() as cursor:
+            partition = get_partitions(cursor, table).get(day)
+            if partition is not None:
+                # No logs can be added to the partition between reading and dropping it
+                cursor.execute(f'LOCK TABLE {partition} IN SHARE MODE')
+            logs = TrackerLog.objects.filter(gps_datetime__gte=day_start, gps_datetime__lt=day_end)
+            by_tracker: dict[int, list[dict[str, Any]]] = {}
+            for log in logs.values('tracker_id', 'point', *FIELDS):
+                by_tracker.setdefault(log['tracker_id'], []).append(log)
+            for tracker_id, tracker_logs in by_tracker.items():
+                _write_day(_day_directory(archive_path, tracker_id, day), tracker_logs)
+            if partition is not None:
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {partition}')
+                cursor.execute(f'DROP TABLE {partition}')
+                deleted = sum(len(tracker_logs) for tracker_logs in by_tracker.values())
+            else:
+                deleted, _ = logs.delete()
+        nb_archived += deleted
+        logger.info(f'Archived {deleted} tracker logs of {day}')
+    return nb_archived
+
+
+class ArchivedDay:
+    """The archived tracker logs of one tracker on one day, as memory-mapped columns.
+
+    Every column is a memoryview of its typed values, sorted by gps_datetime. Use it as a context manager, the
+    columns can not be used after it is closed.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._stack = ExitStack()
+        self.columns: ColumnData = {}
+
+    def __enter__(self) -> Self:
+        for column, typecode in COLUMNS.items():
+            path = self.directory / column
+            if path.stat().st_size == 0:
+                # An empty file can not be mapped
+                self.columns[column] = memoryview(array(typecode))
+                continue
+            file = self._stack.enter_context(path.open('rb'))
+            mapped = self._stack.enter_context(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            buffer = memoryview(mapped)
+            self._stack.callback(buffer.release)
+            view = buffer.cast(typecode)
+            self._stack.callback(view.release)
+            self.columns[column] = view
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._stack.close()
+
+    def __len__(self) -> int:
+        return len(self.columns['gps_datetime'])
+
+
+def open_archived_day(tracker_id: int, day: date, archive_path: Path | None = None) -> ArchivedDay | None:
+    archive_path = archive_path or get_tracker_log_archive_path()
+    if archive_path is None:
+        return None
+    directory = _day_directory(archive_path, tracker_id, day)
+    return ArchivedDay(directory) if directory.exists() else None
+
+
+def archived_days(tracker_id: int, archive_path: Path | None = None) -> list[date]:
+    archive_path = archive_path or get_tracker_log_archive_path()
+    if archive_path is None or not (archive_path / str(tracker_id)).is_dir():
+        return []
+    days = []
+    for directory in (archive_path / str(tracker_id)).iterdir():
+        try:
+            days.append(datetime.strptime(directory.name, '%Y%m%d').date())
+        except ValueError:
+            # Directories that start with a dot are being written, other names are not part of the archive
+            continue
+    return sorted(days)
+
+
+def iter_archived_tracker_logs(
+    tracker_id: int, start: datetime | None = None, end: datetime | None = None, archive_path: Path | None = None
+) -> Iterator[dict[str, Any]]:
+    """Yield the archived logs of a tracker from start until end, as dicts like TrackerLog.objects.values()."""
+    start_us = _to_microseconds(start) if start is not None else MISSING['q']
+    end_us = _to_microseconds(end) if end is not None else -MISSING['q']
+    for day in archived_days(tracker_id, archive_path):
+        if (start is not None and day < start.astimezone(UTC).date()) or (
+            end is not None and day > end.astimezone(UTC).date()
+        ):
+            continue
+        archived_day = open_archived_day(tracker_id, day, archive_path)
+        if archived_day is None:
+            continue
+        with archived_day:
+            gps_datetimes = archived_day.columns['gps_datetime']
+            for index in range(len(archived_day)):
+                if start_us <= gps_datetimes[index] < end_us:
+                    yield _decode(tracker_id, archived_day.columns, index)
+
+
+def iter_tracker_logs(
+    tracker_id: int, start: datetime | None = None, end: datetime | None = None
+) -> Iterator[dict[str, Any]]:
+    """Yield the logs of a tracker from start until end, from the archive and from the database, by gps_datetime."""
+    yield from iter_archived_tracker_logs(tracker_id, start, end)
+    live = TrackerLog.objects.filter(tracker_id=tracker_id)
+    if start is not None:
+        live = live.filter(gps_datetime__gte=start)
+    if end is not None:
+        live = live.filter(gps_datetime__lt=end)
+    yield from live.order_by('gps_datetime').values('tracker_id', 'point', *FIELDS).iterator()
@@ -0,0 +1,233 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from logging import getLogger
+from threading import Lock
+from time import perf_counter, time
+
+from redis import RedisError
+
+from linker.redis_client import get_redis
+
+from .constants import INGEST_STALE_SECONDS, TRACKER_LAG_MAX_AGE_SECONDS
+from .ingest_stream import ingest_stream_metrics
+from .position_buffer import position_buffer_metrics
+
+logger = getLogger(__name__)
+
+RUN_KEY_PREFIX = 'linker:metrics:ingest:'
+TRACKER_LAG_KEY = 'linker:metrics:tracker-lag'
+TRACKER_LAG_UPDATED_KEY = 'linker:metrics:tracker-lag-updated'
+FRESHNESS_KEY = 'linker:metrics:freshness'
+
+# Counters that are added up over all runs, next to the values of the last run
+TOTALS = ('rows', 'inserted_tracker_logs', 'inserted_positions', 'duplicates', 'payload_bytes')
+
+
+@dataclass
+class IngestRun:
+    source: str
+    fetch_ms: float = 0
+    payload_bytes: int = 0
+    insert_ms: float = 0
+    rows: int = 0
+    inserted_tracker_logs: int = 0
+    inserted_positions: int = 0
+    duplicates: int = 0
+    newest_gps_timestamp: float = 0
+    tracker_lag_seconds: dict[int, float] = field(default_factory=dict)
+    # Upstream requests are sent from several threads
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def add(self, **values: float) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+_current_run: ContextVar[IngestRun | None] = ContextVar('current_ingest_run', default=None)
+
+
+def record(**values: float) -> None:
+    """Add to the counters of the ingestion run that is in progress, if any."""
+    run = _current_run.get()
+    if run is not None:
+        run.add(**values)
+
+
+def record_tracker_lag(newest_gps_timestamps: dict[int, float]) -> None:
+    run = _current_run.get()
+    if run is None or not newest_gps_timestamps:
+        return
+    committed = time()
+    # A tracker with its clock in the future would otherwise keep the readiness check fresh until that moment
+    newest_gps_timestamps = {
+        tracker_pk: min(gps_timestamp, committed) for tracker_pk, gps_timestamp in newest_gps_timestamps.items()
+    }
+    with run._lock:
+        for tracker_pk, gps_timestamp in newest_gps_timestamps.items():
+            run.tracker_lag_seconds[tracker_pk] = committed - gps_timestamp
+        run.newest_gps_timestamp = max(run.newest_gps_timestamp, *newest_gps_timestamps.values())
+
+
+def _save_run(run: IngestRun, duration_ms: float, success: bool) -> None:
+    key = RUN_KEY_PREFIX + run.source
+    pipeline = get_redis().pipeline()
+    if success:
+        pipeline.hset(
+            key,
+            mapping={
+                'duration_ms': duration_ms,
+                'fetch_ms': run.fetch_ms,
+                'insert_ms': run.insert_ms,
+                # Everything that is not waiting for Geodynamics or the database, which is mostly parsing
+                'parse_ms': max(0.0, duration_ms - run.fetch_ms - run.insert_ms),
+                **{name: getattr(run, name) for name in TOTALS},
+                'last_success': time(),
+            },
+        )
+        for name in TOTALS:
+            pipeline.hincrby(key, f'{name}_total', getattr(run, name))
+        pipeline.hincrby(key, 'runs_total', 1)
+        if run.tracker_lag_seconds:
+            pipeline.hset(TRACKER_LAG_KEY, mapping=run.tracker_lag_seconds)
+            pipeline.zadd(TRACKER_LAG_UPDATED_KEY, dict.fromkeys(run.tracker_lag_seconds, time()))
+        if run.newest_gps_timestamp:
+            pipeline.zadd(FRESHNESS_KEY, {'gps': run.newest_gps_timestamp}, gt=True)
+    else:
+        pipeline.hincrby(key, 'failures_total', 1)
+    pipeline.execute()
+    _prune_tracker_lag()
+
+
+def _prune_tracker_lag() -> None:
+    redis = get_redis()
+    stale = redis.zrangebyscore(TRACKER_LAG_UPDATED_KEY, '-inf', time() - TRACKER_LAG_MAX_AGE_SECONDS)
+    if stale:
+        pipeline = redis.pipeline()
+        pipeline.hdel(TRACKER_LAG_KEY, *stale)
+        pipeline.zrem(TRACKER_LAG_UPDATED_KEY, *stale)
+        pipeline.execute()
+
+
+@contextmanager
+def ingest_run(source: str) -> Iterator[IngestRun]:
+    """Collect the metrics of one fetch or import and store them in Redis afterwards."""
+    run = IngestRun(source=source)
+    token = _current_run.set(run)
+    start = perf_counter()
+    success = False
+    try:
+        yield run
+        success = True
+    finally:
+        _current_run.reset(token)
+        duration_ms = (perf_counter() - start) * 1000
+        try:
+            _save_run(run, duration_ms, success)
+        except RedisError as e:
+            # Metrics should never make an import fail
+            logger.warning(f'Could not save the ingestion metrics of {source}: {e}')
+
+
+def _decode_hash(values: dict[bytes, bytes]) -> dict[str, float]:
+    return {name.decode(): float(value) for name, value in values.items()}
+
+
+def get_run_metrics() -> dict[str, dict[str, float]]:
+    redis = get_redis()
+    return {
+        key.decode().removeprefix(RUN_KEY_PREFIX): _decode_hash(redis.hgetall(key))
+        for key in redis.scan_iter(match=RUN_KEY_PREFIX + '*')
+    }
+
+
+def ingestion_status(sources: list[str]) -> dict[str, object]:
+    """Tell whether the given sources ran successfully and positions came in during the last INGEST_STALE_SECONDS."""
+    runs = get_run_metrics()
+    now = time()
+    last_success = max((runs.get(source, {}).get('last_success', 0) for source in sources), default=0)
+    newest_gps = get_redis().zscore(FRESHNESS_KEY, 'gps') or 0
+
+    problems = []
+    if sources and now - last_success > INGEST_STALE_SECONDS:
+        problems.append(f'no successful ingestion run in the last {INGEST_STALE_SECONDS} seconds')
+    if sources and now - newest_gps > INGEST_STALE_SECONDS:
+        problems.append(f'no new tracker logs in the last {INGEST_STALE_SECONDS} seconds')
+    return {
+        'ready': not problems,
+        'problems': problems,
+        'last_success_age_seconds': round(now - last_success) if last_success else None,
+        'newest_tracker_log_age_seconds': round(now - newest_gps) if newest_gps else None,
+    }
+
+
+RUN_GAUGES = {
+    'duration_ms': ('linker_ingest_last_run_duration_seconds', 0.001),
+    'fetch_ms': ('linker_ingest_last_run_fetch_seconds', 0.001),
+    'parse_ms': ('linker_ingest_last_run_parse_seconds', 0.001),
+    'insert_ms': ('linker_ingest_last_run_insert_seconds', 0.001),
+    'payload_bytes': ('linker_ingest_last_run_payload_bytes', 1),
+    'rows': ('linker_ingest_last_run_rows', 1),
+    'inserted_tracker_logs': ('linker_ingest_last_run_inserted_tracker_logs', 1),
+    'inserted_positions': ('linker_ingest_last_run_inserted_positions', 1),
+    'duplicates': ('linker_ingest_last_run_duplicates', 1),
+    'last_success': ('linker_ingest_last_success_timestamp_seconds', 1),
+}
+RUN_COUNTERS = {
+    'runs_total': 'linker_ingest_runs_total',
+    'failures_total': 'linker_ingest_failures_total',
+    'rows_total': 'linker_ingest_rows_total',
+    'inserted_tracker_logs_total': 'linker_ingest_inserted_tracker_logs_total',
+    'inserted_positions_total': 'linker_ingest_inserted_positions_total',
+    'duplicates_total': 'linker_ingest_duplicates_total',
+    'payload_bytes_total': 'linker_ingest_payload_bytes_total',
+}
+
+
+def render_prometheus_metrics() -> str:
+    redis = get_redis()
+    runs = get_run_metrics()
+    lines = []
+
+    def add_metric(name: str, metric_type: str, samples: list[tuple[str, float]]) -> None:
+        if not samples:
+            return
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(f'{name}{labels} {value:g}' for labels, value in samples)
+
+    for field_name, (name, scale) in RUN_GAUGES.items():
+        samples = [
+            (f'{{source="{source}"}}', values[field_name] * scale)
+            for source, values in sorted(runs.items())
+            if field_name in values
+        ]
+        add_metric(name, 'gauge', samples)
+    for field_name, name in RUN_COUNTERS.items():
+        samples = [
+            (f'{{source="{source}"}}', values[field_name])
+            for source, values in sorted(runs.items())
+            if field_name in values
+        ]
+        add_metric(name, 'counter', samples)
+
+    tracker_lag = _decode_hash(redis.hgetall(TRACKER_LAG_KEY))
+    add_metric(
+        'linker_ingest_tracker_lag_seconds',
+        'gauge',
+        [(f'{{tracker="{tracker_pk}"}}', lag) for tracker_pk, lag in sorted(tracker_lag.items())],
+    )
+
+    newest_gps = redis.zscore(FRESHNESS_KEY, 'gps')
+    if newest_gps is not None:
+        add_metric('linker_ingest_newest_tracker_log_timestamp_seconds', 'gauge', [('', newest_gps)])
+
+    for name, value in ingest_stream_metrics().items():
+        add_metric(f'linker_ingest_stream_{name}', 'gauge', [('', value)])
+
+    for name, value in position_buffer_metrics().items():
+        metric_type = 'counter' if name.endswith('_total') else 'gauge'
+        add_metric(f'linker_position_buffer_{name}', metric_type, [('', value)])
+
+    return '\n'.join(lines) + '\n'
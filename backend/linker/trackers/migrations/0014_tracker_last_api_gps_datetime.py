@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0013_fix_position_unique_constraint_nulls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracker',
+            name='last_api_gps_datetime',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.db.models.deletion
+import django.utils.timezone
+import enumfields.fields
+from django.db import migrations, models
+
+import linker.trackers.constants
+
+
+def collapse_tracker_positions(apps, schema_editor):
+    # Remember which sources reported every fix, then keep only the position of the source with precedence.
+    schema_editor.execute("""
+        INSERT INTO trackers_positionprovenance (team_id, organization_member_id, timestamp, source, created)
+        SELECT team_id, organization_member_id, timestamp, source, now()
+        FROM trackers_position
+        WHERE source IN ('geodynamics_api', 'minisite_api')
+        ON CONFLICT DO NOTHING
+    """)
+    schema_editor.execute("""
+        DELETE FROM trackers_position p
+        USING trackers_position preferred
+        WHERE p.source = 'minisite_api'
+          AND preferred.source = 'geodynamics_api'
+          AND p.timestamp = preferred.timestamp
+          AND p.team_id IS NOT DISTINCT FROM preferred.team_id
+          AND p.organization_member_id IS NOT DISTINCT FROM preferred.organization_member_id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0017_organizationmember_tracker_token'),
+        ('trackers', '0014_tracker_last_api_gps_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionProvenance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('source', enumfields.fields.EnumField(enum=linker.trackers.constants.PositionSource, max_length=30)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    'organization_member',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='people.organizationmember',
+                    ),
+                ),
+                (
+                    'team',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='people.team',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(
+                        fields=('timestamp', 'source', 'team', 'organization_member'),
+                        name='positionprovenance_unique_timestamp_source_owner',
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(collapse_tracker_positions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='position',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('source__in', ('geodynamics_api', 'minisite_api'))),
+                fields=('timestamp', 'team', 'organization_member'),
+                name='position_unique_tracker_fix_owner',
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0015_positionprovenance_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='end_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
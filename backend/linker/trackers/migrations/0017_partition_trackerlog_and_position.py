@@ -0,0 +1,113 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+from datetime import UTC, datetime, time, timedelta
+
+from django.db import migrations
+from django.utils.timezone import now
+
+# Copies of the values in linker.trackers, a migration must not change when the application code does
+PARTITIONED_TABLES = {
+    'trackers_trackerlog': 'gps_datetime',
+    'trackers_position': 'timestamp',
+}
+PARTITION_DAYS_AHEAD = 7
+
+
+def create_partitions(cursor, table, days):
+    for day in sorted(set(days)):
+        start = datetime.combine(day, time.min, tzinfo=UTC)
+        end = start + timedelta(days=1)
+        cursor.execute(
+            f"CREATE TABLE {table}_p{day:%Y%m%d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+
+def rebuild_table(cursor, table, partition_column):
+    """Copy the table into a new table that is partitioned by day on partition_column, or not when it is None."""
+    # Remember the constraints and indexes, to create them again once the data is copied
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('c', 'f', 'u', 'x')
+        ORDER BY conname
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef
+        FROM pg_indexes
+        WHERE tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        ORDER BY indexname
+        """,
+        [table, table],
+    )
+    indexes = [indexdef.replace(' ON ONLY ', ' ON ') for (indexdef,) in cursor.fetchall()]
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+    (next_id,) = cursor.fetchone()
+    # Older tables have a serial id, whose sequence is kept, newer ones an identity column, which is created again
+    cursor.execute(
+        "SELECT attidentity <> '', pg_get_serial_sequence(%s, 'id') FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attname = 'id'",
+        [table, table],
+    )
+    is_identity, sequence = cursor.fetchone()
+
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    create_table = f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING STORAGE)'
+    if partition_column is None:
+        cursor.execute(create_table)
+    else:
+        cursor.execute(f'{create_table} PARTITION BY RANGE ("{partition_column}")')
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        cursor.execute(f'SELECT DISTINCT ("{partition_column}" AT TIME ZONE \'UTC\')::date FROM {table}_old')
+        days = [day for (day,) in cursor.fetchall()]
+        today = now().astimezone(UTC).date()
+        days += [today + timedelta(days=offset) for offset in range(PARTITION_DAYS_AHEAD + 1)]
+        create_partitions(cursor, table, days)
+
+    cursor.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+    if is_identity:
+        cursor.execute(f'ALTER TABLE {table} ALTER COLUMN id RESTART WITH {next_id}')
+    else:
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    cursor.execute(f'DROP TABLE {table}_old CASCADE')
+
+    primary_key = 'id' if partition_column is None else f'id, "{partition_column}"'
+    cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key})')
+    for name, definition in constraints:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+
+
+def partition_tables(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES.items():
+            rebuild_table(cursor, table, column)
+
+
+def unpartition_tables(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            rebuild_table(cursor, table, None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0016_position_end_timestamp'),
+    ]
+
+    operations = [
+        # The primary key in the database becomes (id, partition column), because a primary key of a partitioned
+        # table must include the partition column. Django keeps id as the primary key of the models.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(partition_tables, unpartition_tables)],
+            state_operations=[],
+        ),
+    ]
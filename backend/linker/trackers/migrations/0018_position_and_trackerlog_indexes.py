@@ -0,0 +1,59 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0017_partition_trackerlog_and_position'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='position',
+            name='trackers_po_team_id_296f1a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='position',
+            name='trackers_po_organiz_b1002f_idx',
+        ),
+        migrations.AlterField(
+            model_name='trackerlog',
+            name='gps_datetime',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='trackerlog',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['gps_datetime'], name='trackerlog_gps_datetime_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(
+                fields=['team', '-timestamp'],
+                include=('point', 'source', 'end_timestamp'),
+                name='position_team_latest_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(
+                fields=['organization_member', '-timestamp'],
+                include=('point', 'source', 'end_timestamp'),
+                name='position_member_latest_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='position_timestamp_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=django.contrib.postgres.indexes.BrinIndex(
+                django.db.models.functions.comparison.Coalesce('end_timestamp', 'timestamp'),
+                name='position_last_seen_brin',
+            ),
+        ),
+    ]
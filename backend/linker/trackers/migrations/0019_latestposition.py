@@ -0,0 +1,76 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+import enumfields.fields
+from django.db import migrations, models
+
+import linker.trackers.constants
+
+
+def fill_latest_positions(apps, schema_editor):
+    schema_editor.execute("""
+        INSERT INTO trackers_latestposition (team_id, organization_member_id, timestamp, end_timestamp, point, source)
+        SELECT DISTINCT ON (team_id, organization_member_id) team_id,
+                                                             organization_member_id,
+                                                             timestamp,
+                                                             end_timestamp,
+                                                             point,
+                                                             source
+        FROM trackers_position
+        ORDER BY team_id, organization_member_id, timestamp DESC
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0017_organizationmember_tracker_token'),
+        ('trackers', '0018_position_and_trackerlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('source', enumfields.fields.EnumField(enum=linker.trackers.constants.PositionSource, max_length=30)),
+                ('end_timestamp', models.DateTimeField(blank=True, null=True)),
+                (
+                    'organization_member',
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='latest_position',
+                        to='people.organizationmember',
+                    ),
+                ),
+                (
+                    'team',
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='latest_position',
+                        to='people.team',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.CheckConstraint(
+                        condition=models.Q(
+                            models.Q(('organization_member__isnull', True), ('team__isnull', False)),
+                            models.Q(('organization_member__isnull', False), ('team__isnull', True)),
+                            _connector='OR',
+                        ),
+                        name='latestposition_exactly_one_owner',
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_latest_positions, migrations.RunPython.noop),
+    ]
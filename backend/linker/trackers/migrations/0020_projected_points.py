@@ -0,0 +1,40 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.gis.db.models.fields
+import django.contrib.gis.db.models.functions
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackers', '0019_latestposition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='latestposition',
+            name='point_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('point', 31370),
+                output_field=django.contrib.gis.db.models.fields.PointField(srid=31370),
+            ),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='point_projected',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.gis.db.models.functions.Transform('point', 31370),
+                output_field=django.contrib.gis.db.models.fields.PointField(srid=31370),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=['point_projected'], name='position_point_projected_gist'
+            ),
+        ),
+    ]
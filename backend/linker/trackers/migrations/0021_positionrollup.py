@@ -0,0 +1,111 @@
+# Generated by Django 6.0.4 on 2026-10-18
+
+import django.contrib.gis.db.models.fields
+import django.contrib.gis.db.models.functions
+import django.db.models.deletion
+import enumfields.fields
+from django.db import migrations, models
+
+import linker.trackers.constants
+
+# Copies of the values in linker.trackers, a migration must not change when the application code does
+ROLLUP_ORIGIN = '2000-01-01T00:00:00+00:00'
+POSITION_ROLLUP_RESOLUTIONS = [60, 5 * 60]
+
+# The last position of every owner in every bucket of every resolution
+FILL_POSITION_ROLLUPS_SQL = """
+    INSERT INTO trackers_positionrollup ({owner_column}, resolution, bucket, position_id, timestamp, end_timestamp,
+                                         point, source)
+    SELECT DISTINCT ON (p.{owner_column}, resolution.seconds, bucket) p.{owner_column},
+                                                                     resolution.seconds,
+                                                                     date_bin(make_interval(secs => resolution.seconds),
+                                                                              p.timestamp,
+                                                                              %s::timestamptz) AS bucket,
+                                                                     p.id,
+                                                                     p.timestamp,
+                                                                     p.end_timestamp,
+                                                                     p.point,
+                                                                     p.source
+    FROM trackers_position p
+             CROSS JOIN unnest(%s::integer[]) AS resolution(seconds)
+    WHERE p.{owner_column} IS NOT NULL
+    ORDER BY p.{owner_column}, resolution.seconds, bucket, p.timestamp DESC
+"""
+
+
+def fill_position_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for owner_column in ('team_id', 'organization_member_id'):
+            cursor.execute(
+                FILL_POSITION_ROLLUPS_SQL.format(owner_column=owner_column),
+                [ROLLUP_ORIGIN, POSITION_ROLLUP_RESOLUTIONS],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0017_organizationmember_tracker_token'),
+        ('trackers', '0020_projected_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('position_id', models.BigIntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                (
+                    'point_projected',
+                    models.GeneratedField(
+                        db_persist=True,
+                        expression=django.contrib.gis.db.models.functions.Transform('point', 31370),
+                        output_field=django.contrib.gis.db.models.fields.PointField(srid=31370),
+                    ),
+                ),
+                ('source', enumfields.fields.EnumField(enum=linker.trackers.constants.PositionSource, max_length=30)),
+                ('end_timestamp', models.DateTimeField(blank=True, null=True)),
+                (
+                    'organization_member',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='position_rollups',
+                        to='people.organizationmember',
+                    ),
+                ),
+                (
+                    'team',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='position_rollups',
+                        to='people.team',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.CheckConstraint(
+                        condition=models.Q(
+                            models.Q(('organization_member__isnull', True), ('team__isnull', False)),
+                            models.Q(('organization_member__isnull', False), ('team__isnull', True)),
+                            _connector='OR',
+                        ),
+                        name='positionrollup_exactly_one_owner',
+                    ),
+                    models.UniqueConstraint(fields=('team', 'resolution', 'bucket'), name='positionrollup_unique_team'),
+                    models.UniqueConstraint(
+                        fields=('organization_member', 'resolution', 'bucket'), name='positionrollup_unique_member'
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_position_rollups, migrations.RunPython.noop),
+    ]
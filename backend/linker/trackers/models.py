@@ -1,8 +1,14 @@
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import Transform
+from django.contrib.postgres.indexes import BrinIndex, GistIndex
 from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 from enumfields import EnumField
 
-from .constants import PositionSource, TrackerLogSource
+from linker.tracing.constants import PROJECTED_SRID
+
+from .constants import TRACKER_POSITION_SOURCE_PRECEDENCE, PositionSource, TrackerLogSource
 
 
 class Tracker(models.Model):
@@ -10,6 +16,9 @@ class Tracker(models.Model):
     tracker_name = models.CharField(max_length=50, blank=True, null=True)
     tracker_barcode = models.CharField(max_length=50, blank=True, null=True)
 
+    # High-water mark of the geodynamics API import, used to only request newer positions
+    last_api_gps_datetime = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         permissions = [
             ('view_heatmap', 'Can view heatmap'),
@@ -24,7 +33,7 @@ class Tracker(models.Model):
 
 class TrackerLog(models.Model):
     tracker = models.ForeignKey(Tracker, on_delete=models.CASCADE, related_name='tracker_logs')
-    gps_datetime = models.DateTimeField(db_index=True)
+    gps_datetime = models.DateTimeField()
     point = models.PointField()
 
     source = EnumField(TrackerLogSource, max_length=30)
@@ -41,9 +50,15 @@ class TrackerLog(models.Model):
     has_gps = models.BooleanField(blank=True, null=True)
     has_power = models.BooleanField(blank=True, null=True)
 
+    # The table is partitioned by day on gps_datetime, see partitions.py. Its primary key in the database is
+    # (id, gps_datetime), Django only knows id: filter on gps_datetime too, so only one partition is read.
     class Meta:
         unique_together = [['tracker', 'gps_datetime', 'tracker_type']]
-        indexes = [models.Index(fields=('tracker', 'tracker_type'))]
+        indexes = [
+            models.Index(fields=('tracker', 'tracker_type')),
+            # Tracker logs are appended in time order, a BRIN index is a fraction of the size of a B-tree
+            BrinIndex(fields=['gps_datetime'], name='trackerlog_gps_datetime_brin'),
+        ]
 
     def __str__(self) -> str:
         return f'{self.tracker} {self.gps_datetime}'
@@ -57,8 +72,18 @@ class Position(models.Model):
 
     timestamp = models.DateTimeField()
     point = models.PointField()
+    point_projected = models.GeneratedField(
+        expression=Transform('point', PROJECTED_SRID),
+        output_field=models.PointField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
     source = EnumField(PositionSource, max_length=30)
+    # A dwell: the tracker reported this point from timestamp until end_timestamp
+    end_timestamp = models.DateTimeField(blank=True, null=True)
 
+    # The table is partitioned by day on timestamp, see partitions.py. Unique constraints must include timestamp. Its
+    # primary key in the database is (id, timestamp), Django only knows id: filter on timestamp too, so only one
+    # partition is read.
     class Meta:
         constraints = [
             models.CheckConstraint(
@@ -73,8 +98,121 @@ class Position(models.Model):
                 name='position_unique_timestamp_source_owner',
                 nulls_distinct=False,
             ),
+            # One position per fix of a tracker, even when both the minisite and the API report it
+            models.UniqueConstraint(
+                fields=['timestamp', 'team', 'organization_member'],
+                condition=Q(source__in=TRACKER_POSITION_SOURCE_PRECEDENCE),
+                name='position_unique_tracker_fix_owner',
+                nulls_distinct=False,
+            ),
         ]
         indexes = [
-            models.Index(fields=['team', 'timestamp']),
-            models.Index(fields=['organization_member', 'timestamp']),
+            # The last position of an owner can be read from these indexes alone
+            models.Index(
+                fields=['team', '-timestamp'],
+                include=['point', 'source', 'end_timestamp'],
+                name='position_team_latest_idx',
+            ),
+            models.Index(
+                fields=['organization_member', '-timestamp'],
+                include=['point', 'source', 'end_timestamp'],
+                name='position_member_latest_idx',
+            ),
+            # Positions are appended in time order, dwells are extended while they are recent
+            BrinIndex(fields=['timestamp'], name='position_timestamp_brin'),
+            BrinIndex(Coalesce('end_timestamp', 'timestamp'), name='position_last_seen_brin'),
+            GistIndex(fields=['point_projected'], name='position_point_projected_gist'),
+        ]
+
+
+class LatestPosition(models.Model):
+    """The last position of every team and organization member, see refresh_latest_positions."""
+
+    team = models.OneToOneField(
+        'people.Team', on_delete=models.CASCADE, null=True, blank=True, related_name='latest_position'
+    )
+    organization_member = models.OneToOneField(
+        'people.OrganizationMember', on_delete=models.CASCADE, null=True, blank=True, related_name='latest_position'
+    )
+
+    timestamp = models.DateTimeField()
+    point = models.PointField()
+    point_projected = models.GeneratedField(
+        expression=Transform('point', PROJECTED_SRID),
+        output_field=models.PointField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
+    source = EnumField(PositionSource, max_length=30)
+    end_timestamp = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=(
+                    Q(team__isnull=False, organization_member__isnull=True)
+                    | Q(team__isnull=True, organization_member__isnull=False)
+                ),
+                name='latestposition_exactly_one_owner',
+            ),
+        ]
+
+
+class PositionRollup(models.Model):
+    """The last position of every owner in every bucket of resolution seconds, see refresh_position_rollups."""
+
+    team = models.ForeignKey(
+        'people.Team', on_delete=models.CASCADE, null=True, blank=True, related_name='position_rollups'
+    )
+    organization_member = models.ForeignKey(
+        'people.OrganizationMember', on_delete=models.CASCADE, null=True, blank=True, related_name='position_rollups'
+    )
+    resolution = models.PositiveIntegerField()
+    bucket = models.DateTimeField()
+
+    # The position in this bucket. Not a foreign key, the primary key of positions is (id, timestamp) in the database.
+    position_id = models.BigIntegerField()
+    timestamp = models.DateTimeField()
+    point = models.PointField()
+    point_projected = models.GeneratedField(
+        expression=Transform('point', PROJECTED_SRID),
+        output_field=models.PointField(srid=PROJECTED_SRID),
+        db_persist=True,
+    )
+    source = EnumField(PositionSource, max_length=30)
+    end_timestamp = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=(
+                    Q(team__isnull=False, organization_member__isnull=True)
+                    | Q(team__isnull=True, organization_member__isnull=False)
+                ),
+                name='positionrollup_exactly_one_owner',
+            ),
+            models.UniqueConstraint(fields=['team', 'resolution', 'bucket'], name='positionrollup_unique_team'),
+            models.UniqueConstraint(
+                fields=['organization_member', 'resolution', 'bucket'], name='positionrollup_unique_member'
+            ),
+        ]
+
+
+class PositionProvenance(models.Model):
+    """Every source that reported a tracker fix, also the ones that lost against a source with precedence."""
+
+    team = models.ForeignKey('people.Team', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    organization_member = models.ForeignKey(
+        'people.OrganizationMember', on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    timestamp = models.DateTimeField()
+    source = EnumField(PositionSource, max_length=30)
+    created = models.DateTimeField(default=now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['timestamp', 'source', 'team', 'organization_member'],
+                name='positionprovenance_unique_timestamp_source_owner',
+                nulls_distinct=False,
+            ),
         ]
@@ -0,0 +1,138 @@
+# TrackerLog and Position are partitioned by day (in UTC) on their timestamp, so queries on recent positions only touch
+# small partitions and old data can be removed by dropping a partition. Rows of a day without a partition end up in the
+# default partition, and are moved to their own partition when it is created. The primary key of the partitioned
+# tables is (id, timestamp) in the database, because it has to include the partition column.
+
+import gzip
+from collections.abc import Iterable
+from datetime import UTC, date, datetime, time, timedelta
+from logging import getLogger
+from pathlib import Path
+
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+from django.utils.timezone import now
+
+from .constants import PARTITION_DAYS_AHEAD
+
+logger = getLogger(__name__)
+
+# Partitioned table: partition column
+PARTITIONED_TABLES = {
+    'trackers_trackerlog': 'gps_datetime',
+    'trackers_position': 'timestamp',
+}
+
+
+def partition_name(table: str, day: date) -> str:
+    return f'{table}_p{day:%Y%m%d}'
+
+
+def get_partitions(cursor: CursorWrapper, table: str) -> dict[date, str]:
+    cursor.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+                 JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                 JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        """,
+        [table],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        suffix = name.removeprefix(f'{table}_p')
+        if suffix != name:
+            partitions[datetime.strptime(suffix, '%Y%m%d').date()] = name
+    return partitions
+
+
+def create_default_partition(cursor: CursorWrapper, table: str) -> None:
+    cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+
+def _stored_columns(cursor: CursorWrapper, table: str) -> str:
+    # Generated columns are computed again on insert
+    cursor.execute(
+        """
+        SELECT attname
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        ORDER BY attnum
+        """,
+        [table],
+    )
+    return ', '.join(f'"{name}"' for (name,) in cursor.fetchall())
+
+
+def create_partition(cursor: CursorWrapper, table: str, day: date) -> str:
+    column = PARTITIONED_TABLES[table]
+    name = partition_name(table, day)
+    start = datetime.combine(day, time.min, tzinfo=UTC)
+    end = start + timedelta(days=1)
+
+    # A partition can only be attached when the default partition holds none of its rows, so move those first
+    cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)')
+    columns = _stored_columns(cursor, table)
+    cursor.execute(
+        f"""
+        WITH moved AS (DELETE FROM {table}_default WHERE "{column}" >= %s AND "{column}" < %s RETURNING {columns})
+        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+        """,
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    return name
+
+
+def create_partitions_for_days(cursor: CursorWrapper, table: str, days: Iterable[date]) -> list[str]:
+    existing = get_partitions(cursor, table)
+    return [create_partition(cursor, table, day) for day in sorted(set(days)) if day not in existing]
+
+
+def create_partitions(days_ahead: int = PARTITION_DAYS_AHEAD) -> list[str]:
+    """Create the partitions of today and the coming days, and of the days that have rows in the default partition."""
+    today = now().astimezone(UTC).date()
+    created = []
+    for table, column in PARTITIONED_TABLES.items():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT ("{column}" AT TIME ZONE \'UTC\')::date FROM {table}_default')
+            days = [day for (day,) in cursor.fetchall()]
+            days += [today + timedelta(days=offset) for offset in range(days_ahead + 1)]
+            created += create_partitions_for_days(cursor, table, days)
+    if created:
+        logger.info(f'Created partitions {", ".join(created)}')
+    return created
+
+
+def detach_partitions(before: date, archive_directory: Path | None = None, drop: bool = True) -> list[str]:
+    """Detach the partitions of the days before the given day, and return their names.
+
+    When an archive directory is given, every partition is written to it as a gzipped COPY file first. Detached
+    partitions are dropped, unless drop is False: they then stay behind as regular tables.
+    """
+    detached = []
+    for table in PARTITIONED_TABLES:
+        with connection.cursor() as cursor:
+            partitions = get_partitions(cursor, table)
+        for day, name in sorted(partitions.items()):
+            if day >= before:
+                continue
+            # Every partition in its own transaction, so a failing archive leaves the partition attached
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                if archive_directory is not None:
+                    archive_directory.mkdir(parents=True, exist_ok=True)
+                    with (
+                        gzip.open(archive_directory / f'{name}.copy.gz', 'wb') as file,
+                        cursor.copy(f'COPY {name} TO STDOUT') as copy,
+                    ):
+                        for data in copy:
+                            file.write(data)
+                if drop:
+                    cursor.execute(f'DROP TABLE {name}')
+            detached.append(name)
+            logger.info(f'Detached partition {name}')
+    return detached
@@ -1,3 +1,6 @@
+import hmac
+
+from django.conf import settings
 from django.http.request import HttpRequest
 from django.views.generic.base import View
 from rest_framework import permissions
@@ -15,3 +18,12 @@ class CanViewPositions(permissions.BasePermission):
         if not request.user:
             return False
         return request.user.has_perm('trackers.view_position')
+
+
+class CanScrapeMetrics(permissions.BasePermission):
+    def has_permission(self, request: HttpRequest, view: View) -> bool:
+        token = settings.METRICS_TOKEN
+        authorization = request.headers.get('Authorization', '')
+        if token and hmac.compare_digest(authorization, f'Bearer {token}'):
+            return True
+        return bool(request.user and request.user.is_staff)
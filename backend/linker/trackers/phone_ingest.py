@@ -0,0 +1,244 @@
+# A minimal ingest path for phone GPS positions, that skips the Django middleware and DRF views. Phones post
+# {"token": ..., "timestamp": ..., "point": <GeoJSON point>}, or {"token": ..., "positions": [...]} for buffered
+# positions. The positions are validated and submitted like the ones posted to /api/phone-gps/: valid positions are
+# queued on the ingest stream when it is active, added to the position buffer when that is active, and stored right
+# away otherwise.
+
+import json
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from datetime import datetime
+from http import HTTPStatus
+from logging import getLogger
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.core import signals
+from django.db import transaction
+from django.utils.timezone import now
+
+from linker.config.models import Switch
+from linker.lru import TTLCache
+
+from .constants import (
+    PHONE_GPS_BATCH_MAX_SIZE,
+    PHONE_GPS_INGEST_MAX_BODY_BYTES,
+    PHONE_GPS_INGEST_PATH,
+    PHONE_GPS_INGEST_SWITCH_TTL_SECONDS,
+    SWITCH_INGEST_STREAM,
+    SWITCH_POSITION_BUFFER,
+    PositionSource,
+    RawPayloadKind,
+)
+from .derived import after_positions_written
+from .ingest_stream import RawPayload, enqueue_payload, ingest_stream_has_capacity
+from .loader import insert_positions
+from .position_buffer import BufferedPosition, buffer_positions
+from .rows import PositionRow
+from .serializers import PhoneGpsBufferedPositionSerializer, PhoneGpsFixSerializer
+from .tokens import resolve_tracker_token
+
+logger = getLogger(__name__)
+
+# The timestamp in ISO format, the longitude and the latitude of a phone GPS position, ready to be queued as JSON
+PhoneGpsFix = tuple[str, float, float]
+
+_switches: TTLCache[str, bool] = TTLCache(maxsize=8, ttl=PHONE_GPS_INGEST_SWITCH_TTL_SECONDS)
+
+
+def _switch_is_active(name: str) -> bool:
+    active = _switches.get(name)
+    if active is None:
+        active = Switch.switch_is_active(name)
+        _switches.set(name, active)
+    return active
+
+
+def store_phone_positions(
+    team_id: int | None, organization_member_id: int | None, fixes: Iterable[Sequence[Any]]
+) -> int:
+    rows = [
+        PositionRow(
+            team_id=team_id,
+            organization_member_id=organization_member_id,
+            timestamp=datetime.fromisoformat(timestamp),
+            longitude=longitude,
+            latitude=latitude,
+            source=PositionSource.PHONE_GPS,
+        )
+        for timestamp, longitude, latitude in fixes
+    ]
+    with transaction.atomic():
+        nb_positions = insert_positions(rows)
+        after_positions_written(rows)
+    return nb_positions
+
+
+def import_phone_gps_payload(payload: RawPayload) -> int:
+    data = json.loads(payload.body)
+    return store_phone_positions(data['team_id'], data['organization_member_id'], data['fixes'])
+
+
+def phone_gps_fix(validated_data: dict[str, Any]) -> PhoneGpsFix:
+    point = validated_data['point']
+    return validated_data['timestamp'].isoformat(), round(point.x, 6), round(point.y, 6)
+
+
+def validate_phone_gps_positions(
+    items: Sequence[Any], serializer_class: type[PhoneGpsFixSerializer]
+) -> tuple[list[PhoneGpsFix], list[dict[str, Any]]]:
+    """Validate every position on its own, so one bad position does not reject the others.
+
+    Return the fixes of the valid positions, and whether every position was accepted.
+    """
+    fixes = []
+    results: list[dict[str, Any]] = []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if not serializer.is_valid():
+            results.append({'index': index, 'accepted': False, 'errors': serializer.errors})
+            continue
+        results.append({'index': index, 'accepted': True})
+        fixes.append(phone_gps_fix(serializer.validated_data))
+    return fixes, results
+
+
+def submit_phone_gps_fixes(
+    team_id: int | None, organization_member_id: int | None, fixes: Sequence[PhoneGpsFix]
+) -> HTTPStatus:
+    """Queue the fixes on the ingest stream or in the position buffer when that is active, or store them right away.
+
+    Return ACCEPTED when the fixes were queued, and CREATED when they were stored.
+    """
+    if not fixes:
+        return HTTPStatus.CREATED
+    if _switch_is_active(SWITCH_INGEST_STREAM) and ingest_stream_has_capacity():
+        message = {'team_id': team_id, 'organization_member_id': organization_member_id, 'fixes': fixes}
+        enqueue_payload(RawPayload(RawPayloadKind.PHONE_GPS, json.dumps(message).encode(), now()))
+        return HTTPStatus.ACCEPTED
+    if _switch_is_active(SWITCH_POSITION_BUFFER):
+        buffered = [
+            BufferedPosition(
+                team_id,
+                organization_member_id,
+                datetime.fromisoformat(timestamp),
+                longitude,
+                latitude,
+                PositionSource.PHONE_GPS,
+            )
+            for timestamp, longitude, latitude in fixes
+        ]
+        if buffer_positions(buffered):
+            return HTTPStatus.ACCEPTED
+    store_phone_positions(team_id, organization_member_id, fixes)
+    return HTTPStatus.CREATED
+
+
+def handle_phone_gps(body: bytes) -> tuple[HTTPStatus, dict[str, Any]]:
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get('token'), str):
+        return HTTPStatus.BAD_REQUEST, {'detail': 'Expected a JSON object with a token.'}
+
+    owner = resolve_tracker_token(data['token'])
+    if owner is None:
+        return HTTPStatus.BAD_REQUEST, {'token': 'Invalid token.'}
+
+    if 'positions' in data:
+        items = data['positions']
+        if not isinstance(items, list) or not 0 < len(items) <= PHONE_GPS_BATCH_MAX_SIZE:
+            return HTTPStatus.BAD_REQUEST, {'positions': f'Expected 1 to {PHONE_GPS_BATCH_MAX_SIZE} positions.'}
+        serializer_class: type[PhoneGpsFixSerializer] = PhoneGpsBufferedPositionSerializer
+    else:
+        items = [data]
+        serializer_class = PhoneGpsFixSerializer
+
+    fixes, results = validate_phone_gps_positions(items, serializer_class)
+    if 'positions' not in data and not fixes:
+        return HTTPStatus.BAD_REQUEST, results[0]['errors']
+    return submit_phone_gps_fixes(owner.team_id, owner.organization_member_id, fixes), {'results': results}
+
+
+def _handle_request(body: bytes, sender: type, **kwargs: Any) -> tuple[HTTPStatus, dict[str, Any]]:
+    # Like a Django request, so database connections that are broken or too old are closed
+    signals.request_started.send(sender=sender, **kwargs)
+    try:
+        return handle_phone_gps(body)
+    finally:
+        signals.request_finished.send(sender=sender)
+
+
+def _error_response(status: HTTPStatus) -> tuple[HTTPStatus, dict[str, Any]]:
+    return status, {'detail': status.phrase}
+
+
+class PhoneGpsWSGIMiddleware:
+    """Answer POSTs to PHONE_GPS_INGEST_PATH directly, and pass every other request to the Django application."""
+
+    def __init__(self, application: Callable[..., Iterable[bytes]]) -> None:
+        self.application = application
+
+    def __call__(self, environ: dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if environ.get('PATH_INFO') != PHONE_GPS_INGEST_PATH:
+            return self.application(environ, start_response)
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = -1
+        if environ['REQUEST_METHOD'] != 'POST':
+            status, data = _error_response(HTTPStatus.METHOD_NOT_ALLOWED)
+        elif length < 0:
+            status, data = _error_response(HTTPStatus.BAD_REQUEST)
+        elif length > PHONE_GPS_INGEST_MAX_BODY_BYTES:
+            status, data = _error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        else:
+            status, data = _handle_request(environ['wsgi.input'].read(length), self.__class__, environ=environ)
+
+        body = json.dumps(data).encode()
+        start_response(
+            f'{status.value} {status.phrase}',
+            [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))],
+        )
+        return [body]
+
+
+class PhoneGpsASGIMiddleware:
+    """The ASGI counterpart of PhoneGpsWSGIMiddleware."""
+
+    def __init__(self, application: Callable[..., Awaitable[None]]) -> None:
+        self.application = application
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope['type'] != 'http' or scope['path'] != PHONE_GPS_INGEST_PATH:
+            await self.application(scope, receive, send)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > PHONE_GPS_INGEST_MAX_BODY_BYTES or not message.get('more_body'):
+                break
+
+        if scope['method'] != 'POST':
+            status, data = _error_response(HTTPStatus.METHOD_NOT_ALLOWED)
+        elif len(body) > PHONE_GPS_INGEST_MAX_BODY_BYTES:
+            status, data = _error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        else:
+            # The token lookup and the queue are blocking calls. The request signals are sent from the same thread,
+            # because database connections belong to a thread.
+            status, data = await sync_to_async(_handle_request, thread_sensitive=False)(
+                body, self.__class__, scope=scope
+            )
+
+        response = json.dumps(data).encode()
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': status.value,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(response)).encode())],
+            }
+        )
+        await send({'type': 'http.response.body', 'body': response})
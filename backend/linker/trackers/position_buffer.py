@@ -0,0 +1,222 @@
+# A write-behind buffer for phone and manual positions. Positions are added to a Redis stream and acknowledged right
+# away; flush_position_buffer() stores them in bulk, every POSITION_BUFFER_FLUSH_SECONDS or every
+# POSITION_BUFFER_FLUSH_SIZE positions, whichever comes first.
+#
+# Durability: a position is accepted once Redis added it to the stream, so it is as durable as the Redis persistence
+# (with appendfsync everysec at most one second of accepted positions is lost when Redis crashes). A position is only
+# removed from the stream after the transaction that stored it committed. When a flusher dies in between, another
+# flusher takes the positions over after POSITION_BUFFER_CLAIM_IDLE_SECONDS and stores them again, which is harmless
+# because the unique constraints of Position skip positions that were stored before.
+
+import os
+import socket
+from dataclasses import dataclass
+from datetime import datetime
+from logging import getLogger
+from time import monotonic, perf_counter, time
+
+from django.contrib.gis.geos import Point
+from django.db import IntegrityError, transaction
+from redis import Redis, RedisError, ResponseError
+
+from linker.config.models import Switch
+from linker.redis_client import get_redis
+
+from .constants import (
+    POSITION_BUFFER_CLAIM_IDLE_SECONDS,
+    POSITION_BUFFER_DEAD_LETTER_KEY,
+    POSITION_BUFFER_FLUSH_SECONDS,
+    POSITION_BUFFER_FLUSH_SIZE,
+    POSITION_BUFFER_GROUP,
+    POSITION_BUFFER_KEY,
+    POSITION_BUFFER_MAX_LENGTH,
+    SWITCH_POSITION_BUFFER,
+    PositionSource,
+)
+from .derived import after_positions_written
+from .loader import insert_positions
+from .models import Position
+from .recent_positions import position_rows
+
+logger = getLogger(__name__)
+
+FLUSH_METRICS_KEY = 'linker:metrics:position-buffer'
+
+StreamMessage = tuple[bytes, dict[bytes, bytes]]
+
+
+@dataclass
+class BufferedPosition:
+    team_id: int | None
+    organization_member_id: int | None
+    timestamp: datetime
+    longitude: float
+    latitude: float
+    source: PositionSource
+
+
+def buffer_positions(positions: list[BufferedPosition]) -> bool:
+    """Add the positions to the buffer, and return False when they could not be added and must be stored directly."""
+    if not positions:
+        return True
+    redis = get_redis()
+    try:
+        if redis.xlen(POSITION_BUFFER_KEY) >= POSITION_BUFFER_MAX_LENGTH:
+            logger.warning('The position buffer is full, storing positions directly')
+            return False
+        pipeline = redis.pipeline()
+        for position in positions:
+            pipeline.xadd(
+                POSITION_BUFFER_KEY,
+                {
+                    'team': position.team_id or '',
+                    'member': position.organization_member_id or '',
+                    'timestamp': position.timestamp.isoformat(),
+                    'longitude': position.longitude,
+                    'latitude': position.latitude,
+                    'source': position.source.value,
+                },
+            )
+        pipeline.execute()
+    except RedisError as e:
+        logger.warning(f'Could not buffer {len(positions)} positions, storing them directly: {e}')
+        return False
+    return True
+
+
+def buffer_position(
+    team_id: int | None, organization_member_id: int | None, timestamp: datetime, point: Point, source: PositionSource
+) -> bool:
+    """Buffer one position when the buffer is active, and return False when the caller must store it directly."""
+    if not Switch.switch_is_active(SWITCH_POSITION_BUFFER):
+        return False
+    return buffer_positions([BufferedPosition(team_id, organization_member_id, timestamp, point.x, point.y, source)])
+
+
+def _decode(fields: dict[bytes, bytes]) -> Position:
+    return Position(
+        team_id=int(fields[b'team']) if fields[b'team'] else None,
+        organization_member_id=int(fields[b'member']) if fields[b'member'] else None,
+        timestamp=datetime.fromisoformat(fields[b'timestamp'].decode()),
+        point=Point(float(fields[b'longitude']), float(fields[b'latitude']), srid=4326),
+        source=PositionSource(fields[b'source'].decode()),
+    )
+
+
+def _ensure_group(redis: Redis) -> None:
+    try:
+        redis.xgroup_create(POSITION_BUFFER_KEY, POSITION_BUFFER_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _remove(redis: Redis, message_ids: list[bytes]) -> None:
+    pipeline = redis.pipeline()
+    pipeline.xack(POSITION_BUFFER_KEY, POSITION_BUFFER_GROUP, *message_ids)
+    pipeline.xdel(POSITION_BUFFER_KEY, *message_ids)
+    pipeline.execute()
+
+
+def _read_batch(redis: Redis, consumer: str) -> list[StreamMessage]:
+    # Positions of a flusher that died before storing them come first
+    _, messages, _ = redis.xautoclaim(
+        POSITION_BUFFER_KEY,
+        POSITION_BUFFER_GROUP,
+        consumer,
+        min_idle_time=POSITION_BUFFER_CLAIM_IDLE_SECONDS * 1000,
+        count=POSITION_BUFFER_FLUSH_SIZE,
+    )
+    flush_at = monotonic() + POSITION_BUFFER_FLUSH_SECONDS
+    while len(messages) < POSITION_BUFFER_FLUSH_SIZE and (remaining := flush_at - monotonic()) > 0:
+        response = redis.xreadgroup(
+            POSITION_BUFFER_GROUP,
+            consumer,
+            {POSITION_BUFFER_KEY: '>'},
+            count=POSITION_BUFFER_FLUSH_SIZE - len(messages),
+            block=max(1, int(remaining * 1000)),
+        )
+        if response:
+            messages.extend(response[0][1])
+    return messages
+
+
+def _store(redis: Redis, messages: list[StreamMessage]) -> int:
+    positions = [_decode(fields) for _, fields in messages]
+    try:
+        with transaction.atomic():
+            inserted = insert_positions(position_rows(positions))
+            after_positions_written(position_rows(positions))
+            return inserted
+    except IntegrityError:
+        pass
+
+    # Probably a position of a team or member that was removed in the meantime: store the positions one by one, and
+    # keep the ones that fail aside
+    inserted = 0
+    for (_, fields), position in zip(messages, positions, strict=True):
+        try:
+            with transaction.atomic():
+                inserted += insert_positions(position_rows([position]))
+                after_positions_written(position_rows([position]))
+        except IntegrityError as e:
+            logger.error(f'Could not store buffered position {fields!r}, moving it to the dead letters: {e}')
+            redis.xadd(POSITION_BUFFER_DEAD_LETTER_KEY, fields, maxlen=1000, approximate=True)
+    return inserted
+
+
+def _save_flush_metrics(redis: Redis, messages: list[StreamMessage], duration_ms: float) -> None:
+    # Stream ids start with the time in milliseconds at which the position was buffered
+    committed = time()
+    latency = max(committed - int(message_id.split(b'-')[0]) / 1000 for message_id, _ in messages)
+    pipeline = redis.pipeline()
+    pipeline.hset(
+        FLUSH_METRICS_KEY,
+        mapping={
+            'last_flush_rows': len(messages),
+            'last_flush_ms': duration_ms,
+            'last_flush_latency_ms': latency * 1000,
+        },
+    )
+    pipeline.hincrby(FLUSH_METRICS_KEY, 'flushes_total', 1)
+    pipeline.hincrby(FLUSH_METRICS_KEY, 'rows_total', len(messages))
+    pipeline.execute()
+
+
+def flush_position_buffer(max_seconds: float) -> int:
+    """Store the buffered positions in bulk until max_seconds have passed, and return the number of positions."""
+    redis = get_redis()
+    _ensure_group(redis)
+    consumer = f'{socket.gethostname()}-{os.getpid()}'
+    deadline = monotonic() + max_seconds
+    nb_positions = 0
+
+    while monotonic() < deadline:
+        messages = _read_batch(redis, consumer)
+        if not messages:
+            continue
+
+        start = perf_counter()
+        _store(redis, messages)
+        _remove(redis, [message_id for message_id, _ in messages])
+        _save_flush_metrics(redis, messages, (perf_counter() - start) * 1000)
+        nb_positions += len(messages)
+
+    return nb_positions
+
+
+def position_buffer_metrics() -> dict[str, float]:
+    redis = get_redis()
+    oldest = redis.xrange(POSITION_BUFFER_KEY, count=1)
+    oldest_age = max(0.0, time() - int(oldest[0][0].split(b'-')[0]) / 1000) if oldest else 0.0
+    flushes = {name.decode(): float(value) for name, value in redis.hgetall(FLUSH_METRICS_KEY).items()}
+    return {
+        'depth': redis.xlen(POSITION_BUFFER_KEY),
+        'oldest_age_seconds': oldest_age,
+        'last_flush_rows': flushes.get('last_flush_rows', 0),
+        'last_flush_seconds': flushes.get('last_flush_ms', 0) / 1000,
+        'last_flush_latency_seconds': flushes.get('last_flush_latency_ms', 0) / 1000,
+        'flushes_total': flushes.get('flushes_total', 0),
+        'rows_total': flushes.get('rows_total', 0),
+        'dead_letters': redis.xlen(POSITION_BUFFER_DEAD_LETTER_KEY),
+    }
@@ -0,0 +1,193 @@
+# The positions of the last RECENT_POSITIONS_HOURS of every team and organization member, in a Redis sorted set per
+# owner scored by the time the position was last seen. Every code path that stores positions adds them once its
+# transaction committed, so recent trails and the tracing tasks can be served without reading positions from the
+# database.
+#
+# The buffer is only used once it is known to be complete: warm_recent_positions() loads the recent positions from
+# the database and records from when on the buffer holds every position. When Redis lost its data that marker is gone
+# too, and readers fall back to the database until the buffer is warmed again. An owner with more than
+# RECENT_POSITIONS_MAX_PER_OWNER recent positions loses its oldest ones, its set is then only complete since the
+# oldest position it still holds.
+
+import json
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import Literal
+
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+from redis import RedisError
+
+from linker.redis_client import get_redis
+
+from .constants import (
+    RECENT_POSITIONS_COMPLETE_SINCE_KEY,
+    RECENT_POSITIONS_HOURS,
+    RECENT_POSITIONS_MAX_PER_OWNER,
+    RECENT_POSITIONS_TRIMMED_SINCE_KEY,
+)
+from .models import Position
+from .rows import PositionRow
+
+logger = getLogger(__name__)
+
+Owner = Literal['team', 'member']
+
+WARM_BATCH_SIZE = 1000
+
+
+def _key(owner: Owner, owner_id: int) -> str:
+    return f'linker:recent:{owner}:{owner_id}'
+
+
+def _owner_key(row: PositionRow) -> str:
+    if row.team_id is not None:
+        return _key('team', row.team_id)
+    return _key('member', row.organization_member_id)  # type: ignore[arg-type]
+
+
+def _encode(row: PositionRow) -> str:
+    end_timestamp = row.end_timestamp.isoformat() if row.end_timestamp else None
+    return json.dumps([row.timestamp.isoformat(), end_timestamp, row.longitude, row.latitude, str(row.source)])
+
+
+def _decode(team_id: int | None, organization_member_id: int | None, member: bytes) -> PositionRow:
+    timestamp, end_timestamp, longitude, latitude, source = json.loads(member)
+    return PositionRow(
+        team_id=team_id,
+        organization_member_id=organization_member_id,
+        timestamp=datetime.fromisoformat(timestamp),
+        longitude=longitude,
+        latitude=latitude,
+        source=source,
+        end_timestamp=datetime.fromisoformat(end_timestamp) if end_timestamp else None,
+    )
+
+
+def position_rows(positions: Iterable[Position]) -> list[PositionRow]:
+    return [
+        PositionRow(
+            team_id=position.team_id,
+            organization_member_id=position.organization_member_id,
+            timestamp=position.timestamp,
+            longitude=position.point.x,
+            latitude=position.point.y,
+            source=str(position.source),
+            end_timestamp=position.end_timestamp,
+        )
+        for position in positions
+    ]
+
+
+def _add(rows: list[PositionRow]) -> None:
+    cutoff = (now() - timedelta(hours=RECENT_POSITIONS_HOURS)).timestamp()
+    by_key: dict[str, dict[str, float]] = {}
+    for row in rows:
+        by_key.setdefault(_owner_key(row), {})[_encode(row)] = (row.end_timestamp or row.timestamp).timestamp()
+
+    redis = get_redis()
+    pipeline = redis.pipeline(transaction=False)
+    for key, members in by_key.items():
+        pipeline.zadd(key, members)
+        pipeline.zremrangebyscore(key, '-inf', f'({cutoff}')
+        pipeline.zremrangebyrank(key, 0, -RECENT_POSITIONS_MAX_PER_OWNER - 1)
+        pipeline.expire(key, RECENT_POSITIONS_HOURS * 60 * 60)
+    # Every key has four results, the third one is the number of positions trimmed after the old ones were removed
+    results = pipeline.execute()
+    trimmed = [key for key, nb_trimmed in zip(by_key, results[2::4], strict=True) if nb_trimmed]
+    if not trimmed:
+        return
+
+    # Positions newer than the cutoff were trimmed, these owners are only complete since their oldest position left
+    pipeline = redis.pipeline(transaction=False)
+    for key in trimmed:
+        pipeline.zrange(key, 0, 0, withscores=True)
+    oldest = {key: members[0][1] for key, members in zip(trimmed, pipeline.execute(), strict=True) if members}
+    if oldest:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hset(RECENT_POSITIONS_TRIMMED_SINCE_KEY, mapping=oldest)
+        pipeline.expire(RECENT_POSITIONS_TRIMMED_SINCE_KEY, RECENT_POSITIONS_HOURS * 60 * 60)
+        pipeline.execute()
+
+
+def add_recent_positions(rows: Iterable[PositionRow]) -> None:
+    """Add the positions to the recent positions once the current transaction committed."""
+    rows = [row for row in rows if row.team_id is not None or row.organization_member_id is not None]
+    if not rows:
+        return
+
+    def add() -> None:
+        try:
+            _add(rows)
+        except RedisError as e:
+            # The buffer misses these positions now, readers must not trust it anymore
+            logger.warning(f'Could not add {len(rows)} recent positions: {e}')
+            invalidate_recent_positions()
+
+    transaction.on_commit(add)
+
+
+def invalidate_recent_positions() -> None:
+    try:
+        get_redis().delete(RECENT_POSITIONS_COMPLETE_SINCE_KEY)
+    except RedisError as e:
+        logger.warning(f'Could not invalidate the recent positions: {e}')
+
+
+def recent_positions_are_complete() -> bool:
+    """Whether the buffer is marked complete, and does not need to be warmed. False when Redis is not available."""
+    try:
+        return bool(get_redis().exists(RECENT_POSITIONS_COMPLETE_SINCE_KEY))
+    except RedisError as e:
+        logger.warning(f'Could not read the recent positions: {e}')
+        return False
+
+
+def warm_recent_positions() -> None:
+    """Load the recent positions from the database, and mark the buffer complete from the start of that period."""
+    since = now() - timedelta(hours=RECENT_POSITIONS_HOURS)
+    positions = Position.objects.annotate(last_seen=Coalesce('end_timestamp', 'timestamp')).filter(last_seen__gte=since)
+    rows = position_rows(positions.iterator())
+    for start in range(0, len(rows), WARM_BATCH_SIZE):
+        _add(rows[start : start + WARM_BATCH_SIZE])
+    # Positions committed while loading were added by their own writers
+    get_redis().set(RECENT_POSITIONS_COMPLETE_SINCE_KEY, since.timestamp())
+    logger.info(f'Warmed the recent positions with {len(rows)} positions')
+
+
+def get_recent_positions(
+    owner: Owner, owner_ids: Iterable[int], since: datetime
+) -> dict[int, list[PositionRow]] | None:
+    """Return the positions of the owners that were last seen since the given moment, oldest first.
+
+    Return None when the buffer can not tell, because it is not complete since then or Redis is not available.
+    """
+    owner_ids = list(owner_ids)
+    if since < now() - timedelta(hours=RECENT_POSITIONS_HOURS):
+        return None
+    try:
+        redis = get_redis()
+        complete_since = redis.get(RECENT_POSITIONS_COMPLETE_SINCE_KEY)
+        if complete_since is None or float(complete_since) > since.timestamp():
+            return None
+        keys = [_key(owner, owner_id) for owner_id in owner_ids]
+        trimmed_since = redis.hmget(RECENT_POSITIONS_TRIMMED_SINCE_KEY, keys) if keys else []
+        if any(value is not None and float(value) >= since.timestamp() for value in trimmed_since):
+            return None
+        pipeline = redis.pipeline(transaction=False)
+        for key in keys:
+            pipeline.zrangebyscore(key, since.timestamp(), '+inf')
+        responses = pipeline.execute()
+    except RedisError as e:
+        logger.warning(f'Could not read the recent positions: {e}')
+        return None
+
+    return {
+        owner_id: [
+            _decode(owner_id if owner == 'team' else None, owner_id if owner == 'member' else None, member)
+            for member in members
+        ]
+        for owner_id, members in zip(owner_ids, responses, strict=True)
+    }
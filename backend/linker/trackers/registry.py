@@ -0,0 +1,88 @@
+import os
+from logging import getLogger
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import QuerySet
+from redis import RedisError
+
+from linker.redis_client import get_redis
+
+from .models import Tracker
+
+logger = getLogger(__name__)
+
+REGISTRY_VERSION_KEY = 'linker:tracker-registry:version'
+
+
+class TrackerOwner(NamedTuple):
+    id: int
+    team_id: int | None
+    organization_member_id: int | None
+
+    @property
+    def in_use(self) -> bool:
+        return self.team_id is not None or self.organization_member_id is not None
+
+
+_registry: dict[str, TrackerOwner] = {}
+_registry_version: int | None = None
+_registry_pid: int | None = None
+
+
+def _get_version() -> int | None:
+    try:
+        return int(get_redis().get(REGISTRY_VERSION_KEY) or 0)
+    except RedisError as e:
+        logger.warning(f'Could not get the tracker registry version: {e}')
+        return None
+
+
+def invalidate_tracker_registry() -> None:
+    try:
+        get_redis().incr(REGISTRY_VERSION_KEY)
+    except RedisError as e:
+        logger.warning(f'Could not invalidate the tracker registry: {e}')
+
+
+def _load_registry(trackers: QuerySet[Tracker] | None = None) -> dict[str, TrackerOwner]:
+    trackers = Tracker.objects.all() if trackers is None else trackers
+    return {
+        tracker_id: TrackerOwner(id=pk, team_id=team_id, organization_member_id=organization_member_id)
+        for tracker_id, pk, team_id, organization_member_id in trackers.values_list(
+            'tracker_id', 'id', 'team__id', 'organizationmember__id'
+        )
+    }
+
+
+def get_tracker_registry() -> dict[str, TrackerOwner]:
+    """Map every tracker_id to its tracker and current owner.
+
+    The mapping is kept in memory between runs, and reloaded when the version in Redis was bumped by a change to a
+    tracker or its team or organization member. If Redis can not be reached, it is reloaded every time.
+    """
+    global _registry, _registry_version, _registry_pid
+    version = _get_version()
+    if version is None or version != _registry_version or _registry_pid != os.getpid():
+        _registry = _load_registry()
+        _registry_version = version
+        _registry_pid = os.getpid()
+    return _registry
+
+
+def register_trackers(tracker_names: dict[str, str | None]) -> dict[str, TrackerOwner]:
+    """Create all unknown trackers in one statement and add them to the registry."""
+    registry = get_tracker_registry()
+    unknown = {tracker_id: name for tracker_id, name in tracker_names.items() if tracker_id not in registry}
+    if not unknown:
+        return registry
+
+    logger.info(f'Trackers {", ".join(unknown)} not yet in tracker list. Creating new trackers')
+    Tracker.objects.bulk_create(
+        [Tracker(tracker_id=tracker_id, tracker_name=name) for tracker_id, name in unknown.items()],
+        ignore_conflicts=True,
+    )
+    # Trackers that already existed, but were missing from a registry that is out of date, can have an owner
+    registry.update(_load_registry(Tracker.objects.filter(tracker_id__in=unknown)))
+    transaction.on_commit(invalidate_tracker_registry)
+    return registry
@@ -0,0 +1,76 @@
+from collections.abc import Iterable
+from datetime import datetime
+
+from django.db import connection
+
+from .constants import POSITION_ROLLUP_RESOLUTIONS
+
+# Buckets of every resolution start at this moment
+ROLLUP_ORIGIN = '2000-01-01T00:00:00+00:00'
+
+# Recompute the buckets of the given owners from the bucket of their oldest changed position onwards. Every bucket
+# holds the last position in it, so the shape of a track is kept with one position per bucket.
+REFRESH_POSITION_ROLLUPS_SQL = """
+    INSERT INTO trackers_positionrollup ({owner_column}, resolution, bucket, position_id, timestamp, end_timestamp,
+                                         point, source)
+    SELECT DISTINCT ON (changed.id, resolution.seconds, bucket) changed.id,
+                                                               resolution.seconds,
+                                                               date_bin(make_interval(secs => resolution.seconds),
+                                                                        p.timestamp,
+                                                                        %(origin)s::timestamptz) AS bucket,
+                                                               p.id,
+                                                               p.timestamp,
+                                                               p.end_timestamp,
+                                                               p.point,
+                                                               p.source
+    FROM unnest(%(ids)s::bigint[], %(since)s::timestamptz[]) AS changed(id, since)
+             CROSS JOIN unnest(%(resolutions)s::integer[]) AS resolution(seconds)
+             JOIN trackers_position p
+                  ON p.{owner_column} = changed.id
+                      AND p.timestamp >= date_bin(make_interval(secs => resolution.seconds),
+                                                  changed.since,
+                                                  %(origin)s::timestamptz)
+    ORDER BY changed.id, resolution.seconds, bucket, p.timestamp DESC
+    ON CONFLICT ({owner_column}, resolution, bucket) DO UPDATE SET position_id   = EXCLUDED.position_id,
+                                                                   timestamp     = EXCLUDED.timestamp,
+                                                                   end_timestamp = EXCLUDED.end_timestamp,
+                                                                   point         = EXCLUDED.point,
+                                                                   source        = EXCLUDED.source
+"""
+
+
+def refresh_position_rollups(changes: Iterable[tuple[int | None, int | None, datetime]]) -> None:
+    """Update the PositionRollup buckets of every (team_id, organization_member_id, timestamp) position written.
+
+    Every code path that inserts or updates positions calls this afterwards, in the same transaction, next to
+    refresh_latest_positions.
+    """
+    team_since: dict[int, datetime] = {}
+    member_since: dict[int, datetime] = {}
+    for team_id, member_id, timestamp in changes:
+        for oldest, owner_id in ((team_since, team_id), (member_since, member_id)):
+            if owner_id is not None and (owner_id not in oldest or timestamp < oldest[owner_id]):
+                oldest[owner_id] = timestamp
+
+    with connection.cursor() as cursor:
+        for owner_column, since in (('team_id', team_since), ('organization_member_id', member_since)):
+            if since:
+                ids = sorted(since)
+                cursor.execute(
+                    REFRESH_POSITION_ROLLUPS_SQL.format(owner_column=owner_column),
+                    {
+                        'origin': ROLLUP_ORIGIN,
+                        'ids': ids,
+                        'since': [since[owner_id] for owner_id in ids],
+                        'resolutions': list(POSITION_ROLLUP_RESOLUTIONS.values()),
+                    },
+                )
+
+
+def position_table_sql(resolution: int | None) -> str:
+    """The table to read positions from in raw SQL: the positions themselves, or the rollups of a resolution."""
+    if resolution is None:
+        return 'trackers_position'
+    if resolution not in POSITION_ROLLUP_RESOLUTIONS.values():
+        raise ValueError(f'No position rollups with a resolution of {resolution} seconds')
+    return f'(SELECT * FROM trackers_positionrollup WHERE resolution = {resolution})'
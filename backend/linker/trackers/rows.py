@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import NamedTuple
+
+
+class TrackerLogRow(NamedTuple):
+    tracker_id: int
+    gps_datetime: datetime
+    longitude: float
+    latitude: float
+    source: str
+    tracker_type: int | None = None
+    fetch_datetime: datetime | None = None
+    local_datetime: datetime | None = None
+    last_sync_date: datetime | None = None
+    satellites: int | None = None
+    analog_input: float | None = None
+    heading: int | None = None
+    speed: int | None = None
+    has_gps: bool | None = None
+    has_power: bool | None = None
+
+
+class PositionRow(NamedTuple):
+    team_id: int | None
+    organization_member_id: int | None
+    timestamp: datetime
+    longitude: float
+    latitude: float
+    source: str
+    # Set when this position stands for several fixes at the same place, until this timestamp
+    end_timestamp: datetime | None = None
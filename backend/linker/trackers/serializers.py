@@ -1,5 +1,7 @@
+from datetime import timedelta
 from typing import Any
 
+from django.db import transaction
 from django.utils.timezone import now
 from enumfields.drf import EnumField
 from rest_framework import serializers
@@ -7,10 +9,24 @@ from rest_framework_gis.fields import GeometryField
 
 from linker.people.models import OrganizationMember, Team
 
-from .constants import TRACKER_VOLTAGE_RANGE, PositionSource
+from .constants import (
+    PHONE_GPS_BATCH_MAX_SIZE,
+    PHONE_GPS_BUFFERED_MAX_AGE_HOURS,
+    PHONE_GPS_TIMESTAMP_TOLERANCE_MINUTES,
+    TRACKER_VOLTAGE_RANGE,
+    PositionSource,
+)
+from .derived import after_positions_written
 from .models import Position, Tracker
+from .recent_positions import position_rows
+from .tokens import resolve_tracker_token
 
-PHONE_GPS_TIMESTAMP_TOLERANCE_MINUTES = 5
+
+def validate_tracker_token(token: str) -> dict[str, Any]:
+    owner = resolve_tracker_token(token)
+    if owner is None:
+        raise serializers.ValidationError({'token': 'Invalid token.'})
+    return {'team_id': owner.team_id, 'organization_member_id': owner.organization_member_id}
 
 
 class PositionSerializer(serializers.ModelSerializer[Position]):
@@ -31,13 +47,20 @@ class PositionSerializer(serializers.ModelSerializer[Position]):
             raise serializers.ValidationError('Exactly one of organization_member or team must be provided.')
         return data
 
+    def create(self, validated_data: dict[str, Any]) -> Position:
+        with transaction.atomic():
+            position = super().create(validated_data)
+            after_positions_written(position_rows([position]))
+        return position
+
     class Meta:
         model = Position
         fields = ['id', 'timestamp', 'point', 'source', 'organization_member', 'team']
 
 
-class PhoneGpsPositionSerializer(serializers.Serializer[Position]):
-    token = serializers.CharField(write_only=True)
+class PhoneGpsFixSerializer(serializers.Serializer[Position]):
+    """A position sent by a phone, validated the same way by the phone GPS endpoints and the ingest path."""
+
     timestamp = serializers.DateTimeField()
     point = GeometryField(precision=6)
 
@@ -47,28 +70,40 @@ class PhoneGpsPositionSerializer(serializers.Serializer[Position]):
             raise serializers.ValidationError('Timestamp must be within 5 minutes of now.')
         return value
 
+    def validate_point(self, value: Any) -> Any:
+        if value.geom_type != 'Point' or not (-180 <= value.x <= 180 and -90 <= value.y <= 90):
+            raise serializers.ValidationError('Point must be a GeoJSON point in WGS84.')
+        return value
+
+
+class PhoneGpsPositionSerializer(PhoneGpsFixSerializer):
+    token = serializers.CharField(write_only=True)
+
     def validate(self, data: dict[str, Any]) -> dict[str, Any]:
-        token = data['token']
-        try:
-            data['team'] = Team.objects.get(tracker_token=token)
-            return data
-        except Team.DoesNotExist:
-            pass
-        try:
-            data['organization_member'] = OrganizationMember.objects.get(tracker_token=token)
-            return data
-        except OrganizationMember.DoesNotExist:
-            pass
-        raise serializers.ValidationError({'token': 'Invalid token.'})
+        return {**data, **validate_tracker_token(data['token'])}
 
-    def create(self, validated_data: dict[str, Any]) -> Position:
-        return Position.objects.create(
-            team=validated_data.get('team'),
-            organization_member=validated_data.get('organization_member'),
-            timestamp=validated_data['timestamp'],
-            point=validated_data['point'],
-            source=PositionSource.PHONE_GPS,
-        )
+
+class PhoneGpsBufferedPositionSerializer(PhoneGpsFixSerializer):
+    def validate_timestamp(self, value: Any) -> Any:
+        age = now() - value
+        if age < -timedelta(minutes=PHONE_GPS_TIMESTAMP_TOLERANCE_MINUTES):
+            raise serializers.ValidationError('Timestamp must not be in the future.')
+        if age > timedelta(hours=PHONE_GPS_BUFFERED_MAX_AGE_HOURS):
+            raise serializers.ValidationError(
+                f'Timestamp must be within {PHONE_GPS_BUFFERED_MAX_AGE_HOURS} hours of now.'
+            )
+        return value
+
+
+class PhoneGpsPositionBatchSerializer(serializers.Serializer[Position]):
+    token = serializers.CharField(write_only=True)
+    # Every position is validated on its own, so one bad position does not reject the whole batch
+    positions = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=PHONE_GPS_BATCH_MAX_SIZE
+    )
+
+    def validate(self, data: dict[str, Any]) -> dict[str, Any]:
+        return {**data, **validate_tracker_token(data['token'])}
 
 
 class TrackerSerializer(serializers.ModelSerializer[Tracker]):
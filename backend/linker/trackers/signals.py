@@ -0,0 +1,37 @@
+from typing import Any
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Tracker
+from .registry import invalidate_tracker_registry
+from .tokens import invalidate_tracker_tokens
+
+
+@receiver(post_save, sender=Tracker)
+@receiver(post_delete, sender=Tracker)
+@receiver(post_delete, sender='people.Team')
+@receiver(post_delete, sender='people.OrganizationMember')
+def tracker_changed(**kwargs: Any) -> None:
+    # After the commit, so an importer that reloads in between can not cache the old owners under the new version
+    transaction.on_commit(invalidate_tracker_registry)
+
+
+@receiver(post_save, sender='people.Team')
+@receiver(post_save, sender='people.OrganizationMember')
+def tracker_owner_saved(update_fields: frozenset[str] | None = None, **kwargs: Any) -> None:
+    if update_fields is None or 'tracker' in update_fields:
+        transaction.on_commit(invalidate_tracker_registry)
+
+
+@receiver(post_save, sender='people.Team')
+@receiver(post_save, sender='people.OrganizationMember')
+@receiver(post_delete, sender='people.Team')
+@receiver(post_delete, sender='people.OrganizationMember')
+def tracker_token_changed(instance: Any, **kwargs: Any) -> None:
+    # The label of a token depends on the team number and member name as well, so any change invalidates it
+    tokens = [instance.tracker_token, instance.loaded_tracker_token]
+    instance.loaded_tracker_token = instance.tracker_token
+    # After the commit, so a concurrent lookup can not cache the old owner again
+    transaction.on_commit(lambda: invalidate_tracker_tokens(tokens))
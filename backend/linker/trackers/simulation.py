@@ -3,6 +3,7 @@ import datetime
 import gzip
 import json
 import zoneinfo
+from itertools import batched
 from pathlib import Path
 
 from dateutil.parser import isoparse
@@ -14,8 +15,10 @@ from linker.people.models import OrganizationMember, Team
 from linker.tracing.models import CheckpointLog
 from linker.utils import import_gpkg, import_groepen_en_deelnemers, import_organization_members
 
-from .constants import SETTING_SIMULATION_START
-from .geodynamics import import_geodynamics_minisite_data
+from .archive import get_payload_archive
+from .constants import GEODYNAMICS_IMPORT_BATCH_SIZE, INGEST_CONSUMER_BATCH_SIZE, SETTING_SIMULATION_START
+from .geodynamics import import_raw_payloads, parse_geodynamics_minisite_data
+from .loader import store_tracker_logs
 from .models import Tracker, TrackerLog
 
 SIMULATION_START = datetime.datetime(year=2023, month=4, day=29, hour=12, tzinfo=zoneinfo.ZoneInfo('Europe/Brussels'))
@@ -46,26 +49,53 @@ def simulate_download_tracker_data(until: datetime.datetime | None = None) -> No
         except KeyError:
             until = SIMULATION_START
 
-    files_to_do = list((Path(settings.SIMULATION_PATH) / 'geodynamics').glob('*.json.gz'))
     try:
         latest_datetime = TrackerLog.objects.latest('fetch_datetime').fetch_datetime
+    except TrackerLog.DoesNotExist:
+        latest_datetime = None
+
+    if get_payload_archive() is not None:
+        start = SIMULATION_START if latest_datetime is None else latest_datetime + datetime.timedelta(milliseconds=1)
+        replay_payload_archive(start, until)
+    else:
+        _replay_simulation_files(latest_datetime, until)
+
+    for tracker in Tracker.objects.all():
+        tracker.last_log = tracker.tracker_logs.latest('gps_datetime')
+        tracker.save()
+
+
+def replay_payload_archive(start: datetime.datetime, end: datetime.datetime) -> None:
+    # Also useful to import a period again after fixing a bug in the import
+    archive = get_payload_archive()
+    for payloads in batched(archive.iter_payloads(start, end), INGEST_CONSUMER_BATCH_SIZE):
+        import_raw_payloads(list(payloads))
+
+
+def _replay_simulation_files(latest_datetime: datetime.datetime | None, until: datetime.datetime) -> None:
+    files_to_do = list((Path(settings.SIMULATION_PATH) / 'geodynamics').glob('*.json.gz'))
+    if latest_datetime is not None:
         files_to_do = [
             filename for filename in files_to_do if latest_datetime < _get_timestamp_from_file_name(filename)
         ]
-    except TrackerLog.DoesNotExist:
-        pass
 
     files_to_do = [filename for filename in files_to_do if _get_timestamp_from_file_name(filename) <= until]
     files_to_do.sort(key=lambda filename: filename.name)
 
+    # Replay the files in large batches instead of one insert per file
+    tracker_log_rows = []
+    position_rows = []
     for filename in files_to_do:
         with gzip.open(filename, 'rb') as file:
             data = json.load(file)
-        import_geodynamics_minisite_data(data, _get_timestamp_from_file_name(filename))
-
-    for tracker in Tracker.objects.all():
-        tracker.last_log = tracker.tracker_logs.latest('gps_datetime')
-        tracker.save()
+        new_tracker_logs, new_positions = parse_geodynamics_minisite_data(data, _get_timestamp_from_file_name(filename))
+        tracker_log_rows.extend(new_tracker_logs)
+        position_rows.extend(new_positions)
+        if len(tracker_log_rows) >= GEODYNAMICS_IMPORT_BATCH_SIZE:
+            store_tracker_logs(tracker_log_rows, position_rows)
+            tracker_log_rows = []
+            position_rows = []
+    store_tracker_logs(tracker_log_rows, position_rows)
 
 
 def couple_trackers() -> None:
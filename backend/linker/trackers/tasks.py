@@ -1,15 +1,33 @@
+from datetime import timedelta
 from logging import getLogger
+from pathlib import Path
 
 from celery import shared_task
 from django.conf import settings
+from django.utils.timezone import now
 from redis import Redis
 from redis.lock import Lock
 
 from linker.config.models import Switch
+from linker.redis_client import get_redis
 
-from .constants import SWITCH_FETCH_TRACKERS_API, SWITCH_FETCH_TRACKERS_MINISITE
-from .geodynamics import fetch_geodynamics_api_data, fetch_geodynamics_minisite_data
+from .constants import (
+    INGEST_CONSUMER_RUN_SECONDS,
+    POSITION_BUFFER_FLUSH_RUN_SECONDS,
+    POSITION_BUFFER_KEY,
+    SWITCH_FETCH_TRACKERS_API,
+    SWITCH_FETCH_TRACKERS_MINISITE,
+    SWITCH_INGEST_STREAM,
+    SWITCH_POSITION_BUFFER,
+)
+from .geodynamics import fetch_geodynamics_api_data, fetch_geodynamics_minisite_data, import_raw_payloads
 from .heatmap import generate_heatmap_mbtiles
+from .ingest_stream import consume_ingest_stream, ingest_stream_metrics
+from .log_archive import archive_tracker_logs
+from .metrics import ingest_run
+from .partitions import create_partitions, detach_partitions
+from .position_buffer import flush_position_buffer
+from .recent_positions import recent_positions_are_complete, warm_recent_positions
 
 logger = getLogger(__name__)
 
@@ -17,8 +35,14 @@ logger = getLogger(__name__)
 @shared_task
 def download_tracker_data_minisite() -> None:
     if Switch.switch_is_active(SWITCH_FETCH_TRACKERS_MINISITE):
-        with Lock(
-            redis=Redis.from_url(settings.CELERY_BROKER_URL), name='download-tracker-data', blocking=False, timeout=30
+        with (
+            Lock(
+                redis=Redis.from_url(settings.CELERY_BROKER_URL),
+                name='download-tracker-data',
+                blocking=False,
+                timeout=30,
+            ),
+            ingest_run('minisite'),
         ):
             fetch_geodynamics_minisite_data()
 
@@ -26,7 +50,48 @@ def download_tracker_data_minisite() -> None:
 @shared_task
 def download_tracker_data_api() -> None:
     if Switch.switch_is_active(SWITCH_FETCH_TRACKERS_API):
-        fetch_geodynamics_api_data()
+        with ingest_run('geodynamics_api'):
+            fetch_geodynamics_api_data()
+
+
+@shared_task
+def import_ingest_stream() -> None:
+    # Scheduled every minute; start more workers running this task to import in parallel
+    if Switch.switch_is_active(SWITCH_INGEST_STREAM):
+        with ingest_run('ingest_stream'):
+            nb_payloads = consume_ingest_stream(import_raw_payloads, max_seconds=INGEST_CONSUMER_RUN_SECONDS)
+        logger.info(f'Imported {nb_payloads} payloads from the ingest stream, {ingest_stream_metrics()}')
+
+
+@shared_task
+def flush_buffered_positions() -> None:
+    # Scheduled every minute. The buffer is also flushed after the switch is turned off, until it is empty.
+    if Switch.switch_is_active(SWITCH_POSITION_BUFFER) or get_redis().xlen(POSITION_BUFFER_KEY):
+        nb_positions = flush_position_buffer(max_seconds=POSITION_BUFFER_FLUSH_RUN_SECONDS)
+        logger.info(f'Flushed {nb_positions} buffered positions')
+
+
+@shared_task
+def maintain_partitions() -> None:
+    create_partitions()
+    if settings.PARTITION_RETENTION_DAYS is not None:
+        archive_path = Path(settings.PARTITION_ARCHIVE_PATH) if settings.PARTITION_ARCHIVE_PATH else None
+        detach_partitions(now().date() - timedelta(days=settings.PARTITION_RETENTION_DAYS), archive_path)
+
+
+@shared_task
+def fill_recent_positions() -> None:
+    # Scheduled every minute. Warms the recent positions after they were invalidated or Redis lost its data.
+    if recent_positions_are_complete():
+        return
+    with Lock(redis=get_redis(), name='fill-recent-positions', blocking=False, timeout=300):
+        warm_recent_positions()
+
+
+@shared_task
+def archive_old_tracker_logs() -> None:
+    if settings.TRACKER_LOG_ARCHIVE_PATH and settings.TRACKER_LOG_ARCHIVE_AFTER_DAYS is not None:
+        archive_tracker_logs(now().date() - timedelta(days=settings.TRACKER_LOG_ARCHIVE_AFTER_DAYS))
 
 
 @shared_task
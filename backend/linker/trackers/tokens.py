@@ -0,0 +1,95 @@
+import json
+from collections.abc import Iterable
+from logging import getLogger
+from typing import NamedTuple
+
+from redis import RedisError
+
+from linker.lru import TTLCache
+from linker.people.models import OrganizationMember, Team
+from linker.redis_client import get_redis
+
+from .constants import (
+    TRACKER_TOKEN_CACHE_MAX_KEYS,
+    TRACKER_TOKEN_LOCAL_TTL_SECONDS,
+    TRACKER_TOKEN_NEGATIVE_TTL_SECONDS,
+    TRACKER_TOKEN_REDIS_TTL_SECONDS,
+)
+
+logger = getLogger(__name__)
+
+REDIS_KEY_PREFIX = 'linker:tracker-token:'
+
+
+class TokenOwner(NamedTuple):
+    team_id: int | None
+    organization_member_id: int | None
+    label: str
+
+
+# An unknown token is cached as None, so invalid tokens are rejected without a query as well
+_local_cache: TTLCache[str, TokenOwner | None] = TTLCache(
+    maxsize=TRACKER_TOKEN_CACHE_MAX_KEYS, ttl=TRACKER_TOKEN_LOCAL_TTL_SECONDS
+)
+
+
+def _load_owner(token: str) -> TokenOwner | None:
+    team = Team.objects.filter(tracker_token=token).values_list('id', 'number').first()
+    if team is not None:
+        return TokenOwner(team_id=team[0], organization_member_id=None, label=f'G{team[1]:02d}')
+    member = OrganizationMember.objects.filter(tracker_token=token).values_list('id', 'name').first()
+    if member is not None:
+        return TokenOwner(team_id=None, organization_member_id=member[0], label=member[1])
+    return None
+
+
+def _get_from_redis(token: str) -> tuple[bool, TokenOwner | None]:
+    # Return whether the token was cached, and its owner
+    try:
+        value = get_redis().get(REDIS_KEY_PREFIX + token)
+    except RedisError as e:
+        logger.warning(f'Could not get tracker token from Redis: {e}')
+        return False, None
+    if value is None:
+        return False, None
+    return True, TokenOwner(*json.loads(value)) if value else None
+
+
+def _set_in_redis(token: str, owner: TokenOwner | None) -> None:
+    try:
+        if owner is None:
+            get_redis().set(REDIS_KEY_PREFIX + token, b'', ex=TRACKER_TOKEN_NEGATIVE_TTL_SECONDS)
+        else:
+            get_redis().set(REDIS_KEY_PREFIX + token, json.dumps(owner), ex=TRACKER_TOKEN_REDIS_TTL_SECONDS)
+    except RedisError as e:
+        logger.warning(f'Could not cache tracker token in Redis: {e}')
+
+
+def resolve_tracker_token(token: str) -> TokenOwner | None:
+    """Find the team or organization member a phone tracker token belongs to.
+
+    Looked up in an in-process cache first, then in Redis, and only then in the database. The Redis entries are
+    removed when a team or organization member is saved, the in-process entries expire after a short time.
+    """
+    if token in _local_cache:
+        return _local_cache.get(token)
+
+    cached, owner = _get_from_redis(token)
+    if not cached:
+        owner = _load_owner(token)
+        _set_in_redis(token, owner)
+
+    _local_cache.set(token, owner)
+    return owner
+
+
+def invalidate_tracker_tokens(tokens: Iterable[str | None]) -> None:
+    tokens = [token for token in tokens if token]
+    for token in tokens:
+        _local_cache.pop(token)
+    if not tokens:
+        return
+    try:
+        get_redis().delete(*(REDIS_KEY_PREFIX + token for token in tokens))
+    except RedisError as e:
+        logger.warning(f'Could not invalidate tracker tokens: {e}')
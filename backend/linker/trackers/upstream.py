@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from logging import getLogger
+from time import perf_counter
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .constants import (
+    HTTP_MAX_CONCURRENT_REQUESTS,
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_RETRY_BACKOFF_FACTOR,
+    HTTP_TIMEOUT,
+)
+from .metrics import record
+
+logger = getLogger(__name__)
+
+USER_AGENT = 'https://github.com/Tijs-B/linker'
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+
+
+@dataclass
+class UpstreamRequest:
+    method: str
+    url: str
+    label: str
+    params: dict[str, Any] | None = None
+    json: Any = None
+    auth: tuple[str, ...] | None = None
+    stream: bool = False
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+def _create_session() -> requests.Session:
+    # The geodynamics position endpoint is a read-only query, so POST is safe to retry as well.
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def get_session() -> requests.Session:
+    # Celery forks its pool workers after importing the tasks, so every process creates its own pool.
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = _create_session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def send(upstream_request: UpstreamRequest) -> requests.Response:
+    start = perf_counter()
+    try:
+        response = get_session().request(
+            upstream_request.method,
+            upstream_request.url,
+            params=upstream_request.params,
+            json=upstream_request.json,
+            auth=upstream_request.auth,
+            headers=upstream_request.headers,
+            stream=upstream_request.stream,
+            timeout=HTTP_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        duration_ms = (perf_counter() - start) * 1000
+        logger.warning(f'{upstream_request.label} failed after {duration_ms:.0f} ms: {e}')
+        raise
+    duration_ms = (perf_counter() - start) * 1000
+    logger.info(f'{upstream_request.label} status {response.status_code}, took {duration_ms:.0f} ms')
+    payload_bytes = int(response.headers.get('Content-Length', 0)) if upstream_request.stream else len(response.content)
+    record(fetch_ms=duration_ms, payload_bytes=payload_bytes)
+    return response
+
+
+def send_all(upstream_requests: list[UpstreamRequest]) -> list[requests.Response]:
+    if len(upstream_requests) <= 1:
+        return [send(upstream_request) for upstream_request in upstream_requests]
+
+    max_workers = min(len(upstream_requests), HTTP_MAX_CONCURRENT_REQUESTS)
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run every request in a copy of the current context, so its metrics end up in the current ingestion run
+        contexts = [copy_context() for _ in upstream_requests]
+        responses = list(executor.map(lambda context, r: context.run(send, r), contexts, upstream_requests))
+    logger.info(f'Sent {len(upstream_requests)} upstream requests in {(perf_counter() - start) * 1000:.0f} ms')
+    return responses
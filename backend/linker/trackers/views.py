@@ -1,6 +1,7 @@
 import sqlite3
 from datetime import timedelta
 from pathlib import Path
+from typing import Any
 
 from django.conf import settings
 from django.db.models import BooleanField, Exists, FloatField, OuterRef
@@ -16,11 +17,27 @@ from rest_framework.response import Response
 from rest_framework.serializers import BaseSerializer
 from rest_framework.views import APIView
 
-from linker.people.models import OrganizationMember, Team
-from linker.trackers.constants import TRACKER_OFFLINE_MINUTES, PositionSource
+from linker.config.models import Switch
+from linker.trackers.constants import (
+    SWITCH_FETCH_TRACKERS_API,
+    SWITCH_FETCH_TRACKERS_MINISITE,
+    SWITCH_INGEST_STREAM,
+    TRACKER_OFFLINE_MINUTES,
+    PositionSource,
+)
+from linker.trackers.metrics import ingestion_status, render_prometheus_metrics
 from linker.trackers.models import Position, Tracker, TrackerLog
-from linker.trackers.permissions import CanViewHeatmap, CanViewPositions
-from linker.trackers.serializers import PhoneGpsPositionSerializer, PositionSerializer, TrackerSerializer
+from linker.trackers.permissions import CanScrapeMetrics, CanViewHeatmap, CanViewPositions
+from linker.trackers.phone_ingest import phone_gps_fix, submit_phone_gps_fixes, validate_phone_gps_positions
+from linker.trackers.position_buffer import buffer_position
+from linker.trackers.serializers import (
+    PhoneGpsBufferedPositionSerializer,
+    PhoneGpsPositionBatchSerializer,
+    PhoneGpsPositionSerializer,
+    PositionSerializer,
+    TrackerSerializer,
+)
+from linker.trackers.tokens import resolve_tracker_token
 
 
 class TrackerViewSet(viewsets.ReadOnlyModelViewSet[Tracker]):
@@ -60,6 +77,24 @@ class PositionViewSet(CreateModelMixin, viewsets.GenericViewSet[Position]):
     serializer_class = PositionSerializer
     queryset = Position.objects.all()
 
+    def create(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        team, organization_member = data.get('team'), data.get('organization_member')
+        if buffer_position(
+            team.pk if team is not None else None,
+            organization_member.pk if organization_member is not None else None,
+            data['timestamp'],
+            data['point'],
+            PositionSource.MANUAL,
+        ):
+            # The position is stored by the next flush of the buffer, so it has no id yet
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer: BaseSerializer[Position]) -> None:
         serializer.save(source=PositionSource.MANUAL)
 
@@ -72,23 +107,31 @@ class PhoneGpsPositionView(APIView):
         token = request.query_params.get('token')
         if not token:
             return Response({'detail': 'token required'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            team = Team.objects.get(tracker_token=token)
-            return Response({'label': f'G{team.number:02d}'})
-        except Team.DoesNotExist:
-            pass
-        try:
-            member = OrganizationMember.objects.get(tracker_token=token)
-            return Response({'label': member.name})
-        except OrganizationMember.DoesNotExist:
-            pass
-        return Response({'detail': 'Invalid token.'}, status=status.HTTP_404_NOT_FOUND)
+        owner = resolve_tracker_token(token)
+        if owner is None:
+            return Response({'detail': 'Invalid token.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'label': owner.label})
 
     def post(self, request: Request) -> Response:
         serializer = PhoneGpsPositionSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(status=status.HTTP_201_CREATED)
+        data = serializer.validated_data
+        status_code = submit_phone_gps_fixes(data['team_id'], data['organization_member_id'], [phone_gps_fix(data)])
+        return Response(status=status_code)
+
+
+class PhoneGpsPositionBatchView(APIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def post(self, request: Request) -> Response:
+        serializer = PhoneGpsPositionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        fixes, results = validate_phone_gps_positions(data['positions'], PhoneGpsBufferedPositionSerializer)
+        # Phones retry batches that timed out, positions that were stored before are accepted again
+        status_code = submit_phone_gps_fixes(data['team_id'], data['organization_member_id'], fixes)
+        return Response({'results': results}, status=status_code)
 
 
 class HeatmapTileView(APIView):
@@ -116,3 +159,28 @@ class HeatmapTileView(APIView):
         response = HttpResponse(row[0], content_type='application/x-protobuf')
         response['Content-Encoding'] = 'gzip'
         return response
+
+
+class MetricsView(APIView):
+    permission_classes = (CanScrapeMetrics,)
+
+    def get(self, request: Request) -> HttpResponse:
+        return HttpResponse(render_prometheus_metrics(), content_type='text/plain; version=0.0.4')
+
+
+class ReadinessView(APIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def get(self, request: Request) -> Response:
+        if Switch.switch_is_active(SWITCH_INGEST_STREAM):
+            sources = ['ingest_stream']
+        else:
+            sources = []
+            if Switch.switch_is_active(SWITCH_FETCH_TRACKERS_MINISITE):
+                sources.append('minisite')
+            if Switch.switch_is_active(SWITCH_FETCH_TRACKERS_API):
+                sources.append('geodynamics_api')
+
+        result = ingestion_status(sources)
+        return Response(result, status=status.HTTP_200_OK if result['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -25,7 +25,15 @@ from linker.people.views import (
     UserView,
 )
 from linker.tracing.views import CheckpointLogViewSet, NotificationViewSet, StatsView
-from linker.trackers.views import HeatmapTileView, PhoneGpsPositionView, PositionViewSet, TrackerViewSet
+from linker.trackers.views import (
+    HeatmapTileView,
+    MetricsView,
+    PhoneGpsPositionBatchView,
+    PhoneGpsPositionView,
+    PositionViewSet,
+    ReadinessView,
+    TrackerViewSet,
+)
 
 router = routers.DefaultRouter()
 router.register('teams', TeamViewSet, basename='team')
@@ -53,6 +61,9 @@ urlpatterns = [
     path('api/stats/', StatsView.as_view()),
     path('api/heatmap/tiles/<int:z>/<int:x>/<int:y>.pbf', HeatmapTileView.as_view()),
     path('api/phone-gps/', PhoneGpsPositionView.as_view()),
+    path('api/phone-gps/batch/', PhoneGpsPositionBatchView.as_view()),
+    path('api/metrics/', MetricsView.as_view()),
+    path('api/ready/', ReadinessView.as_view()),
     path('api/login/', csrf_exempt(LoginView.as_view())),
     path('api/token-login/', csrf_exempt(TokenLoginView.as_view())),
     path('api/logout/', LogoutView.as_view()),
@@ -3,6 +3,10 @@ WSGI config for linker project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
 
+Every request passes through the phone GPS ingest middleware first. It answers POSTs to PHONE_GPS_INGEST_PATH
+itself, without the Django middleware: there is no SecurityMiddleware and no ALLOWED_HOSTS validation on that path,
+which is authenticated by the tracker token in the body. Every other request goes to the Django application.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 """
@@ -13,4 +17,8 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'linker.settings')
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+from linker.trackers.phone_ingest import PhoneGpsWSGIMiddleware  # noqa: E402
+
+application = PhoneGpsWSGIMiddleware(django_application)